@@ -1,14 +1,28 @@
 import argparse
 from pathlib import Path
 import importlib
-import base64
-import tempfile
+import functools
 import os
 import time
 import sys
-from urllib.error import URLError
-from sparql import check_database_connection, get_frames_of_video_segment, get_cameras, get_object_containing_frames, get_video, get_annotation_2d_bbox_from_object
-import cv2
+import http.client
+import sparql
+from sparql import check_database_connection, get_frames_of_video_segment, get_cameras, get_object_containing_frames, get_annotation_2d_bbox_from_object
+from sparql_client import SparqlError
+import video_cache
+import query_cache
+import vocabulary
+import trimming
+import images
+import pipeline
+import annotation_dataset
+import shards
+import profiling
+import planning
+import export_manifest
+
+# Images are saved for every FRAME_GAPth frame in which the objects are visible.
+FRAME_GAP = 5
 
 
 def main():
@@ -22,30 +36,67 @@ def main():
     is_segment: bool = args.segment
     output_path: str = args.__getattribute__('output-path')
 
+    sparql.configure(args.endpoint)
+    query_cache.configure(not args.no_cache, args.query_cache_path, args.query_cache_size, args.query_cache_ttl, args.refresh)
+    video_cache.configure(args.video_cache_dir, args.video_cache_size)
+    pipeline.configure(pipeline.parse_jobs(args.jobs))
+    shards.configure(args.shard_size)
+    profiling.configure(args.profile, args.profile_output, args.profile_format)
+    export_manifest.configure(not args.no_resume, args.verify_resume)
+    annotation_dataset.configure(args.annotation_format)
+
     absolute_output_path = str(Path(output_path).resolve())
 
+    wait_for_database()
+
+    vocabulary.configure(args.vocabulary_index, args.vocabulary_index_dir)
+
+    # The segments are shared by all output stages, so they are searched for only once.
+    video_segments = get_frames_of_video_segment(action, main_object, target_object, camera)
+    if args.plan is not None:
+        print_plan(video_segments, main_object, target_object, is_full, is_segment, args.plan)
+        return
+    output(video_segments, action, main_object, target_object, camera, is_full, is_segment, absolute_output_path, args.trim_mode, args.annotation_format, args.output_format)
+    pipeline.wait()
+    shards.close()
+    export_manifest.close()
+    profiling.report()
+
+
+def wait_for_database():
     print("Loading the data from the RDF database...")
 
+    # The SPARQL client has already retried failed requests, so these are the errors left once its retries are used up.
     has_printed_waiting_message = False
     while True:
         try:
             check_database_connection()
             break
-        except (ConnectionRefusedError, URLError):
-            sys.exit("Error: Cannot connect to the RDF database. Please check if the database container is running.")
-        except ConnectionResetError as e:
+        except (ConnectionResetError, http.client.HTTPException):
             if not has_printed_waiting_message:
                 print("The RDF database is loading the data. Please wait for a while...")
                 has_printed_waiting_message = True
             time.sleep(20)
+        except (OSError, SparqlError):
+            sys.exit("Error: Cannot connect to the RDF database. Please check if the database container is running.")
+
 
+def output(video_segments: dict, action: str, main_object: str, target_object: str | None, camera: str | None, is_full: bool, is_segment: bool, absolute_output_path: str, trim_mode: str, annotation_format: str = 'tsv', output_format: str = 'files'):
     if is_segment:
-        output_video_segment(action, main_object, target_object, camera, absolute_output_path)
+        output_video_segment(video_segments, absolute_output_path, trim_mode)
     if is_full:
         output_full_video(action, main_object, target_object, camera, absolute_output_path)
 
-    output_object_containing_image(action, main_object, target_object, camera, absolute_output_path)
-    generate_tsv(action, main_object, target_object, camera, absolute_output_path)
+    if output_format == 'shards':
+        # The annotations of the frames are saved in the shards with them.
+        output_object_containing_image(video_segments, main_object, target_object, absolute_output_path, shards.get_writer(absolute_output_path))
+        return
+
+    output_object_containing_image(video_segments, main_object, target_object, absolute_output_path)
+    if annotation_format == 'parquet':
+        generate_parquet(video_segments, main_object, target_object, absolute_output_path)
+    else:
+        generate_tsv(video_segments, main_object, target_object, absolute_output_path)
 
 
 def get_args():
@@ -61,10 +112,39 @@ def get_args():
     parser.add_argument("-f", "--full", action='store_true', help="The flag to search for videos")
     parser.add_argument("-s", "--segment", action='store_true', help="The flag to search for the segments of the videos")
     parser.add_argument("output-path", type=str, help="The directory to save the search results (can be relative or absolute)")
+    sparql.add_arguments(parser)
+    query_cache.add_arguments(parser)
+    video_cache.add_arguments(parser)
+    vocabulary.add_arguments(parser)
+    trimming.add_arguments(parser)
+    pipeline.add_arguments(parser)
+    annotation_dataset.add_arguments(parser)
+    shards.add_arguments(parser)
+    profiling.add_arguments(parser)
+    export_manifest.add_arguments(parser)
+    planning.add_arguments(parser)
 
     return parser.parse_args()
 
 
+def print_plan(video_segments: dict, main_object: str, target_object: str | None, is_full: bool, is_segment: bool, format: str = 'text'):
+    camera_frame_lists = {camera: {name: video_segments[name] for name in names} for camera, names in group_by_camera(video_segments).items()}
+    plan = planning.get_plan(camera_frame_lists)
+
+    # An image is extracted from the videos for every frame in which the objects are visible, which are
+    # counted with one aggregate query. A saved frame is estimated to take as many bytes as the tiles of a
+    # frame of the knowledge graph.
+    image_count = sparql.count_object_containing_frames(list(video_segments), main_object, target_object)
+    image_bytes = int(image_count * plan['tile_bytes'] / plan['frames']) if plan['frames'] > 0 else 0
+    plan['images'] = image_count
+
+    # The annotations take at most the bbox rows of the segments.
+    downloads = {'videos': plan['video_bytes']}
+    outputs = {'videos': (plan['segment_video_bytes'] if is_segment else 0) + (plan['video_bytes'] if is_full else 0),
+               'images': image_bytes, 'annotations': plan['bbox_rows'] * planning.BBOX_ROW_BYTES}
+    planning.print_plan(plan, downloads, outputs, format)
+
+
 def output_full_video(action: str, main_object: str, target_object: str | None, camera: str | None, absolute_output_path: str):
     output_video = importlib.import_module('mmkg-search').output_video
     camera_list = get_cameras(action, main_object, target_object, camera)
@@ -72,114 +152,193 @@ def output_full_video(action: str, main_object: str, target_object: str | None,
     for camera in camera_list:
         [*activity_name_word_list, scene, camera] = camera.split('_')
         activity = '_'.join(activity_name_word_list)
-        output_video(activity, scene, camera, frame_list,absolute_output_path)
+        pipeline.submit('fetch', output_video, activity, scene, camera, frame_list, absolute_output_path)
 
 
-def output_video_segment(action: str, main_object: str, target_object: str | None, camera: str | None, absolute_output_path: str):
+def output_video_segment(frames: dict, absolute_output_path: str, trim_mode: str):
     output_video = importlib.import_module('mmkg-search').output_video
-    frames = get_frames_of_video_segment(action, main_object, target_object, camera)
-    for video_segment_name in frames.keys():
-        split_video_segment_name = video_segment_name.split('_') # ['clean', 'sink3', '1', 'scene7', 'video', 'segment10']
-        (*activity_name_word_list, camera_number, scene, _, _) = split_video_segment_name
-        activity = '_'.join(activity_name_word_list)
 
-        output_video(activity, scene, "camera" + camera_number, {video_segment_name: frames[video_segment_name]}, absolute_output_path)
+    # Segments of the same camera video are trimmed together, different cameras concurrently.
+    for (activity, scene, camera), video_segment_names in group_by_camera(frames).items():
+        frame_list = {video_segment_name: frames[video_segment_name] for video_segment_name in video_segment_names}
+        pipeline.submit('fetch', output_video, activity, scene, camera, frame_list, absolute_output_path, trim_mode)
 
 
-def output_object_containing_image(action: str, main_object: str, target_object: str | None, camera: str | None, absolute_output_path: str):
-    video_segment_names = get_frames_of_video_segment(action, main_object, target_object, camera).keys()
-    for video_segment_name in video_segment_names:
-        with TemporaryVideoFile(video_segment_name) as tmp_video:
-            if tmp_video is None:
-                continue
-            frame_lists = get_object_containing_frames(video_segment_name, main_object, target_object)
-            for frame_list in frame_lists:
-                output_image_from_video(tmp_video.name, frame_list, absolute_output_path)
-
-
-def output_image_from_video(video_path, frame_list, absolute_output_path):
+def output_object_containing_image(video_segments: dict, main_object: str, target_object: str | None, absolute_output_path: str, writer=None):
     image_directory_path = absolute_output_path + "/images"
-    if not os.path.exists(image_directory_path):
+    if writer is None and not os.path.exists(image_directory_path):
         os.makedirs(image_directory_path)
 
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print("Cannot open video")
-        return
+    # Frames of all segments of the same camera video are extracted in one pass over the video.
+    manifest = export_manifest.get_manifest(absolute_output_path) if writer is None else None
+    for (activity, scene, camera), video_segment_names in group_by_camera(video_segments).items():
+        group = None
+        if manifest is not None:
+            name = "images/" + "_".join([activity, scene, camera])
+            params = {'segments': sorted(video_segment_names), 'main_object': main_object, 'target_object': target_object}
+            # The video of a camera is only downloaded again if some of its images are missing.
+            if manifest.is_group_complete(name, params):
+                print("Images already saved for " + "_".join([activity, scene, camera]))
+                continue
+            group = manifest.group(name, params)
+        camera_video_segments = {video_segment_name: video_segments[video_segment_name] for video_segment_name in video_segment_names}
+        pipeline.submit('fetch', output_camera_image, activity, scene, camera, camera_video_segments, main_object, target_object, image_directory_path, writer, group)
+
 
-    for video_segment_name in frame_list:
-        if video_segment_name == 'all':
-            continue
+def output_camera_image(activity: str, scene: str, camera: str, video_segments: dict, main_object: str, target_object: str | None, image_directory_path: str, writer=None, group=None):
+    video = video_cache.get_video(activity, scene, camera)
+    if video is None:
+        print("No video found")
+        return
 
-        start_frame = frame_count = frame_list[video_segment_name]['start_frame']
-        end_frame = frame_list[video_segment_name]['end_frame']
-        frame_gap = 5
+    # The video stays pinned until the decode task has read the frames from it.
+    try:
+        frame_lists = []
+        for video_segment_name in video_segments:
+            frame_lists.extend(get_object_containing_frames(video_segment_name, main_object, target_object))
+
+        # Samples of shards hold the annotations of their frame, in the same shape as those of mmkg-search.py.
+        bbox_annotations = {}
+        action_annotations = {}
+        if writer is not None:
+            for video_segment_name in video_segments:
+                for annotation in get_annotation_2d_bbox_from_object(main_object, target_object, video_segment_name):
+                    bbox_annotations.setdefault((video_segment_name, int(annotation['frame_number'])), []).append(shards.bbox_metadata(annotation))
+            for annotation in sparql.get_annotation_action_batched(scene, video_segments):
+                action_annotations.setdefault(annotation['segment'], []).append(shards.action_metadata(annotation))
+
+        pipeline.submit('decode', output_image_from_video, activity, scene, camera, video, frame_lists, image_directory_path, writer, bbox_annotations, action_annotations, group)
+    except BaseException:
+        video.close()
+        raise
+
+
+def output_image_from_video(activity, scene, camera, video, frame_lists, image_directory_path, writer=None, bbox_annotations=None, action_annotations=None, group=None):
+    # The pinned video is released once the frames are read from it.
+    with video:
+        targets = {}
+        for video_segment_name, frame_count in get_sampled_frames(frame_lists):
+            frame_name = video_segment_name + "_frame" + str(frame_count).zfill(4)
+            image_path = image_directory_path + "/" + frame_name + ".jpg"
+            if group is not None:
+                if group.manifest.is_file_complete(image_path, {'segment': video_segment_name}):
+                    group.add(image_path, is_saved=True)
+                    continue
+                group.add(image_path)
+                save = functools.partial(images.save_image, image_path,
+                                         on_saved=functools.partial(save_image_done, group, video_segment_name))
+            elif writer is None:
+                save = functools.partial(images.save_image, image_path)
+            else:
+                metadata = {'activity': activity, 'scene': scene, 'camera': camera, 'segment': video_segment_name, 'frame_number': frame_count,
+                            'bboxes': bbox_annotations.get((video_segment_name, frame_count), []), 'actions': action_annotations.get(video_segment_name, [])}
+                save = functools.partial(images.save_sample, writer, frame_name, metadata)
+            targets.setdefault(from_14_5_to_30_fps(frame_count), []).append(save)
+
+        images.extract_frames(video.path, targets)
+        if group is not None:
+            group.close()
+
+
+def get_sampled_frames(frame_lists: list):
+    """Returns the `(video_segment_name, frame_number)` of the frames saved as images: every
+    `FRAME_GAP`th frame of each range in which the objects are visible, in annotation frame numbers.
+    """
+    sampled_frames = []
+    for frame_list in frame_lists:
+        for video_segment_name in frame_list:
+            if video_segment_name == 'all':
+                continue
 
-        cap.set(cv2.CAP_PROP_POS_FRAMES, from_14_5_to_30_fps(start_frame))
-        
-        while True:
-            if frame_count > end_frame:
-                break
-            success, image = cap.read()
-            if not success:
-                break
+            start_frame = frame_list[video_segment_name]['start_frame']
+            end_frame = frame_list[video_segment_name]['end_frame']
+            for frame_count in range(start_frame, end_frame + 1, FRAME_GAP):
+                sampled_frames.append((video_segment_name, frame_count))
+    return sampled_frames
 
-            frame_path = image_directory_path + "/" + video_segment_name + "_frame" + str(frame_count).zfill(4) + ".jpg"
-            cv2.imwrite(frame_path, image)
-            print("Image saved to " + frame_path)
-            
-            frame_count += frame_gap
-            cap.set(cv2.CAP_PROP_POS_FRAMES, from_14_5_to_30_fps(frame_count))
 
-    cap.release()
+def save_image_done(group, video_segment_name, image_path):
+    group.manifest.record_file(image_path, {'segment': video_segment_name})
+    group.done()
 
 
 def from_14_5_to_30_fps(frame_number):
     return int(frame_number / 14.5 * 30)
 
 
-class TemporaryVideoFile:
-    def __init__(self, video_segment_name: str):
-        (*activity_name_word_list, camera_number, scene, _, _) = video_segment_name.split('_')
-        activity = '_'.join(activity_name_word_list)
-
-        results = get_video(activity, scene, "camera" + camera_number)
-
-        bindings = results["results"]["bindings"]
-        if len(bindings) == 0:
-            print("No video found")
-            self.tmp_file = None
-
-        result = bindings[0]
-        video_base64 = result["video"]["value"]
-        video_binary = base64.b64decode(video_base64)
+def get_camera_of_segment(video_segment_name: str):
+    split_video_segment_name = video_segment_name.split('_') # ['clean', 'sink3', '1', 'scene7', 'video', 'segment10']
+    (*activity_name_word_list, camera_number, scene, _, _) = split_video_segment_name
+    activity = '_'.join(activity_name_word_list)
 
-        self.tmp_file = tempfile.NamedTemporaryFile(suffix=".mp4")
-        self.tmp_file.write(video_binary)
+    return activity, scene, "camera" + camera_number
 
-    def __enter__(self):
-        return self.tmp_file
 
-    def __exit__(self, *args):
-        self.tmp_file.close()
+def group_by_camera(video_segment_names):
+    camera_segments = {}
+    for video_segment_name in video_segment_names:
+        camera_segments.setdefault(get_camera_of_segment(video_segment_name), []).append(video_segment_name)
+    return camera_segments
 
 
-def generate_tsv(action: str, main_object: str, target_object: str | None, camera: str | None, absolute_output_path: str):
+def generate_tsv(video_segments: dict, main_object: str, target_object: str | None, absolute_output_path: str):
     annotation_directory = absolute_output_path + "/annotations"
     if not os.path.exists(annotation_directory):
         os.makedirs(annotation_directory)
 
-    video_segment_names = get_frames_of_video_segment(action, main_object, target_object, camera).keys()
-    for video_segment_name in video_segment_names:
-        bbox_annotations = get_annotation_2d_bbox_from_object(main_object, target_object, video_segment_name)
-        if len(bbox_annotations) == 0:
-            continue
-
-        tsv_file_path = annotation_directory + "/" + video_segment_name + ".tsv"
-        with open(tsv_file_path, 'w') as tsv_file:
-            for annotation in bbox_annotations:
-                tsv_file.write("\t".join([annotation['frame_number'], annotation['object'], annotation['2dbbox']]) + "\n")
-        print("2D Bounding Box Annotation saved to " + tsv_file_path)
+    manifest = export_manifest.get_manifest(absolute_output_path)
+    for video_segment_name in video_segments.keys():
+        pipeline.submit('fetch', generate_segment_tsv, video_segment_name, main_object, target_object, annotation_directory, manifest)
+
+
+def generate_segment_tsv(video_segment_name: str, main_object: str, target_object: str | None, annotation_directory: str, manifest=None):
+    tsv_file_path = annotation_directory + "/" + video_segment_name + ".tsv"
+    params = {'main_object': main_object, 'target_object': target_object}
+    if manifest is not None and manifest.is_file_complete(tsv_file_path, params):
+        print("2D Bounding Box Annotation already saved to " + tsv_file_path)
+        return
+
+    bbox_annotations = get_annotation_2d_bbox_from_object(main_object, target_object, video_segment_name)
+    if len(bbox_annotations) == 0:
+        return
+
+    with profiling.span("file.write") as span, open(tsv_file_path, 'w') as tsv_file:
+        for annotation in bbox_annotations:
+            tsv_file.write("\t".join([annotation['frame_number'], annotation['object'], annotation['2dbbox']]) + "\n")
+        span['bytes'] = tsv_file.tell()
+        span['rows'] = len(bbox_annotations)
+    if manifest is not None:
+        manifest.record_file(tsv_file_path, params)
+    print("2D Bounding Box Annotation saved to " + tsv_file_path)
+
+
+def generate_parquet(video_segments: dict, main_object: str, target_object: str | None, absolute_output_path: str):
+    annotation_directory = annotation_dataset.get_directory(absolute_output_path)
+    name = annotation_dataset.get_name(absolute_output_path, "_".join([main_object] + ([target_object] if target_object is not None else [])))
+
+    # The dataset is partitioned by camera, so the segments of a camera are written to one file.
+    manifest = export_manifest.get_manifest(absolute_output_path)
+    for (activity, scene, camera), video_segment_names in group_by_camera(video_segments).items():
+        pipeline.submit('fetch', generate_camera_parquet, activity, scene, camera, video_segment_names, main_object, target_object, annotation_directory, name, manifest)
+
+
+def generate_camera_parquet(activity: str, scene: str, camera: str, video_segment_names: list, main_object: str, target_object: str | None, annotation_directory: str, name: str, manifest=None):
+    file_path = annotation_dataset.bbox_annotations_path(annotation_directory, activity, scene, camera, name)
+    params = {'segments': sorted(video_segment_names), 'main_object': main_object, 'target_object': target_object}
+    if manifest is not None and manifest.is_file_complete(file_path, params):
+        print("2D Bounding Box Annotation already saved to " + file_path)
+        return
+
+    def annotations():
+        for video_segment_name in video_segment_names:
+            for annotation in get_annotation_2d_bbox_from_object(main_object, target_object, video_segment_name):
+                yield {'segment': video_segment_name, **annotation}
+
+    annotation_dataset.write_bbox_annotations(annotation_directory, activity, scene, camera, name, annotations())
+    if manifest is not None:
+        manifest.record_file(file_path, params)
+    print("2D Bounding Box Annotation saved to " + file_path)
+
 
 if __name__ == '__main__':
     main()
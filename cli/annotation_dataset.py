@@ -0,0 +1,148 @@
+import hashlib
+import os
+
+import profiling
+
+ANNOTATION_FORMATS = ['tsv', 'parquet']
+
+# Rows are written to the Parquet files in row groups of this size.
+BATCH_SIZE = 10000
+
+_output_root = None
+
+
+def configure(annotation_format: str = 'tsv', output_root: str | None = None):
+    """Checks that pyarrow is installed if the annotations are saved as Parquet.
+
+    With an `output_root`, e.g. the output path of a batch or of the server, the annotations of all
+    searches saving below it are written to one dataset in its `annotations` directory.
+    """
+    global _output_root
+    if annotation_format == 'parquet':
+        try:
+            import pyarrow
+        except ImportError:
+            raise SystemExit("Error: The parquet annotation format requires pyarrow. Please run `pip install pyarrow`.")
+    _output_root = output_root
+
+
+def add_arguments(parser):
+    parser.add_argument("--annotation-format", type=str, choices=ANNOTATION_FORMATS, default='tsv',
+                        help="How annotations are saved: 'tsv' files, or a 'parquet' dataset partitioned by activity, scene and camera "
+                             "with typed columns, which requires pyarrow (default: tsv)")
+
+
+def get_directory(output_path: str):
+    """Returns the directory of the dataset the annotations of a search saving to an output path are written to."""
+    return (_output_root if _output_root is not None else output_path) + "/annotations"
+
+
+def get_name(output_path: str, name: str):
+    """Returns the name of the files of a search in its partitions, which is unique within a shared dataset."""
+    if _output_root is None or os.path.abspath(output_path) == os.path.abspath(_output_root):
+        return name
+    # Searches saving to different output paths may write the same partitions, so their files are told apart by the path.
+    relative_path = os.path.relpath(os.path.abspath(output_path), os.path.abspath(_output_root))
+    return name + "-" + hashlib.sha1(relative_path.encode()).hexdigest()[:8]
+
+
+def parse_bbox(value: str):
+    """Parses a 2D bbox value "leftX,topY,rightX,bottomY" into its coordinates."""
+    coordinates = value.split(',')
+    try:
+        if len(coordinates) != 4:
+            raise ValueError()
+        return [float(coordinate) for coordinate in coordinates]
+    except ValueError:
+        raise ValueError("Malformed 2D bbox value '" + value + "', expected leftX,topY,rightX,bottomY") from None
+
+
+def write_bbox_annotations(annotation_directory: str, activity: str, scene: str, camera: str, name: str, annotations):
+    """Writes 2D bbox annotations with the keys 'segment', 'frame_number', 'object' and '2dbbox'
+    to the partition of a camera in the `2d_bbox` dataset. Returns the path of the written file.
+    """
+    import pyarrow
+    schema = pyarrow.schema([
+        ('segment', pyarrow.string()),
+        ('frame_number', pyarrow.int32()),
+        ('object', pyarrow.string()),
+        ('left_x', pyarrow.float64()),
+        ('top_y', pyarrow.float64()),
+        ('right_x', pyarrow.float64()),
+        ('bottom_y', pyarrow.float64()),
+    ])
+
+    def rows():
+        for annotation in annotations:
+            left_x, top_y, right_x, bottom_y = parse_bbox(annotation['2dbbox'])
+            yield (annotation['segment'], int(annotation['frame_number']), annotation['object'], left_x, top_y, right_x, bottom_y)
+
+    return write_partition(bbox_annotations_path(annotation_directory, activity, scene, camera, name), schema, rows())
+
+
+def write_action_annotations(annotation_directory: str, activity: str, scene: str, camera: str, name: str, annotations):
+    """Writes action annotations with the keys 'segment', 'action', 'main_object', 'target_object',
+    'start_frame' and 'end_frame' to the partition of a camera in the `action` dataset.
+    """
+    import pyarrow
+    schema = pyarrow.schema([
+        ('segment', pyarrow.string()),
+        ('action', pyarrow.string()),
+        ('main_object', pyarrow.string()),
+        ('target_object', pyarrow.string()),
+        ('start_frame', pyarrow.int32()),
+        ('end_frame', pyarrow.int32()),
+    ])
+
+    def rows():
+        for annotation in annotations:
+            yield (annotation['segment'], annotation['action'].strip(), annotation['main_object'], annotation['target_object'] or None,
+                   annotation['start_frame'], annotation['end_frame'])
+
+    return write_partition(action_annotations_path(annotation_directory, activity, scene, camera, name), schema, rows())
+
+
+def bbox_annotations_path(annotation_directory: str, activity: str, scene: str, camera: str, name: str):
+    return partition_path(annotation_directory + "/2d_bbox", activity, scene, camera, name)
+
+
+def action_annotations_path(annotation_directory: str, activity: str, scene: str, camera: str, name: str):
+    return partition_path(annotation_directory + "/action", activity, scene, camera, name)
+
+
+def partition_path(dataset_directory: str, activity: str, scene: str, camera: str, name: str):
+    # Hive-style directories, so that readers restore activity, scene and camera as columns.
+    return dataset_directory + "/activity=" + activity + "/scene=" + scene + "/camera=" + camera + "/" + name + ".parquet"
+
+
+def write_partition(file_path: str, schema, rows):
+    import pyarrow.parquet
+
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    def write_batch(writer, batch: list):
+        # The rows may still be fetched while writing, so only the conversion and the write are timed.
+        with profiling.span("file.write") as span:
+            table = to_table(schema, batch)
+            writer.write_table(table)
+            span['bytes'] = table.nbytes
+            span['rows'] = len(batch)
+
+    with pyarrow.parquet.ParquetWriter(file_path, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                write_batch(writer, batch)
+                batch = []
+        if len(batch) > 0:
+            write_batch(writer, batch)
+
+    return file_path
+
+
+def to_table(schema, batch: list):
+    import pyarrow
+    columns = list(zip(*batch))
+    return pyarrow.Table.from_arrays([pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema)
+
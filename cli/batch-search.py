@@ -0,0 +1,249 @@
+import argparse
+from pathlib import Path
+import collections
+from concurrent.futures import Future
+import csv
+import importlib
+import json
+import sys
+import threading
+import time
+import sparql
+from sparql import get_frames_of_video_segment
+import video_cache
+import query_cache
+import vocabulary
+import segment_index
+import trimming
+import pipeline
+import annotation_dataset
+import shards
+import profiling
+import export_manifest
+
+mmkg_search = importlib.import_module('mmkg-search')
+action_object_search = importlib.import_module('action-object-search')
+
+MMKG_FIELDS = ['activity', 'scene', 'camera', 'action', 'object', 'start', 'end', 'visibility_runs']
+ACTION_OBJECT_FIELDS = ['action', 'main_object', 'target_object', 'camera', 'full', 'segment']
+# The number of segment searches whose results are kept for the following entries or requests.
+MAX_SEARCHES = 256
+
+
+def main():
+    args = get_args()
+
+    sparql.configure(args.endpoint)
+    query_cache.configure(not args.no_cache, args.query_cache_path, args.query_cache_size, args.query_cache_ttl, args.refresh)
+    video_cache.configure(args.video_cache_dir, args.video_cache_size)
+    pipeline.configure(pipeline.parse_jobs(args.jobs))
+    shards.configure(args.shard_size)
+    profiling.configure(args.profile, args.profile_output, args.profile_format)
+    export_manifest.configure(not args.no_resume, args.verify_resume)
+
+    absolute_output_path = str(Path(args.output_path).resolve())
+    # The annotations of all entries are saved in one dataset in the output path of the batch.
+    annotation_dataset.configure(args.annotation_format, absolute_output_path)
+    report_path = args.report or absolute_output_path + "/batch_report.jsonl"
+    entries = read_manifest(args.manifest)
+
+    # The database is probed and the vocabulary and segment indexes are loaded once for all entries.
+    action_object_search.wait_for_database()
+    vocabulary.configure(args.vocabulary_index, args.vocabulary_index_dir)
+    segment_index.configure(args.segment_index, args.segment_index_dir)
+
+    searches = Searches()
+    frame_lists = get_frame_lists(entries)
+    jobs = []
+    for line_number, entry in entries:
+        started_at = time.monotonic()
+        with pipeline.job() as job:
+            try:
+                frame_list = frame_lists.get(line_number)
+                if isinstance(frame_list, Exception):
+                    raise frame_list
+                kind = search(searches, entry, absolute_output_path, args.trim_mode, args.max_frames_in_flight, args.annotation_format, args.output_format, frame_list)
+                jobs.append((line_number, kind, started_at, time.monotonic(), job, None))
+            except Exception as e:
+                jobs.append((line_number, entry_kind(entry), started_at, time.monotonic(), job, e))
+
+    Path(report_path).parent.mkdir(parents=True, exist_ok=True)
+    failed = 0
+    with open(report_path, "w") as report_file:
+        for line_number, kind, started_at, searched_at, job, error in jobs:
+            errors = job.wait()
+            if error is not None:
+                errors.insert(0, error)
+
+            status = {'line': line_number, 'kind': kind, 'status': 'ok' if len(errors) == 0 else 'failed'}
+            if len(errors) > 0:
+                failed += 1
+                status['error'] = repr(errors[0])
+                print("ERROR: The search on line " + str(line_number) + " of the manifest failed: " + repr(errors[0]))
+            status['seconds'] = round(max(job.finished_at or 0, searched_at) - started_at, 3)
+            report_file.write(json.dumps(status) + "\n")
+    shards.close()
+    export_manifest.close()
+    profiling.report()
+
+    print(str(len(jobs) - failed) + " of " + str(len(jobs)) + " searches succeeded. Report saved to " + report_path)
+    if failed > 0:
+        sys.exit(1)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        prog='batch_search',
+        description='Run the searches listed in a manifest in one process, sharing videos and segments between them'
+    )
+
+    parser.add_argument("manifest", type=str, help="A JSONL or CSV file with one search per line or row. "
+                                                   "Searches by activities have the fields " + ", ".join(MMKG_FIELDS) + ", "
+                                                   "searches by actions the fields " + ", ".join(ACTION_OBJECT_FIELDS) + "; "
+                                                   "an optional output_path field is relative to the output path of the batch")
+    parser.add_argument("output_path", type=str, help="The directory to save the search results (can be relative or absolute)")
+    parser.add_argument("--report", type=str, help="The path of the JSONL status report (default: OUTPUT_PATH/batch_report.jsonl)")
+    parser.add_argument('--max-frames-in-flight', type=int, default=sparql.MAX_FRAMES_IN_FLIGHT, help='The maximum number of images held in memory while exporting')
+    sparql.add_arguments(parser)
+    query_cache.add_arguments(parser)
+    video_cache.add_arguments(parser)
+    vocabulary.add_arguments(parser)
+    segment_index.add_arguments(parser)
+    trimming.add_arguments(parser)
+    pipeline.add_arguments(parser)
+    annotation_dataset.add_arguments(parser)
+    shards.add_arguments(parser)
+    profiling.add_arguments(parser)
+    export_manifest.add_arguments(parser)
+
+    return parser.parse_args()
+
+
+def read_manifest(manifest_path: str):
+    entries = []
+    with open(manifest_path, newline='') as file:
+        if manifest_path.endswith(".csv"):
+            # The header is the first line, so rows start on the second one.
+            for line_number, row in enumerate(csv.DictReader(file), start=2):
+                entries.append((line_number, {key: value for key, value in row.items() if value not in (None, '')}))
+        else:
+            for line_number, line in enumerate(file, start=1):
+                if line.strip() == '':
+                    continue
+                entries.append((line_number, {key: value for key, value in json.loads(line).items() if value not in (None, '')}))
+    return entries
+
+
+def entry_kind(entry: dict):
+    if 'activity' in entry:
+        return 'mmkg'
+    if 'main_object' in entry:
+        return 'action-object'
+    return 'unknown'
+
+
+def get_frame_lists(entries: list):
+    """Resolves the frame ranges of the searches for whole camera videos, e.g. the windows of a sliding
+    window, with one lookup of the segments per camera for all of them.
+
+    Returns the frame list of each of these searches by line number, or the error of its lookup.
+    """
+    camera_ranges = {}
+    for line_number, entry in entries:
+        if entry_kind(entry) != 'mmkg' or entry.get('action') is not None or entry.get('object') is not None:
+            continue
+        try:
+            camera_ranges.setdefault((entry['activity'], entry['scene'], entry['camera']), []).append((line_number, (to_int(entry.get('start')), to_int(entry.get('end')))))
+        except (KeyError, ValueError):
+            # Malformed entries are reported when they are searched for.
+            continue
+
+    frame_lists = {}
+    for (activity, scene, camera), ranges in camera_ranges.items():
+        try:
+            camera_frame_lists = segment_index.get_frame_lists(activity, scene, camera, [frame_range for _, frame_range in ranges])
+        except Exception as e:
+            camera_frame_lists = [e] * len(ranges)
+        frame_lists.update(zip([line_number for line_number, _ in ranges], camera_frame_lists))
+    return frame_lists
+
+
+def search(searches, entry: dict, absolute_output_path: str, trim_mode: str, max_frames_in_flight: int, annotation_format: str = 'tsv', output_format: str = 'files', frame_list=None):
+    """Searches for one manifest entry and submits its outputs to the pipeline.
+
+    The frame list of a search for a whole camera video may be given if it was resolved in advance.
+    """
+    kind = entry_kind(entry)
+    output_path = str(Path(absolute_output_path, entry.get('output_path', '.')).resolve())
+
+    if kind == 'mmkg':
+        activity, scene, camera = entry['activity'], entry['scene'], entry['camera']
+        action, object = entry.get('action'), entry.get('object')
+        start_frame, end_frame = to_int(entry.get('start')), to_int(entry.get('end'))
+        if frame_list is None:
+            segments = searches.get_segments(activity, scene, camera, action, object, to_int(entry.get('visibility_runs')))
+            frame_list = mmkg_search.clip_frames(segments, start_frame, end_frame, action is None and object is None)
+        mmkg_search.output(activity, scene, camera, frame_list, mmkg_search.get_output_path(output_path, activity, scene, camera), trim_mode, max_frames_in_flight, annotation_format, output_format)
+    elif kind == 'action-object':
+        action, main_object, target_object, camera = entry['action'], entry['main_object'], entry.get('target_object'), entry.get('camera')
+        video_segments = searches.get_video_segments(action, main_object, target_object, camera)
+        action_object_search.output(video_segments, action, main_object, target_object, camera, to_bool(entry.get('full')), to_bool(entry.get('segment')), output_path, trim_mode, annotation_format, output_format)
+    else:
+        raise ValueError("Cannot tell the kind of search, expected an activity or a main_object field")
+
+    return kind
+
+
+class Searches:
+    """Segment searches shared by the entries of a batch, so that each is sent to the database only once.
+
+    Each search runs outside the lock, so different searches run concurrently and the same search
+    waits for the one in flight. Only the `max_size` most recently used results are kept.
+    """
+
+    def __init__(self, max_size: int = MAX_SEARCHES):
+        self.results = collections.OrderedDict()
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    def get_segments(self, activity, scene, camera, action, object, visibility_gap=None):
+        return self.get(('mmkg', activity, scene, camera, action, object, visibility_gap), mmkg_search.get_segments, activity, scene, camera, action, object, visibility_gap)
+
+    def get_video_segments(self, action, main_object, target_object, camera):
+        return self.get(('action-object', action, main_object, target_object, camera), get_frames_of_video_segment, action, main_object, target_object, camera)
+
+    def get(self, key, function, *args):
+        with self.lock:
+            future = self.results.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self.results[key] = Future()
+                while len(self.results) > self.max_size:
+                    self.results.popitem(last=False)
+            else:
+                self.results.move_to_end(key)
+
+        if is_owner:
+            try:
+                future.set_result(function(*args))
+            except Exception as e:
+                # A failed search is not kept, so that it is tried again.
+                with self.lock:
+                    if self.results.get(key) is future:
+                        del self.results[key]
+                future.set_exception(e)
+        return future.result()
+
+
+def to_int(value):
+    return None if value is None else int(value)
+
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    return value is not None and str(value).lower() in ('1', 'true', 'yes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+import argparse
+import local_store
+
+
+def main():
+    args = get_args()
+    local_store.compile_store(args.rdf_path, args.store_path)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        prog='build_local_store',
+        description='Compile the .ttl files of VHAKG into a local store, which the search tools can use with --endpoint instead of the RDF database'
+    )
+
+    parser.add_argument("rdf_path", type=str, help="The directory of the .ttl files (e.g. ../RDF)")
+    parser.add_argument("store_path", type=str, help="The path of the local store to build (e.g. vhakg.sqlite3)")
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
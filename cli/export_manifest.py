@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import threading
+
+MANIFEST_NAME = "export_manifest.jsonl"
+
+
+def add_arguments(parser):
+    parser.add_argument("--no-resume", action='store_true',
+                        help="Redo all work instead of skipping the videos, images and annotation files recorded as complete in " + MANIFEST_NAME + " of the output directory")
+    parser.add_argument("--verify-resume", action='store_true',
+                        help="Only skip recorded files whose SHA-256 checksum is unchanged, instead of those whose size is unchanged")
+
+
+class ExportManifest:
+    """Records the artifacts of an output directory once they are complete, so that an interrupted or
+    repeated export only produces what is missing.
+
+    Each line of `export_manifest.jsonl` records an artifact by its path relative to the directory,
+    with the parameters it was produced from and, for files, their size and SHA-256 checksum. An
+    artifact is complete if it was recorded with the same parameters and its file still has the
+    recorded size, and with `verify`, the recorded checksum. Groups of files, e.g. the images of a
+    segment, are recorded with the names of their files once all of them are complete.
+    """
+
+    def __init__(self, directory: str, resume: bool = True, verify: bool = False):
+        self.directory = directory
+        self.resume = resume
+        self.verify = verify
+        self.lock = threading.Lock()
+        self.entries = {}
+        path = os.path.join(directory, MANIFEST_NAME)
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line is cut off if the export was killed while recording it.
+                        continue
+                    self.entries[entry['name']] = entry
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "a")
+
+    def name(self, path: str):
+        return os.path.relpath(os.path.abspath(path), self.directory)
+
+    def is_complete(self, name: str, params: dict):
+        entry = self.entries.get(name)
+        return self.resume and entry is not None and entry['params'] == params
+
+    def is_file_complete(self, path: str, params: dict):
+        if not self.is_complete(self.name(path), params):
+            return False
+        return self.is_saved(self.name(path))
+
+    def is_group_complete(self, name: str, params: dict):
+        if not self.is_complete(name, params):
+            return False
+        return all(self.is_saved(file_name) for file_name in self.entries[name]['files'])
+
+    def is_saved(self, name: str):
+        entry = self.entries.get(name)
+        path = os.path.join(self.directory, name)
+        if entry is None or not os.path.exists(path) or os.path.getsize(path) != entry['size']:
+            return False
+        # A file cut off or corrupted in place may still have the recorded size.
+        return not self.verify or file_digest(path) == entry['sha256']
+
+    def record(self, name: str, params: dict, **fields):
+        entry = {'name': name, 'params': params, **fields}
+        # Parameters are compared with the ones read back from the file, so they are normalized the same way.
+        entry = json.loads(json.dumps(entry))
+        with self.lock:
+            self.entries[name] = entry
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+
+    def record_file(self, path: str, params: dict):
+        self.record(self.name(path), params, size=os.path.getsize(path), sha256=file_digest(path))
+
+    def group(self, name: str, params: dict):
+        return Group(self, name, params)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class Group:
+    """Counts the files of a group still being saved, and records the group once all of them are.
+
+    Every file is registered with `add()`, before it is handed on or with `is_saved=True` if it was
+    saved earlier, and reported with `done()` once it is saved; `close()` is called after the last
+    one has been handed on. A group with a failed file is never recorded.
+    """
+
+    def __init__(self, manifest: ExportManifest, name: str, params: dict):
+        self.manifest = manifest
+        self.name = name
+        self.params = params
+        self.lock = threading.Lock()
+        self.pending = 1
+        self.files = []
+
+    def add(self, path: str, is_saved: bool = False):
+        with self.lock:
+            self.files.append(self.manifest.name(path))
+            if not is_saved:
+                self.pending += 1
+
+    def done(self, *args):
+        with self.lock:
+            self.pending -= 1
+            is_complete = self.pending == 0
+        if is_complete:
+            self.manifest.record(self.name, self.params, files=self.files)
+
+    def close(self):
+        self.done()
+
+
+def file_digest(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_recorded_files(output_path: str):
+    """Returns the paths of the files recorded in the export manifests of an output path and the paths
+    under it, which include files saved outside of it, e.g. to a shared annotation dataset.
+    """
+    paths = []
+    for directory, _, names in os.walk(output_path):
+        if MANIFEST_NAME not in names:
+            continue
+        with open(os.path.join(directory, MANIFEST_NAME)) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                path = os.path.normpath(os.path.join(directory, entry['name']))
+                if 'size' in entry and os.path.exists(path):
+                    paths.append(path)
+    return list(dict.fromkeys(paths))
+
+
+def is_output_file(path: str):
+    """Tells whether a file is an output, rather than the export manifest recording the outputs."""
+    return os.path.basename(path) != MANIFEST_NAME
+
+
+_manifests = {}
+_lock = threading.Lock()
+_resume = True
+_verify = False
+
+
+def configure(resume: bool = True, verify: bool = False):
+    global _resume, _verify
+    _resume = resume
+    _verify = verify
+
+
+def get_manifest(output_path: str):
+    """Returns the export manifest of an output path, which is shared by all searches saving there."""
+    directory = os.path.abspath(output_path)
+    with _lock:
+        if directory not in _manifests:
+            _manifests[directory] = ExportManifest(directory, _resume, _verify)
+        return _manifests[directory]
+
+
+def close(output_path: str | None = None):
+    """Closes the export manifests of an output path and the paths under it, or all of them."""
+    with _lock:
+        for directory in list(_manifests):
+            if output_path is None or directory == os.path.abspath(output_path) or directory.startswith(os.path.abspath(output_path) + os.sep):
+                _manifests.pop(directory).close()
@@ -0,0 +1,159 @@
+import base64
+import json
+import os
+
+import cv2
+import numpy
+
+import pipeline
+import profiling
+
+
+def decode_tile(base64_data: str):
+    with profiling.span("base64.decode") as span:
+        img_raw = numpy.frombuffer(base64.b64decode(base64_data), numpy.uint8)
+        span['bytes'] = len(img_raw)
+    with profiling.span("image.decode") as span:
+        image = cv2.imdecode(img_raw, cv2.IMREAD_UNCHANGED)
+        span['bytes'] = len(img_raw)
+    return image
+
+
+def assemble_frame(tiles: list, split_width: int):
+    """Places the tiles of a split image, ordered by their split image ID, into one frame buffer.
+
+    Each row holds `split_width` tiles. The buffer is sized from the tile shapes, so the last
+    row and column may be narrower than the others, as with `cv2.hconcat`/`cv2.vconcat`.
+    """
+    rows = [tiles[i:i+split_width] for i in range(0, len(tiles), split_width)]
+    row_heights = [row[0].shape[0] for row in rows]
+    column_widths = [tile.shape[1] for tile in rows[0]]
+
+    frame = numpy.zeros((sum(row_heights), sum(column_widths)) + tiles[0].shape[2:], dtype=tiles[0].dtype)
+    y = 0
+    for row, row_height in zip(rows, row_heights):
+        x = 0
+        for tile in row:
+            frame[y:y+row_height, x:x+tile.shape[1]] = tile
+            x += tile.shape[1]
+        y += row_height
+
+    return frame
+
+
+def complete_frame(pending_frame: dict):
+    tiles = pending_frame['tiles']
+    image = assemble_frame([tiles[image_id].result() for image_id in sorted(tiles)], pending_frame['split_width'])
+    return pending_frame['descriptor'], pending_frame['frame_number'], pending_frame['split_width'], image
+
+
+def extract_frames(video_path: str, targets: dict):
+    """Hands the frames of a video whose indices are the keys of `targets` to the functions listed for them.
+
+    The video is decoded once from the first target on: frames in between are skipped with
+    `grab()` and only the targets are retrieved. The functions should hand the frames on to the
+    encode stage of the pipeline, like `save_image`.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print("Cannot open video")
+        return
+
+    # The capture is released even if a frame cannot be handed on, e.g. when the pipeline rejects it.
+    try:
+        frame_indices = sorted(targets)
+        if len(frame_indices) > 0 and frame_indices[0] > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_indices[0])
+        position = frame_indices[0] if len(frame_indices) > 0 else 0
+
+        for frame_index in frame_indices:
+            with profiling.span("video.decode") as span:
+                while position < frame_index and cap.grab():
+                    position += 1
+                if position < frame_index or not cap.grab():
+                    break
+                position += 1
+                success, image = cap.retrieve()
+                if not success:
+                    break
+                span['bytes'] = image.nbytes
+
+            for save in targets[frame_index]:
+                save(image)
+    finally:
+        cap.release()
+
+
+def save_image(image_path: str, image, on_saved=None, release=None):
+    """Encodes and writes an image in the pipeline; `on_saved(image_path)` is called once it is written.
+
+    `release()` is called once the image is written or cannot be, e.g. to free its slot of the frames in flight.
+    """
+    return submit('encode', release, encode_image, image_path, image, on_saved, release)
+
+
+def encode_image(image_path: str, image, on_saved=None, release=None):
+    try:
+        with profiling.span("image.encode") as span:
+            success, buffer = cv2.imencode(os.path.splitext(image_path)[1], image)
+            span['bytes'] = len(buffer)
+        if not success:
+            raise ValueError("Cannot encode " + image_path)
+    except BaseException:
+        if release is not None:
+            release()
+        raise
+    submit('write', release, write_image, image_path, buffer, on_saved, release)
+
+
+def write_image(image_path: str, buffer, on_saved=None, release=None):
+    try:
+        with profiling.span("file.write") as span, open(image_path, "wb") as file:
+            file.write(buffer)
+            span['bytes'] = len(buffer)
+        print("Image saved to " + image_path)
+        if on_saved is not None:
+            on_saved(image_path)
+    finally:
+        if release is not None:
+            release()
+
+
+def save_sample(writer, key: str, metadata: dict, image, release=None):
+    """Adds a frame and its metadata to a shard writer as `<key>.jpg` and `<key>.json`.
+
+    `release()` is called once the sample is written or cannot be, like for `save_image`.
+    """
+    return submit('encode', release, encode_sample, writer, key, metadata, image, release)
+
+
+def encode_sample(writer, key: str, metadata: dict, image, release=None):
+    try:
+        with profiling.span("image.encode") as span:
+            success, buffer = cv2.imencode(".jpg", image)
+            span['bytes'] = len(buffer)
+        if not success:
+            raise ValueError("Cannot encode " + key)
+    except BaseException:
+        if release is not None:
+            release()
+        raise
+    submit('write', release, write_sample, writer, key, {'jpg': buffer.tobytes(), 'json': json.dumps(metadata).encode()}, release)
+
+
+def write_sample(writer, key: str, files: dict, release=None):
+    try:
+        writer.add(key, files)
+    finally:
+        if release is not None:
+            release()
+
+
+def submit(stage: str, release, function, *args):
+    """Submits a task that hands a frame on, calling `release()` if it cannot be submitted."""
+    try:
+        return pipeline.submit(stage, function, *args)
+    except BaseException:
+        if release is not None:
+            release()
+        raise
@@ -0,0 +1,246 @@
+import glob
+import hashlib
+import os
+import sqlite3
+import threading
+
+from rdflib import BNode, Graph, Literal, URIRef
+from rdflib.plugins.sparql import prepareQuery
+from rdflib.store import Store
+
+import profiling
+
+# Kinds of RDF terms in the term table.
+IRI = 0
+BLANK_NODE = 1
+LITERAL = 2
+
+TERM_ID_CACHE_SIZE = 1000000
+
+
+def term_key(kind: int, value: str, datatype: str | None, language: str | None):
+    # Literals may hold whole base64 videos, so terms are looked up by a digest instead of their value.
+    return hashlib.sha1("\x00".join([str(kind), value, datatype or "", language or ""]).encode()).digest()
+
+
+class SQLiteStore(Store):
+    """Read-optimized rdflib store of a single graph in an SQLite file.
+
+    Terms are stored once in a dictionary table, and triples as term IDs with an index for each
+    access pattern of the SPARQL engine. The store is written once by `compile_store`.
+    """
+
+    context_aware = False
+    formula_aware = False
+    transaction_aware = False
+    graph_aware = False
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.local = threading.local()
+        self.term_ids = {}
+
+    def connection(self):
+        # SQLite connections cannot be shared between threads.
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            self.local.connection = connection
+        return connection
+
+    def create_tables(self):
+        connection = self.connection()
+        connection.executescript("""
+CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, key BLOB NOT NULL UNIQUE, kind INTEGER NOT NULL, value TEXT NOT NULL, datatype TEXT, language TEXT);
+CREATE TABLE IF NOT EXISTS triples (s INTEGER NOT NULL, p INTEGER NOT NULL, o INTEGER NOT NULL, PRIMARY KEY (s, p, o)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+""")
+
+    def create_indexes(self):
+        connection = self.connection()
+        connection.executescript("""
+CREATE INDEX IF NOT EXISTS triples_pos ON triples (p, o, s);
+CREATE INDEX IF NOT EXISTS triples_osp ON triples (o, s, p);
+""")
+        connection.execute("INSERT OR REPLACE INTO metadata (name, value) VALUES ('size', ?)", (str(len(self)),))
+        connection.commit()
+
+    def encode(self, term):
+        if isinstance(term, Literal):
+            return LITERAL, str(term), str(term.datatype) if term.datatype is not None else None, term.language
+        if isinstance(term, BNode):
+            return BLANK_NODE, str(term), None, None
+        return IRI, str(term), None, None
+
+    def decode(self, kind: int, value: str, datatype: str | None, language: str | None):
+        if kind == LITERAL:
+            return Literal(value, datatype=URIRef(datatype) if datatype is not None else None, lang=language)
+        if kind == BLANK_NODE:
+            return BNode(value)
+        return URIRef(value)
+
+    def term_id(self, term, create: bool = False):
+        key = term_key(*self.encode(term))
+        term_id = self.term_ids.get(key)
+        if term_id is not None:
+            return term_id
+
+        connection = self.connection()
+        row = connection.execute("SELECT id FROM terms WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            term_id = row[0]
+        elif create:
+            term_id = connection.execute("INSERT INTO terms (key, kind, value, datatype, language) VALUES (?, ?, ?, ?, ?)", (key, *self.encode(term))).lastrowid
+        else:
+            return None
+
+        # Large literals are only looked up while compiling, so only IRIs and blank nodes are kept.
+        if not isinstance(term, Literal):
+            if len(self.term_ids) >= TERM_ID_CACHE_SIZE:
+                self.term_ids.clear()
+            self.term_ids[key] = term_id
+        return term_id
+
+    def add(self, triple, context=None, quoted=False):
+        ids = [self.term_id(term, create=True) for term in triple]
+        self.connection().execute("INSERT OR IGNORE INTO triples (s, p, o) VALUES (?, ?, ?)", ids)
+
+    def triples(self, triple_pattern, context=None):
+        conditions = []
+        parameters = []
+        for column, term in zip(("s", "p", "o"), triple_pattern):
+            if term is None:
+                continue
+            term_id = self.term_id(term)
+            if term_id is None:
+                return
+            conditions.append("t." + column + " = ?")
+            parameters.append(term_id)
+
+        query = """SELECT s.kind, s.value, s.datatype, s.language, p.kind, p.value, p.datatype, p.language, o.kind, o.value, o.datatype, o.language
+FROM triples t JOIN terms s ON s.id = t.s JOIN terms p ON p.id = t.p JOIN terms o ON o.id = t.o"""
+        if len(conditions) > 0:
+            query += " WHERE " + " AND ".join(conditions)
+
+        for row in self.connection().execute(query, parameters):
+            yield (self.decode(*row[0:4]), self.decode(*row[4:8]), self.decode(*row[8:12])), iter(())
+
+    def __len__(self, context=None):
+        return self.connection().execute("SELECT COUNT(*) FROM triples").fetchone()[0]
+
+    def size(self):
+        row = self.connection().execute("SELECT value FROM metadata WHERE name = 'size'").fetchone()
+        return row[0] if row is not None else str(len(self))
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    def bind(self, prefix, namespace, override=True):
+        pass
+
+    def namespace(self, prefix):
+        return None
+
+    def prefix(self, namespace):
+        return None
+
+    def namespaces(self):
+        return iter(())
+
+
+class LocalStoreClient:
+    """Runs SPARQL queries against a local store with the interface of `SparqlClient`."""
+
+    def __init__(self, path: str):
+        if not os.path.exists(path):
+            raise FileNotFoundError("The local store " + path + " does not exist, build it with build-local-store.py")
+        self.endpoint = "file://" + os.path.abspath(path)
+        self.store = SQLiteStore(path)
+        self.graph = Graph(store=self.store)
+        self.parse_lock = threading.Lock()
+
+    def close(self):
+        pass
+
+    def query(self, query: str):
+        # The SPARQL parser of rdflib is not thread-safe, the evaluation is.
+        with self.parse_lock:
+            prepared_query = prepareQuery(query)
+        return self.graph.query(prepared_query)
+
+    def select(self, query: str):
+        with profiling.span("sparql.query") as span:
+            result = self.query(query)
+            variables = [str(variable) for variable in result.vars]
+            bindings = list(self.rows(result, variables))
+            span['rows'] = len(bindings)
+        return {'head': {'vars': variables}, 'results': {'bindings': bindings}}
+
+    def select_stream(self, query: str):
+        from sparql_client import binding_size
+
+        return profiling.iterate("sparql.query", self.stream_rows(query), binding_size)
+
+    def stream_rows(self, query: str):
+        result = self.query(query)
+        yield from self.rows(result, [str(variable) for variable in result.vars])
+
+    def select_value_stream(self, query: str, chunk_size: int | None = None):
+        from sparql_client import STREAM_CHUNK_SIZE
+
+        return profiling.iterate("sparql.query", self.stream_value(query, chunk_size or STREAM_CHUNK_SIZE), len)
+
+    def stream_value(self, query: str, chunk_size: int):
+        # The store holds the literal as one value, which is only handed out in chunks like by `SparqlClient`.
+        for row in self.query(query):
+            if row[0] is None:
+                return
+            value = str(row[0])
+            for i in range(0, len(value), chunk_size):
+                yield value[i:i+chunk_size]
+            return
+
+    def rows(self, result, variables: list):
+        for row in result:
+            yield {variable: {'value': str(row[variable])} for variable in variables if row[variable] is not None}
+
+    def ask(self, query: str):
+        with profiling.span("sparql.query"):
+            return self.query(query).askAnswer
+
+    def get(self, path: str):
+        from sparql_client import SparqlError
+
+        if path != "/size":
+            raise SparqlError("The local store has no resource " + path)
+        return self.store.size().encode()
+
+
+def compile_store(rdf_directory: str, path: str):
+    """Compiles the .ttl files of a directory into a local store at `path`."""
+    paths = sorted(glob.glob(os.path.join(rdf_directory, "**", "*.ttl"), recursive=True))
+    if len(paths) == 0:
+        raise FileNotFoundError("No .ttl files found in " + rdf_directory)
+
+    # Build next to the final location and rename, so a half-built store is never used.
+    tmp_path = path + ".part"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    store = SQLiteStore(tmp_path)
+    store.create_tables()
+    connection = store.connection()
+    connection.execute("PRAGMA journal_mode=OFF")
+    connection.execute("PRAGMA synchronous=OFF")
+    graph = Graph(store=store)
+
+    for i, ttl_path in enumerate(paths):
+        print("Compiling " + ttl_path + " (" + str(i + 1) + "/" + str(len(paths)) + ")...")
+        graph.parse(ttl_path, format="turtle")
+        connection.commit()
+
+    print("Indexing...")
+    store.create_indexes()
+    connection.close()
+    os.replace(tmp_path, path)
+    print("Local store saved to " + path)
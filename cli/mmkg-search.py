@@ -1,201 +1,474 @@
 def main():
-    import os
+    import annotation_dataset
+    import export_manifest
+    import pipeline
+    import profiling
+    import query_cache
+    import segment_index
+    import shards
+    import sparql
+    import video_cache
 
     args = parse_args()
+    sparql.configure(args.endpoint)
+    query_cache.configure(not args.no_cache, args.query_cache_path, args.query_cache_size, args.query_cache_ttl, args.refresh)
+    video_cache.configure(args.video_cache_dir, args.video_cache_size)
+    pipeline.configure(pipeline.parse_jobs(args.jobs))
+    shards.configure(args.shard_size)
+    profiling.configure(args.profile, args.profile_output, args.profile_format)
+    export_manifest.configure(not args.no_resume, args.verify_resume)
+    annotation_dataset.configure(args.annotation_format)
+    segment_index.configure(args.segment_index, args.segment_index_dir)
+
+    cameras = get_cameras(args.activity, args.scene, args.camera)
+    if cameras is None:
+        frame_lists = {args.camera: get_frames(args.activity, args.scene, args.camera, args.start, args.end, args.action, args.object, args.visibility_runs)}
+    else:
+        frame_lists = get_camera_frames(args.activity, args.scene, cameras, args.start, args.end, args.action, args.object, args.visibility_runs)
 
-    output_path = args.output_path + "/" + args.activity + "_" + args.scene + "_" + args.camera
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
+    if args.plan is not None:
+        print_plan(args.activity, args.scene, frame_lists, args.plan)
+        return
 
-    frame_list = get_frames(args.activity, args.scene, args.camera, args.start, args.end, args.action, args.object)
-    output_video(args.activity, args.scene, args.camera, frame_list, output_path)
-    output_image(frame_list, output_path)
-    output_annotation(args.activity, args.scene, args.camera, frame_list, output_path)
+    if cameras is None:
+        output_path = get_output_path(args.output_path, args.activity, args.scene, args.camera)
+        output(args.activity, args.scene, args.camera, frame_lists[args.camera], output_path, args.trim_mode, args.max_frames_in_flight, args.annotation_format, args.output_format)
+        pipeline.wait()
+    else:
+        bundle_path = get_output_path(args.output_path, args.activity, args.scene)
+        # The videos of the cameras are fetched and trimmed concurrently by the pipeline.
+        for camera, frame_list in frame_lists.items():
+            output(args.activity, args.scene, camera, frame_list, bundle_path + "/" + camera, args.trim_mode, args.max_frames_in_flight, args.annotation_format, args.output_format)
+        pipeline.wait()
+        write_bundle(args.activity, args.scene, frame_lists, bundle_path, args.output_format)
+    shards.close()
+    export_manifest.close()
+    profiling.report()
 
 
 def parse_args():
     import argparse
+    import annotation_dataset
+    import export_manifest
+    import pipeline
+    import planning
+    import profiling
+    import query_cache
+    import segment_index
+    import shards
+    import sparql
+    import trimming
+    import video_cache
 
     parser = argparse.ArgumentParser(description='Search for a database in the MMKG dataset')
     parser.add_argument('activity', type=str, help='The activity to search for')
     parser.add_argument('scene', type=str, help='The scene to search for')
-    parser.add_argument('camera', type=str, help='The camera to search for')
+    parser.add_argument('camera', type=str, help="The camera to search for, a comma-separated list of cameras (e.g. camera1,camera4), or 'all' for every camera of the scene")
     parser.add_argument('-a', '--action', type=str, help='The event action to search for')
     parser.add_argument('-o', '--object', type=str, help='The object to search for')
+    parser.add_argument('-r', '--visibility-runs', type=int, nargs='?', const=0, metavar='GAP',
+                        help='With --object, output each run of frames in which the object is visible instead of one range per segment; runs closer than GAP frames are merged (default GAP: 0)')
     parser.add_argument('-s', '--start', type=int, help='The start frame of the video')
     parser.add_argument('-e', '--end', type=int, help='The end frame of the video')
     parser.add_argument('output_path', type=str, help='The path to save the output')
+    parser.add_argument('--max-frames-in-flight', type=int, default=sparql.MAX_FRAMES_IN_FLIGHT, help='The maximum number of images held in memory while exporting')
+    sparql.add_arguments(parser)
+    query_cache.add_arguments(parser)
+    video_cache.add_arguments(parser)
+    segment_index.add_arguments(parser)
+    trimming.add_arguments(parser)
+    pipeline.add_arguments(parser)
+    annotation_dataset.add_arguments(parser)
+    shards.add_arguments(parser)
+    profiling.add_arguments(parser)
+    planning.add_arguments(parser)
+    export_manifest.add_arguments(parser)
 
     return parser.parse_args()
 
 
-def get_frames(activity, scene, camera, start_frame, end_frame, action, object):
+def get_output_path(output_path, activity, scene, camera=None):
+    import os
+
+    output_path = output_path + "/" + "_".join([activity, scene] + ([camera] if camera is not None else []))
+    os.makedirs(output_path, exist_ok=True)
+    return output_path
+
+
+def get_cameras(activity, scene, camera):
+    """Returns the cameras of a multi-camera search, or None if only one camera is searched for."""
+    import sparql
+
+    if camera == 'all':
+        cameras = sparql.get_scene_cameras(activity, scene)
+        if len(cameras) == 0:
+            raise SystemExit("No cameras found for " + activity + " in " + scene)
+        return cameras
+    if ',' in camera:
+        return list(dict.fromkeys(name.strip() for name in camera.split(',') if name.strip() != ''))
+    return None
+
+
+def output(activity, scene, camera, frame_list, output_path, trim_mode='exact', max_frames_in_flight=None, annotation_format='tsv', output_format='files'):
+    import pipeline
+
+    # The video, the images of each segment and the annotations are fetched concurrently.
+    pipeline.submit('fetch', output_video, activity, scene, camera, frame_list, output_path, trim_mode)
+    if output_format == 'shards':
+        output_shards(activity, scene, camera, frame_list, output_path, max_frames_in_flight)
+        return
+    output_image(frame_list, output_path, max_frames_in_flight)
+    pipeline.submit('fetch', output_annotation, activity, scene, camera, frame_list, output_path, annotation_format)
+
+
+def print_plan(activity, scene, frame_lists, format='text'):
+    import planning
+
+    plan = planning.get_plan({(activity, scene, camera): frame_list for camera, frame_list in frame_lists.items()})
+    # The video is trimmed into the segments, and every frame is assembled from its tiles and saved as an image.
+    downloads = {'videos': plan['video_bytes'], 'image tiles': plan['tile_bytes']}
+    outputs = {'videos': plan['segment_video_bytes'], 'images': plan['tile_bytes'],
+               'annotations': plan['bbox_rows'] * planning.BBOX_ROW_BYTES + plan['segments'] * planning.ACTION_ROW_BYTES}
+    planning.print_plan(plan, downloads, outputs, format)
+
+
+def get_frames(activity, scene, camera, start_frame, end_frame, action, object, visibility_gap=None):
     print("Searching for frames...")
+    segments = get_segments(activity, scene, camera, action, object, visibility_gap)
+    return clip_frames(segments, start_frame, end_frame, action is None and object is None)
+
+
+def get_segments(activity, scene, camera, action, object, visibility_gap=None):
+    return get_camera_segments(activity, scene, [camera], action, object, visibility_gap).get(camera, {})
+
+
+def get_camera_frames(activity, scene, cameras, start_frame, end_frame, action, object, visibility_gap=None):
+    """Searches for the frames of several cameras, with one query for all of them; they are returned by camera."""
+    print("Searching for frames...")
+    camera_segments = get_camera_segments(activity, scene, cameras, action, object, visibility_gap)
+    return {camera: clip_frames(camera_segments.get(camera, {}), start_frame, end_frame, action is None and object is None) for camera in cameras}
+
+
+def get_camera_segments(activity, scene, cameras, action, object, visibility_gap=None):
+    import segment_index
     import sparql
-    frame_list = {}
-    segments = None
 
-    if object is not None:
-        segments = sparql.get_frames_from_object(activity, scene, camera, action, object)
+    index = segment_index.get_index()
+    if object is not None and visibility_gap is not None:
+        return sparql.get_visibility_runs_from_object_of_cameras(activity, scene, cameras, action, object, visibility_gap)
+    elif object is not None:
+        return sparql.get_frames_from_object_of_cameras(activity, scene, cameras, action, object)
     elif action is not None:
-        segments = sparql.get_frames_from_action(activity, scene, camera, action)
+        return sparql.get_frames_from_action_of_cameras(activity, scene, cameras, action)
+    elif index is not None:
+        return {camera: index.get(activity, scene, camera).segments for camera in cameras}
     else:
-        segments = sparql.get_all_frames(activity, scene, camera)
-        frame_list['all'] = {'start_frame': start_frame, 'end_frame': end_frame}
+        return sparql.get_all_frames_of_cameras(activity, scene, cameras)
 
-    for segment in segments:
-        segment_start_frame = segments[segment]['start_frame']
-        segment_end_frame = segments[segment]['end_frame']
-        if start_frame is None and end_frame is None:
-            frame_list[segment] = {'start_frame': segment_start_frame, 'end_frame': segment_end_frame}
-        elif end_frame is None:
-            if segment_end_frame < start_frame:
-                continue
-            elif segment_start_frame < start_frame:
-                frame_list[segment] = {'start_frame': start_frame, 'end_frame': segment_end_frame}
-            else:
-                frame_list[segment] = {'start_frame': segment_start_frame, 'end_frame': segment_end_frame}
-        elif start_frame is None:
-            if end_frame < segment_start_frame:
-                continue
-            elif end_frame < segment_end_frame:
-                frame_list[segment] = {'start_frame': segment_start_frame, 'end_frame': end_frame}
-            else:
-                frame_list[segment] = {'start_frame': segment_start_frame, 'end_frame': segment_end_frame}
-        else:
-            if segment_end_frame < start_frame or end_frame < segment_start_frame:
-                continue
-            elif segment_start_frame < start_frame and segment_end_frame <= end_frame:
-                frame_list[segment] = {'start_frame': start_frame, 'end_frame': segment_end_frame}
-            elif start_frame <= segment_start_frame and end_frame < segment_end_frame:
-                frame_list[segment] = {'start_frame': segment_start_frame, 'end_frame': end_frame}
-            elif start_frame <= segment_start_frame and segment_end_frame <= end_frame:
-                frame_list[segment] = {'start_frame': segment_start_frame, 'end_frame': segment_end_frame}
-            else:
-                frame_list[segment] = {'start_frame': start_frame, 'end_frame': end_frame}
 
+def clip_frames(segments, start_frame, end_frame, is_whole_video):
+    import segment_index
+
+    frame_list = {}
+    if is_whole_video:
+        frame_list['all'] = {'start_frame': start_frame, 'end_frame': end_frame}
+
+    # Runs of a segment keep the name of their segment.
+    frame_list.update(segment_index.IntervalIndex(segments).clip(start_frame, end_frame))
     return frame_list
 
 
-def output_video(activity, scene, camera, frame_list, output_path):
-    print("Outputting video...")
+def write_bundle(activity, scene, frame_lists, bundle_path, output_format='files'):
+    """Writes `bundle.json`, which aligns the outputs of the cameras of a multi-camera search.
+
+    The videos of a scene are synchronized, so the segments of the same event share their frame
+    numbers in all cameras and differ only in the camera number of their names. Each aligned
+    entry lists the segment of every camera that has it with its frames and its video, and the
+    frames common to all of them (None if they do not overlap). Paths are relative to the bundle.
+    """
+    import json
     import os
-    import base64
-    import tempfile
     import sparql
 
-    video_directory = output_path + "/videos"
-    if not os.path.exists(video_directory):
-        os.makedirs(video_directory)
+    bundle = {'activity': activity, 'scene': scene, 'cameras': {}, 'segments': []}
+    camera_clips = {}
+    for camera, frame_list in frame_lists.items():
+        frame_rate = sparql.get_video_frame_rate(activity, scene, camera)
+        bundle['cameras'][camera] = {'directory': camera, 'frame_rate': None if frame_rate is None else float(frame_rate)}
+        if output_format == 'shards':
+            bundle['cameras'][camera]['shards'] = camera + "/shards"
+        else:
+            bundle['cameras'][camera]['images'] = camera + "/images"
+            bundle['cameras'][camera]['annotations'] = camera + "/annotations"
+
+        clips = get_video_clips(activity, scene, camera, frame_list, camera + "/videos")
+        camera_clips[camera] = {key: clip[0] for key, clip in zip(['all'] if 'all' in frame_list else list(frame_list), clips)}
+
+    bundle['segments'] = align_segments(scene, frame_lists, camera_clips)
+
+    bundle_file_path = os.path.join(bundle_path, "bundle.json")
+    with open(bundle_file_path, "w") as file:
+        json.dump(bundle, file, indent=2)
+    print("Bundle saved to " + bundle_file_path)
+
+
+def align_segments(scene, frame_lists, camera_clips):
+    """Aligns the frame lists of several cameras by segment, with the videos of their clips by camera.
+
+    Visibility runs hold the name of their segment in 'segment'. They are found per camera and do
+    not correspond across cameras, so the runs of a camera are listed in 'runs' of its view of the
+    segment, which spans all of them.
+    """
+    aligned = {}
+    for camera, frame_list in frame_lists.items():
+        for key, frames in frame_list.items():
+            view = {'segment': key, 'start_frame': frames['start_frame'], 'end_frame': frames['end_frame']}
+            if key in camera_clips.get(camera, {}):
+                view['video'] = camera_clips[camera][key]
+            segment = frames.get('segment', key)
+            # Segment names are e.g. `clean_sink_1_scene1_video_segment0`, with the camera number before the scene.
+            views = aligned.setdefault(segment.split("_" + scene + "_", 1)[-1], {})
+            if 'segment' not in frames:
+                views[camera] = view
+                continue
+            run = {'run': key, **{name: value for name, value in view.items() if name != 'segment'}}
+            if camera not in views:
+                views[camera] = {'segment': segment, 'start_frame': run['start_frame'], 'end_frame': run['end_frame'], 'runs': []}
+            views[camera]['start_frame'] = min(views[camera]['start_frame'], run['start_frame'])
+            views[camera]['end_frame'] = max(views[camera]['end_frame'], run['end_frame'])
+            views[camera]['runs'].append(run)
+
+    segments = []
+    for key, views in aligned.items():
+        start_frames = [view['start_frame'] for view in views.values() if view['start_frame'] is not None]
+        end_frames = [view['end_frame'] for view in views.values() if view['end_frame'] is not None]
+        start_frame = max(start_frames) if len(start_frames) > 0 else None
+        end_frame = min(end_frames) if len(end_frames) > 0 else None
+        if start_frame is not None and end_frame is not None and end_frame < start_frame:
+            start_frame, end_frame = None, None
+        segments.append({'key': key, 'start_frame': start_frame, 'end_frame': end_frame, 'views': views})
+    return segments
+
+
+def output_video(activity, scene, camera, frame_list, output_path, trim_mode='exact'):
+    print("Outputting video...")
+    import os
+    import export_manifest
+    import pipeline
+    import video_cache
 
-    results = sparql.get_video(activity, scene, camera)
+    video_directory = output_path + "/videos"
+    os.makedirs(video_directory, exist_ok=True)
+
+    # Clips saved by an earlier run are kept, and the video is not even fetched if all of them are.
+    manifest = export_manifest.get_manifest(output_path)
+    clips = [clip for clip in get_video_clips(activity, scene, camera, frame_list, video_directory)
+             if not manifest.is_file_complete(clip[0], video_clip_params(activity, scene, camera, clip, trim_mode))]
+    if len(clips) == 0:
+        print("Videos already saved to " + video_directory)
+        return
 
-    bindings = results["results"]["bindings"]
-    if bindings.__len__() == 0:
+    video = video_cache.get_video(activity, scene, camera)
+    if video is None:
         print("No video found")
         return
 
-    result = bindings[0]
-    frame_rate = result["frame_rate"]["value"]
-    video_base64 = result["video"]["value"]
-    video_binary = base64.b64decode(video_base64)
+    # The video stays pinned until the trim task has cut it.
+    try:
+        pipeline.submit('trim', trim_video, activity, scene, camera, video, clips, trim_mode, manifest)
+    except BaseException:
+        video.close()
+        raise
+
+
+def get_video_clips(activity, scene, camera, frame_list, video_directory):
+    """Returns the clips of a frame list as `(video_path, start_frame, end_frame)`; the whole video has neither."""
     if 'all' in frame_list:
         if frame_list['all']['start_frame'] is None and frame_list['all']['end_frame'] is None:
-            video_path = video_directory + "/" + activity + "_" + scene + "_" + camera + ".mp4"
-            with open(video_path, "wb") as file:
-                file.write(video_binary)
+            return [(video_directory + "/" + activity + "_" + scene + "_" + camera + ".mp4", None, None)]
+        return [(video_directory + "/" + activity + "_" + scene + "_" + camera + "_trimmed.mp4", frame_list['all']['start_frame'], frame_list['all']['end_frame'])]
+    return [(video_directory + "/" + segment + ".mp4", frame_list[segment]['start_frame'], frame_list[segment]['end_frame']) for segment in frame_list]
+
+
+def video_clip_params(activity, scene, camera, clip, trim_mode):
+    _, start_frame, end_frame = clip
+    return {'activity': activity, 'scene': scene, 'camera': camera, 'start_frame': start_frame, 'end_frame': end_frame, 'trim_mode': trim_mode}
+
+
+def trim_video(activity, scene, camera, video, clips, trim_mode='exact', manifest=None):
+    import os
+    import shutil
+    import trimming
+
+    # The pinned video is released once it is cut.
+    with video:
+        # Clips left unfinished by an earlier run are replaced.
+        for video_path, _, _ in clips:
+            if os.path.exists(video_path):
+                os.remove(video_path)
+
+        segments = []
+        for video_path, start_frame, end_frame in clips:
+            if start_frame is None and end_frame is None:
+                shutil.copyfile(video.path, video_path)
                 print("Video saved to " + video_path)
-        else:
-            video_path = video_directory + "/" + activity + "_" + scene + "_" + camera + "_trimmed.mp4"
-            with tempfile.NamedTemporaryFile(suffix=".mp4") as tmp_file:
-                tmp_file.write(video_binary)
-                tmp_path = tmp_file.name
-                trim_video(tmp_path, video_path, frame_rate, frame_list['all']['start_frame'], frame_list['all']['end_frame'])
-    else:
-        with tempfile.NamedTemporaryFile(suffix=".mp4") as tmp_file:
-            tmp_file.write(video_binary)
-            tmp_path = tmp_file.name
-            for segment in frame_list:
-                video_path = video_directory + "/" + segment + ".mp4"
-                start_frame = frame_list[segment]['start_frame']
-                end_frame = frame_list[segment]['end_frame']
-                trim_video(tmp_path, video_path, frame_rate, start_frame, end_frame)
-
-
-def trim_video(tmp_path, video_path, frame_rate, start_frame, end_frame):
-    print("Trimming video...")
-    import ffmpeg
-
-    if start_frame is None and end_frame is None:
-        ffmpeg.input(tmp_path).output(video_path).run()
-    elif start_frame is None:
-        end_seconds = float(end_frame)/float(frame_rate)
-        ffmpeg.input(tmp_path, ss=0, to=end_seconds).output(video_path).run()
-    elif end_frame is None:
-        start_seconds = float(start_frame)/float(frame_rate)
-        ffmpeg.input(tmp_path, ss=start_seconds).output(video_path).run()
-    else:
-        if start_frame == end_frame:
-            print("ERROR: Cannot trim video to a single frame.")
-            return
-        start_seconds = float(start_frame)/float(frame_rate)
-        end_seconds = float(end_frame)/float(frame_rate)
-        ffmpeg.input(tmp_path, ss=start_seconds, to=end_seconds).output(video_path).run()
+            else:
+                segments.append((video_path, start_frame, end_frame))
+        # All segments are cut out of the video in one pass.
+        if len(segments) > 0:
+            trimming.trim_segments(video.path, video.frame_rate, segments, trim_mode)
 
-    print("Video saved to " + video_path)
+    if manifest is not None:
+        for clip in clips:
+            if os.path.exists(clip[0]):
+                manifest.record_file(clip[0], video_clip_params(activity, scene, camera, clip, trim_mode))
 
 
-def output_image(frame_list, output_path):
+def output_image(frame_list, output_path, max_frames_in_flight=None):
     print("Outputting images...")
     import os
-    import cv2
+    import threading
+    import export_manifest
+    import pipeline
     import sparql
 
     image_directory = output_path + "/images"
     if not os.path.exists(image_directory):
         os.makedirs(image_directory)
 
+    # The frames of all segments share the bound, from their first tile until they are written.
+    frames_in_flight = threading.BoundedSemaphore(max_frames_in_flight or sparql.MAX_FRAMES_IN_FLIGHT)
+    manifest = export_manifest.get_manifest(output_path)
     for segment in frame_list:
-        print("Outputting images for " + segment + "...")
         if segment == 'all':
             continue
-        image_dict = sparql.get_images(segment, frame_list[segment]['start_frame'], frame_list[segment]['end_frame'])
+        params = {'segment': frame_list[segment].get('segment', segment), 'start_frame': frame_list[segment]['start_frame'], 'end_frame': frame_list[segment]['end_frame']}
+        # The images of a segment are only queried again if some of them are missing.
+        if manifest.is_group_complete("images/" + segment, params):
+            print("Images already saved for " + segment)
+            continue
+        pipeline.submit('fetch', output_segment_image, params['segment'], params['start_frame'], params['end_frame'], image_directory, frames_in_flight,
+                        manifest.group("images/" + segment, params))
+
+
+def output_segment_image(segment, start_frame, end_frame, image_directory, frames_in_flight, group=None):
+    print("Outputting images for " + segment + "...")
+    import functools
+    import images
+    import sparql
 
-        for descriptor in image_dict:
+    # Each frame is handed to the encode stage as soon as its tiles have arrived, and its slot is released once it is written.
+    frames = sparql.iter_images(segment, start_frame, end_frame, frames_in_flight)
+    for descriptor, _, _, image in frames:
+        image_path = image_directory + "/" + descriptor + ".jpg"
+        if group is None:
+            print("Saving images for " + descriptor + "...")
+            images.save_image(image_path, image, release=frames_in_flight.release)
+        elif group.manifest.is_file_complete(image_path, {'segment': segment}):
+            frames_in_flight.release()
+            group.add(image_path, is_saved=True)
+        else:
             print("Saving images for " + descriptor + "...")
-            images = list(image_dict[descriptor]['images'].values())
-            split_width = image_dict[descriptor]['split_width']
+            group.add(image_path)
+            images.save_image(image_path, image, functools.partial(save_image_done, group, segment), frames_in_flight.release)
+    if group is not None:
+        group.close()
 
-            horizontal_list = []
-            for i in range(0, len(images), split_width):
-                horizontal_list.append(cv2.hconcat(images[i:i+split_width]))
 
-            combined_horizontal = cv2.vconcat(horizontal_list)
+def save_image_done(group, segment, image_path):
+    group.manifest.record_file(image_path, {'segment': segment})
+    group.done()
 
-            cv2.imwrite(image_directory + "/" + descriptor + ".jpg", combined_horizontal)
-            print("Image saved to " + image_directory + "/" + descriptor + ".jpg")
 
+def output_shards(activity, scene, camera, frame_list, output_path, max_frames_in_flight=None):
+    print("Outputting shards...")
+    import threading
+    import pipeline
+    import shards
+    import sparql
+
+    # The annotations are saved with the frames they belong to, so they are searched for first.
+    bbox_annotations = {}
+    for annotation in sparql.get_annotation_2d_bbox_batched(scene, frame_list):
+        bbox_annotations.setdefault((annotation['segment'], int(annotation['frame_number'])), []).append(shards.bbox_metadata(annotation))
+    action_annotations = {}
+    for annotation in sparql.get_annotation_action_batched(scene, frame_list):
+        action_annotations.setdefault(annotation['segment'], []).append(shards.action_metadata(annotation))
 
-def output_annotation(activity, scene, camera, frame_list, output_path):
+    writer = shards.get_writer(output_path)
+    frames_in_flight = threading.BoundedSemaphore(max_frames_in_flight or sparql.MAX_FRAMES_IN_FLIGHT)
+    for segment in frame_list:
+        if segment == 'all':
+            continue
+        metadata = {'activity': activity, 'scene': scene, 'camera': camera, 'segment': frame_list[segment].get('segment', segment)}
+        pipeline.submit('fetch', output_segment_shards, writer, metadata, frame_list[segment]['start_frame'], frame_list[segment]['end_frame'], bbox_annotations, action_annotations, frames_in_flight)
+
+
+def output_segment_shards(writer, metadata, start_frame, end_frame, bbox_annotations, action_annotations, frames_in_flight):
+    print("Outputting shards for " + metadata['segment'] + "...")
+    import images
+    import sparql
+
+    segment = metadata['segment']
+    frames = sparql.iter_images(segment, start_frame, end_frame, frames_in_flight)
+    for descriptor, frame_number, _, image in frames:
+        sample_metadata = {**metadata, 'frame_number': frame_number, 'bboxes': bbox_annotations.get((segment, frame_number), []), 'actions': action_annotations.get(segment, [])}
+        images.save_sample(writer, descriptor, sample_metadata, image, frames_in_flight.release)
+
+
+def output_annotation(activity, scene, camera, frame_list, output_path, annotation_format='tsv'):
     print("Outputting annotation...")
     import os
+    import annotation_dataset
+    import export_manifest
+    import profiling
     import sparql
 
-    annotation_directory = output_path + "/annotations"
-    if not os.path.exists(annotation_directory):
-        os.makedirs(annotation_directory)
-
-    annotation_list = sparql.get_annotation_2d_bbox(scene, frame_list)
-    with open(annotation_directory + "/" + activity + "_" + scene + "_" + camera + "_2D.tsv", "w") as file:
-        for annotation in annotation_list:
-            file.write(annotation['frame_number'] + "\t" + annotation['object'] + "\t" + annotation['2dbbox'] + "\n")
-    print("Annotation saved to " + annotation_directory + "/" + activity + "_" + scene + "_" + camera + "_2D.tsv")
-
-    annotation_list = sparql.get_annotation_action(scene, frame_list)
-    with open(annotation_directory + "/" + activity + "_" + scene + "_" + camera + "_Action.tsv", "w") as file:
-        for annotation in annotation_list:
-            file.write(annotation['action'] + "\t" + annotation['main_object'] + "\t" + annotation['target_object'] + "\t" + str(annotation['start_frame']) + "\t" + str(annotation['end_frame']) + "\n")
-    print("Annotation saved to " + annotation_directory + "/" + activity + "_" + scene + "_" + camera + "_Action.tsv")
+    name = activity + "_" + scene + "_" + camera
+    if annotation_format == 'parquet':
+        annotation_directory = annotation_dataset.get_directory(output_path)
+        name = annotation_dataset.get_name(output_path, name)
+        bbox_path = annotation_dataset.bbox_annotations_path(annotation_directory, activity, scene, camera, name)
+        action_path = annotation_dataset.action_annotations_path(annotation_directory, activity, scene, camera, name)
+    else:
+        annotation_directory = output_path + "/annotations"
+        os.makedirs(annotation_directory, exist_ok=True)
+        bbox_path = annotation_directory + "/" + name + "_2D.tsv"
+        action_path = annotation_directory + "/" + name + "_Action.tsv"
+
+    # Annotation files saved by an earlier run for the same frames are not queried again.
+    manifest = export_manifest.get_manifest(output_path)
+    params = {'frame_list': frame_list, 'format': annotation_format}
+
+    if manifest.is_file_complete(bbox_path, params):
+        print("Annotation already saved to " + bbox_path)
+    else:
+        annotation_list = sparql.get_annotation_2d_bbox_batched(scene, frame_list)
+        if annotation_format == 'parquet':
+            annotation_dataset.write_bbox_annotations(annotation_directory, activity, scene, camera, name, annotation_list)
+        else:
+            with profiling.span("file.write") as span, open(bbox_path, "w") as file:
+                for annotation in annotation_list:
+                    file.write(annotation['frame_number'] + "\t" + annotation['object'] + "\t" + annotation['2dbbox'] + "\n")
+                span['bytes'] = file.tell()
+                span['rows'] = len(annotation_list)
+        manifest.record_file(bbox_path, params)
+        print("Annotation saved to " + bbox_path)
+
+    if manifest.is_file_complete(action_path, params):
+        print("Annotation already saved to " + action_path)
+    else:
+        annotation_list = sparql.get_annotation_action_batched(scene, frame_list)
+        if annotation_format == 'parquet':
+            annotation_dataset.write_action_annotations(annotation_directory, activity, scene, camera, name, annotation_list)
+        else:
+            with profiling.span("file.write") as span, open(action_path, "w") as file:
+                for annotation in annotation_list:
+                    file.write(annotation['action'] + "\t" + annotation['main_object'] + "\t" + annotation['target_object'] + "\t" + str(annotation['start_frame']) + "\t" + str(annotation['end_frame']) + "\n")
+                span['bytes'] = file.tell()
+                span['rows'] = len(annotation_list)
+        manifest.record_file(action_path, params)
+        print("Annotation saved to " + action_path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,194 @@
+import base64
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import cv2
+import numpy
+from rdflib import RDF, RDFS, XSD, Graph, Literal, Namespace, URIRef
+from rdflib.plugins.sparql import prepareQuery
+
+EX = Namespace("http://kgrc4si.home.kg/virtualhome2kg/instance/")
+VH2KG = Namespace("http://kgrc4si.home.kg/virtualhome2kg/ontology/")
+MSSN = Namespace("http://mssn.sigappfr.org/mssn/")
+
+# The shape of the synthetic data; every value can be overridden with `build_graph(**sizes)`.
+DEFAULT_SIZES = {
+    'activities': 1,
+    'cameras': 2,
+    'segments': 2,
+    'frames_per_segment': 20,
+    'split_width': 2,
+    'tiles_per_frame': 4,
+    'tile_width': 64,
+    'tile_height': 48,
+    'video_width': 128,
+    'video_height': 96,
+    'frame_rate': 30,
+}
+
+# Actions and objects of the synthetic events, in turn.
+EVENTS = [("grab", "bread", None), ("put", "bread", "fryingpan")]
+
+
+def synthetic_video(frames: int, width: int, height: int, frame_rate: int):
+    with tempfile.TemporaryDirectory(prefix="vhakg-mock-") as directory:
+        path = os.path.join(directory, "video.mp4")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), frame_rate, (width, height))
+        for i in range(frames):
+            writer.write(numpy.full((height, width, 3), i % 256, numpy.uint8))
+        writer.release()
+        with open(path, "rb") as file:
+            return base64.b64encode(file.read()).decode()
+
+
+def synthetic_tile(index: int, width: int, height: int):
+    success, buffer = cv2.imencode(".png", numpy.full((height, width, 3), index * 50 % 256, numpy.uint8))
+    return base64.b64encode(buffer.tobytes()).decode()
+
+
+def build_graph(**sizes):
+    """Builds a graph with the shape of VHAKG: activities recorded by cameras, with event segments,
+    tiled frame images, 2D bboxes and the base64 video of each camera.
+
+    Activities are named `activity<i>` in `scene1`, and cameras `camera<j>`. The object of an event
+    is visible in two of three frames.
+    """
+    sizes = {**DEFAULT_SIZES, **sizes}
+    graph = Graph()
+    scene = "scene1"
+    frames = sizes['segments'] * sizes['frames_per_segment']
+    video = synthetic_video(frames, sizes['video_width'], sizes['video_height'], sizes['frame_rate'])
+    tiles = [synthetic_tile(i, sizes['tile_width'], sizes['tile_height']) for i in range(sizes['tiles_per_frame'])]
+
+    for activity_number in range(1, sizes['activities'] + 1):
+        activity = "activity" + str(activity_number)
+        activity_scene = EX[activity + "_" + scene]
+        events = []
+        for event_number in range(sizes['segments']):
+            action, main_object, target_object = EVENTS[event_number % len(EVENTS)]
+            event = EX["event" + str(event_number) + "_" + activity + "_" + scene]
+            graph.add((activity_scene, VH2KG.hasEvent, event))
+            graph.add((event, VH2KG.action, URIRef(str(VH2KG) + "action/" + action)))
+            for predicate, name in ((VH2KG.mainObject, main_object), (VH2KG.targetObject, target_object)):
+                if name is None:
+                    continue
+                object = EX[name + "1_" + scene]
+                graph.add((object, RDFS.label, Literal(name)))
+                graph.add((event, predicate, object))
+            events.append((event, EX[main_object + "1_" + scene], main_object))
+
+        for camera_number in range(1, sizes['cameras'] + 1):
+            camera = EX[activity + "_" + scene + "_camera" + str(camera_number)]
+            graph.add((activity_scene, VH2KG.hasVideo, camera))
+            graph.add((camera, VH2KG.frameRate, Literal(str(sizes['frame_rate']))))
+            graph.add((camera, VH2KG.video, Literal(video, datatype=XSD.base64Binary)))
+
+            for segment_number, (event, object, object_name) in enumerate(events):
+                prefix = activity + "_" + str(camera_number) + "_" + scene
+                segment = EX[prefix + "_video_segment" + str(segment_number)]
+                start_frame = segment_number * sizes['frames_per_segment']
+                end_frame = start_frame + sizes['frames_per_segment'] - 1
+                graph.add((camera, MSSN.hasMediaSegment, segment))
+                graph.add((segment, VH2KG.isVideoSegmentOf, event))
+                graph.add((event, VH2KG.hasVideoSegment, segment))
+                graph.add((segment, VH2KG.hasStartFrame, Literal(start_frame)))
+                graph.add((segment, VH2KG.hasEndFrame, Literal(end_frame)))
+
+                for frame_number in range(start_frame, end_frame + 1):
+                    descriptor = EX[prefix + "_frame" + str(frame_number)]
+                    graph.add((segment, MSSN.hasMediaDescriptor, descriptor))
+                    graph.add((descriptor, VH2KG.frameNumber, Literal(frame_number)))
+                    graph.add((descriptor, VH2KG.splitWidth, Literal(sizes['split_width'])))
+                    for tile_number, tile in enumerate(tiles):
+                        image = EX[prefix + "_frame" + str(frame_number) + "_tile" + str(tile_number)]
+                        graph.add((descriptor, VH2KG.image, image))
+                        graph.add((image, VH2KG.splitImageID, Literal(tile_number)))
+                        graph.add((image, RDF.value, Literal(tile)))
+                    if frame_number % 3 != 0:
+                        bbox = EX[prefix + "_frame" + str(frame_number) + "_bbox"]
+                        graph.add((descriptor, MSSN.hasMediaDescriptor, bbox))
+                        graph.add((bbox, VH2KG.is2DbboxOf, object))
+                        graph.add((bbox, VH2KG["bbox-2d-value"], Literal("10,40,30,10")))
+                        graph.add((bbox, RDFS.label, Literal(object_name)))
+
+    return graph
+
+
+class MockEndpoint:
+    """Local stand-in of the GraphDB SPARQL endpoint, serving a graph over the SPARQL protocol.
+
+    The responses are kept per query, so that after a first run the endpoint answers as fast as
+    the network allows and measurements reflect the client, not the in-memory query engine.
+    """
+
+    def __init__(self, graph: Graph, host: str = "127.0.0.1", port: int = 0):
+        self.graph = graph
+        self.responses = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self.server.server_address[:2]
+        return "http://" + host + ":" + str(port) + "/repositories/mock"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, query: str, accept: str):
+        is_csv = "csv" in accept
+        key = (query, is_csv)
+        with self.lock:
+            if key not in self.responses:
+                # The rdflib query engine is not thread-safe.
+                result = self.graph.query(prepareQuery(query))
+                if result.type == "ASK":
+                    body = '{"head": {}, "boolean": ' + ("true" if result.askAnswer else "false") + '}'
+                    self.responses[key] = (body.encode(), "application/sparql-results+json")
+                elif is_csv:
+                    self.responses[key] = (result.serialize(format="csv"), "text/csv")
+                else:
+                    self.responses[key] = (result.serialize(format="json"), "application/sparql-results+json")
+            return self.responses[key]
+
+    def handler_class(self):
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send_body(self, body: bytes, content_type: str):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path.endswith("/size"):
+                    self.send_body(str(len(endpoint.graph)).encode(), "text/plain")
+                    return
+                self.send_body(*endpoint.respond(parse_qs(url.query)["query"][0], self.headers.get("Accept", "")))
+
+            def do_POST(self):
+                data = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+                if "form" in self.headers.get("Content-Type", ""):
+                    data = parse_qs(data)["query"][0]
+                self.send_body(*endpoint.respond(data, self.headers.get("Accept", "")))
+
+        return Handler
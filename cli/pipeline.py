@@ -0,0 +1,163 @@
+import argparse
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+STAGES = ['fetch', 'decode', 'trim', 'encode', 'write']
+DEFAULT_JOBS = {'fetch': 4, 'decode': os.cpu_count(), 'trim': 2, 'encode': os.cpu_count(), 'write': 4}
+QUEUE_SIZE = 32
+
+
+class Stage:
+    """Worker pool of one pipeline stage with a bounded queue in front of it.
+
+    Submitting blocks while the queue is full, so a fast stage cannot run arbitrarily far
+    ahead of a slow one.
+    """
+
+    def __init__(self, name: str, jobs: int, queue_size: int = QUEUE_SIZE):
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix=name)
+        self.slots = threading.BoundedSemaphore(jobs + queue_size)
+
+    def submit(self, function, *args):
+        self.slots.acquire()
+        try:
+            # Tasks run in the context they were submitted from, so they belong to the same job.
+            future = self.executor.submit(contextvars.copy_context().run, function, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+
+class Job:
+    """Tasks submitted on behalf of one search, including the tasks they submit in turn."""
+
+    def __init__(self):
+        self.unfinished_tasks = 0
+        self.errors = []
+        self.finished_at = None
+        self.condition = threading.Condition()
+
+    def task_started(self):
+        with self.condition:
+            self.unfinished_tasks += 1
+            self.finished_at = None
+
+    def task_done(self, error: BaseException | None = None):
+        with self.condition:
+            self.unfinished_tasks -= 1
+            if error is not None:
+                self.errors.append(error)
+            if self.unfinished_tasks == 0:
+                self.finished_at = time.monotonic()
+            self.condition.notify_all()
+
+    def wait(self):
+        """Blocks until all tasks of the job have finished and returns their errors."""
+        # Tasks may submit new tasks while running, so wait until no unfinished ones are left.
+        with self.condition:
+            while self.unfinished_tasks > 0:
+                self.condition.wait()
+            errors = self.errors
+            self.errors = []
+            return errors
+
+
+_current_job = contextvars.ContextVar('job', default=None)
+
+
+class Pipeline:
+    """Stages for SPARQL fetches, blob decoding, ffmpeg trimming, image encoding and file writes.
+
+    Tasks of a stage hand their results on to the next stages, so network-bound queries overlap
+    with CPU-bound decoding and ffmpeg work. Tasks must only submit to later stages.
+    """
+
+    def __init__(self, jobs: dict | None = None):
+        jobs = {**DEFAULT_JOBS, **(jobs or {})}
+        self.stages = {name: Stage(name, jobs[name]) for name in STAGES}
+        self.all_tasks = Job()
+
+    def submit(self, stage: str, function, *args):
+        jobs = [self.all_tasks] + ([_current_job.get()] if _current_job.get() is not None else [])
+        # Errors of a job are only kept by the job, which drains them in `Job.wait()`. `all_tasks` is
+        # never drained by a long-running server, so it only keeps the errors of tasks without a job.
+        owner = jobs[-1]
+        for job in jobs:
+            job.task_started()
+        try:
+            future = self.stages[stage].submit(function, *args)
+        except BaseException:
+            for job in jobs:
+                job.task_done()
+            raise
+
+        # Finished futures are not kept, so their results are freed as soon as their consumers are done.
+        def task_done(future):
+            error = None if future.cancelled() else future.exception()
+            for job in jobs:
+                job.task_done(error if job is owner else None)
+
+        future.add_done_callback(task_done)
+        return future
+
+    def wait(self):
+        errors = self.all_tasks.wait()
+        if len(errors) > 0:
+            raise errors[0]
+
+
+_pipeline = None
+
+
+def parse_job(value: str):
+    name, _, number = value.partition('=')
+    if name not in STAGES or not number.isdigit() or int(number) < 1:
+        raise argparse.ArgumentTypeError("invalid value '" + value + "', expected STAGE=N with STAGE in " + ", ".join(STAGES))
+    return name, int(number)
+
+
+def parse_jobs(values: list | None):
+    return dict(values or [])
+
+
+def configure(jobs: dict | None = None):
+    global _pipeline
+    _pipeline = Pipeline(jobs)
+
+
+def add_arguments(parser):
+    parser.add_argument("-j", "--jobs", type=parse_job, action='append', metavar="STAGE=N",
+                        help="The number of workers of a pipeline stage (" + ", ".join(STAGES) + "), can be repeated "
+                             "(default: " + ", ".join(name + "=" + str(number) for name, number in DEFAULT_JOBS.items()) + ")")
+
+
+@contextlib.contextmanager
+def job():
+    """Tracks the tasks submitted inside the context as one job."""
+    current_job = Job()
+    token = _current_job.set(current_job)
+    try:
+        yield current_job
+    finally:
+        _current_job.reset(token)
+
+
+def get_pipeline():
+    if _pipeline is None:
+        configure()
+    return _pipeline
+
+
+def submit(stage: str, function, *args):
+    return get_pipeline().submit(stage, function, *args)
+
+
+def wait():
+    get_pipeline().wait()
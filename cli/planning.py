@@ -0,0 +1,84 @@
+import json
+
+PLAN_FORMATS = ['text', 'json']
+
+# Approximate sizes of a line of the annotation files, to estimate their size from the number of rows.
+BBOX_ROW_BYTES = 40
+ACTION_ROW_BYTES = 60
+
+# The size of the image tiles is estimated from a sample of the tiles of this many segments.
+SAMPLE_SEGMENTS = 10
+
+
+def add_arguments(parser):
+    parser.add_argument("--plan", type=str, nargs='?', const='text', choices=PLAN_FORMATS,
+                        help="Do not download anything, only count the cameras, segments, frames, image tiles and bbox rows the search matches "
+                             "and estimate the bytes to download and to save, as 'text' or 'json' (default: text)")
+
+
+def get_plan(camera_frame_lists: dict):
+    """Counts what a search matches with aggregate queries, without fetching any video or image.
+
+    `camera_frame_lists` maps each `(activity, scene, camera)` to the frame list of its segments.
+    Sizes are in bytes; the sizes of the tiles are estimated from a sample.
+    """
+    import sparql
+
+    print("Planning...")
+    plan = {'cameras': len(camera_frame_lists), 'segments': 0, 'frames': 0, 'tiles': 0, 'bbox_rows': 0,
+            'video_bytes': 0, 'segment_video_bytes': 0, 'tile_bytes': 0}
+    video_sizes = sparql.get_video_sizes(list(camera_frame_lists)) if len(camera_frame_lists) > 0 else {}
+
+    segments = []
+    for camera, frame_list in camera_frame_lists.items():
+        counts = sparql.count_frames_batched(frame_list)
+        plan['segments'] += len([key for key in frame_list if key != 'all'])
+        plan['frames'] += counts['frames']
+        plan['tiles'] += counts['tiles']
+        plan['bbox_rows'] += counts['bboxes']
+        segments.extend(frame_list[key].get('segment', key) for key in frame_list if key != 'all')
+
+        video = video_sizes.get(camera)
+        if video is None:
+            continue
+        plan['video_bytes'] += video['size']
+        # Segment videos are cut from the camera video, so they take about its share of the frames.
+        if 'all' in frame_list or video['frames'] == 0:
+            plan['segment_video_bytes'] += video['size']
+        else:
+            segment_frames = sum(entry['end_frame'] - entry['start_frame'] + 1 for key, entry in frame_list.items() if key != 'all')
+            plan['segment_video_bytes'] += video['size'] * min(1, segment_frames / video['frames'])
+
+    if plan['tiles'] > 0:
+        plan['tile_bytes'] = plan['tiles'] * sparql.get_average_tile_size(list(dict.fromkeys(segments))[:SAMPLE_SEGMENTS])
+    plan['segment_video_bytes'] = int(plan['segment_video_bytes'])
+    plan['tile_bytes'] = int(plan['tile_bytes'])
+    return plan
+
+
+def print_plan(plan: dict, downloads: dict, outputs: dict, format: str = 'text'):
+    """Prints the counts of a plan with the estimated bytes to download and to save, given by kind."""
+    if format == 'json':
+        print(json.dumps({**plan, 'download_bytes': {**downloads, 'total': sum(downloads.values())},
+                          'output_bytes': {**outputs, 'total': sum(outputs.values())}}))
+        return
+
+    rows = [("cameras", str(plan['cameras'])), ("segments", str(plan['segments'])), ("frames", str(plan['frames'])),
+            ("image tiles", str(plan['tiles'])), ("bbox rows", str(plan['bbox_rows'])),
+            ("download (estimated)", format_sizes(downloads)), ("output (estimated)", format_sizes(outputs))]
+    width = max(len(name) for name, _ in rows)
+    print("Plan:")
+    for name, value in rows:
+        print("  " + name.ljust(width) + "  " + value)
+
+
+def format_sizes(sizes: dict):
+    return ", ".join([name + " " + format_size(size) for name, size in sizes.items()] + ["total " + format_size(sum(sizes.values()))])
+
+
+def format_size(size: float):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return "{:.1f} ".format(size) + unit
+        size /= 1024
+    return "{:.1f} TB".format(size)
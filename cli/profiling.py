@@ -0,0 +1,156 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+PROFILE_FORMATS = ['json', 'chrome']
+
+
+def add_arguments(parser):
+    parser.add_argument("--profile", action='store_true',
+                        help="Print a table of the time, bytes and rows of the SPARQL queries, downloads, decoding, ffmpeg runs, encoding and file writes at the end")
+    parser.add_argument("--profile-output", type=str,
+                        help="Also save every timed operation to this file, which implies --profile")
+    parser.add_argument("--profile-format", type=str, choices=PROFILE_FORMATS, default='json',
+                        help="The format of the profile file: 'json', or 'chrome' for the trace viewers of Chrome and Perfetto (default: json)")
+
+
+class Profiler:
+    """Collects the duration, bytes and rows of timed operations such as SPARQL queries or file writes.
+
+    Totals are kept per operation. The single operations are only kept if they are saved to a file,
+    so that long searches with many frames profile in constant memory.
+    """
+
+    def __init__(self, keep_spans: bool = False):
+        self.started_at = time.perf_counter()
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.spans = [] if keep_spans else None
+
+    def add(self, name: str, start: float, duration: float, bytes: int = 0, rows: int = 0):
+        with self.lock:
+            total = self.totals.setdefault(name, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'bytes': 0, 'rows': 0})
+            total['count'] += 1
+            total['seconds'] += duration
+            total['max_seconds'] = max(total['max_seconds'], duration)
+            total['bytes'] += bytes
+            total['rows'] += rows
+            if self.spans is not None:
+                self.spans.append((name, start - self.started_at, duration, threading.get_ident(), threading.current_thread().name, bytes, rows))
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        counts = {'bytes': 0, 'rows': 0}
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.add(name, start, time.perf_counter() - start, counts['bytes'], counts['rows'])
+
+    def print_summary(self):
+        wall_seconds = time.perf_counter() - self.started_at
+        with self.lock:
+            totals = sorted(self.totals.items(), key=lambda item: item[1]['seconds'], reverse=True)
+
+        rows = [["operation", "count", "total s", "mean ms", "max ms", "MB", "rows"]]
+        for name, total in totals:
+            rows.append([name, str(total['count']), "{:.3f}".format(total['seconds']), "{:.2f}".format(total['seconds'] / total['count'] * 1000),
+                         "{:.2f}".format(total['max_seconds'] * 1000), "{:.2f}".format(total['bytes'] / 1024 / 1024), str(total['rows'])])
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+
+        # Operations of concurrent pipeline stages overlap, so their totals may add up to more than the wall time.
+        print("Profile (wall time " + "{:.3f}".format(wall_seconds) + " s):")
+        for row in rows:
+            print("  " + row[0].ljust(widths[0]) + "  " + "  ".join(value.rjust(width) for value, width in zip(row[1:], widths[1:])))
+
+    def save(self, path: str, format: str = 'json'):
+        with self.lock:
+            spans = list(self.spans or [])
+            totals = {name: dict(total) for name, total in self.totals.items()}
+
+        if format == 'chrome':
+            # Complete events of the Trace Event Format, in microseconds.
+            data = {'traceEvents': [
+                {'name': name, 'cat': name.split('.')[0], 'ph': "X", 'ts': start * 1000000, 'dur': duration * 1000000,
+                 'pid': os.getpid(), 'tid': thread_id, 'args': {'thread': thread_name, 'bytes': bytes, 'rows': rows}}
+                for name, start, duration, thread_id, thread_name, bytes, rows in spans
+            ], 'displayTimeUnit': "ms"}
+        else:
+            data = {'totals': totals, 'spans': [
+                {'name': name, 'start': start, 'duration': duration, 'thread': thread_name, 'bytes': bytes, 'rows': rows}
+                for name, start, duration, _, thread_name, bytes, rows in spans
+            ]}
+
+        with open(path, "w") as file:
+            json.dump(data, file)
+        print("Profile saved to " + path)
+
+
+_profiler = None
+_output_path = None
+_output_format = 'json'
+
+
+def configure(enabled: bool = False, output_path: str | None = None, output_format: str = 'json'):
+    global _profiler, _output_path, _output_format
+    _profiler = Profiler(keep_spans=output_path is not None) if enabled or output_path is not None else None
+    _output_path = output_path
+    _output_format = output_format
+
+
+def is_enabled():
+    return _profiler is not None
+
+
+def now():
+    return time.perf_counter()
+
+
+def add(name: str, start: float, duration: float, bytes: int = 0, rows: int = 0):
+    """Records an operation timed by the caller, e.g. the time spent inside a generator."""
+    if _profiler is not None:
+        _profiler.add(name, start, duration, bytes, rows)
+
+
+def span(name: str):
+    """Times the operation run inside the context; the bytes and rows of the yielded dict are recorded with it."""
+    if _profiler is None:
+        return contextlib.nullcontext({'bytes': 0, 'rows': 0})
+    return _profiler.span(name)
+
+
+def iterate(name: str, iterator, size=None):
+    """Yields the items of an iterator, recording the time spent producing them but not the time the
+    caller spends on them. `size` returns the number of bytes of an item.
+    """
+    start = resumed_at = now()
+    elapsed = 0.0
+    rows = 0
+    bytes = 0
+    try:
+        for item in iterator:
+            elapsed += now() - resumed_at
+            resumed_at = None
+            rows += 1
+            if size is not None and _profiler is not None:
+                bytes += size(item)
+            yield item
+            resumed_at = now()
+    finally:
+        if resumed_at is not None:
+            elapsed += now() - resumed_at
+        # A stream left early is closed at once, so that its connection is released.
+        if hasattr(iterator, 'close'):
+            iterator.close()
+        add(name, start, elapsed, bytes, rows)
+
+
+def report():
+    """Prints the summary of the profile and saves it to the configured file, if profiling is enabled."""
+    if _profiler is None:
+        return
+    _profiler.print_summary()
+    if _output_path is not None:
+        _profiler.save(_output_path, _output_format)
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import profiling
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "vhakg-tools", "queries.sqlite3")
+DEFAULT_MAX_SIZE_MB = 512
+DEFAULT_TTL_DAYS = 30
+
+# Runs of whitespace outside of string literals and IRIs do not change the meaning of a query.
+QUERY_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|<[^<>\s]*>|\s+')
+
+
+def normalize_query(query: str):
+    return QUERY_TOKEN.sub(lambda match: " " if match.group().isspace() else match.group(), query).strip()
+
+
+class QueryCache:
+    """SQLite store of SPARQL query results with a time-to-live and a size-bounded LRU eviction policy.
+
+    Entries are keyed by the normalized query text and the dataset fingerprint, so a reloaded
+    repository never serves stale results. With `refresh`, cached results are not read but replaced.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, max_size_mb: int = DEFAULT_MAX_SIZE_MB, ttl_days: float = DEFAULT_TTL_DAYS, refresh: bool = False):
+        self.path = path
+        self.max_bytes = max_size_mb * 1024 * 1024
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+        self.refresh = refresh
+        self.fingerprint = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self.connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+
+    def connection(self):
+        # SQLite connections cannot be shared between threads.
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def key(self, kind: str, query: str):
+        import sparql
+
+        with self.lock:
+            if self.fingerprint is None:
+                self.fingerprint = sparql.get_dataset_fingerprint()
+        return hashlib.sha256((kind + "\n" + self.fingerprint + "\n" + normalize_query(query)).encode()).hexdigest()
+
+    def get_or_run(self, kind: str, query: str, run):
+        """Returns the cached result of a query, or runs it with `run()` and caches the result."""
+        key = self.key(kind, query)
+        now = time.time()
+        connection = self.connection()
+        if not self.refresh:
+            with profiling.span("query_cache.read") as span:
+                row = connection.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] <= self.ttl_seconds:
+                    with connection:
+                        connection.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+                    span['bytes'] = len(row[0])
+                    return json.loads(row[0])
+
+        result = run()
+        value = json.dumps(result)
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO results (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)", (key, value, len(value), now, now))
+        self.evict()
+        return result
+
+    def evict(self):
+        connection = self.connection()
+        with connection:
+            connection.execute("DELETE FROM results WHERE created < ?", (time.time() - self.ttl_seconds,))
+            total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            if total_size <= self.max_bytes:
+                return
+            for key, size in connection.execute("SELECT key, size FROM results ORDER BY accessed").fetchall():
+                if total_size <= self.max_bytes:
+                    break
+                connection.execute("DELETE FROM results WHERE key = ?", (key,))
+                total_size -= size
+
+
+_query_cache = None
+_configured = False
+
+
+def configure(enabled: bool = True, path: str = DEFAULT_PATH, max_size_mb: int = DEFAULT_MAX_SIZE_MB, ttl_days: float = DEFAULT_TTL_DAYS, refresh: bool = False):
+    global _query_cache, _configured
+    _query_cache = QueryCache(path, max_size_mb, ttl_days, refresh) if enabled and max_size_mb > 0 else None
+    _configured = True
+
+
+def add_arguments(parser):
+    parser.add_argument("--no-cache", action='store_true', help="Do not use the local cache of query results")
+    parser.add_argument("--refresh", action='store_true', help="Run all queries again and replace their cached results")
+    parser.add_argument("--query-cache-path", type=str, default=DEFAULT_PATH,
+                        help="The SQLite file of the local cache of query results (default: " + DEFAULT_PATH + ")")
+    parser.add_argument("--query-cache-size", type=int, default=DEFAULT_MAX_SIZE_MB,
+                        help="The size budget of the local cache of query results in MB (default: " + str(DEFAULT_MAX_SIZE_MB) + ")")
+    parser.add_argument("--query-cache-ttl", type=float, default=DEFAULT_TTL_DAYS,
+                        help="The number of days after which cached query results are run again (default: " + str(DEFAULT_TTL_DAYS) + ")")
+
+
+def get_cache():
+    if not _configured:
+        configure()
+    return _query_cache
@@ -0,0 +1,192 @@
+import argparse
+import importlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import export_manifest
+import mock_endpoint
+import pipeline
+import trimming
+
+# The synthetic data is searched for with these parameters, which match every event of `mock_endpoint`.
+ACTIVITY = "activity1"
+SCENE = "scene1"
+CAMERA = "camera1"
+ACTION = "grab"
+# The MMKG search takes the name of an object instance, the action-object search a part of its label.
+OBJECT_INSTANCE = "bread1"
+OBJECT = "bread"
+
+STAGES = ['get_frames', 'output_video', 'output_image', 'output_annotation',
+          'action_object_search', 'action_object_video', 'action_object_image', 'action_object_annotation']
+PERCENTILES = [50, 90, 99]
+
+
+def main():
+    args = get_args()
+    if args.run_stage is not None:
+        run_stage(args)
+        return
+
+    sizes = {name: getattr(args, name) for name in mock_endpoint.DEFAULT_SIZES}
+    print("Generating the synthetic data...", file=sys.stderr)
+    endpoint = mock_endpoint.MockEndpoint(mock_endpoint.build_graph(**sizes)).start()
+
+    report = {'sizes': sizes, 'iterations': args.iterations, 'warmup': args.warmup, 'stages': {}}
+    try:
+        for stage in args.stages or STAGES:
+            print("Benchmarking " + stage + "...", file=sys.stderr)
+            report['stages'][stage] = benchmark_stage(stage, endpoint.endpoint, args)
+    finally:
+        endpoint.stop()
+
+    data = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            file.write(data + "\n")
+        print("Report saved to " + args.output, file=sys.stderr)
+    else:
+        print(data)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        prog='run_benchmark',
+        description='Benchmark the search and export stages against a local mock SPARQL endpoint serving synthetic data, '
+                    'and report their throughput, latency percentiles and peak memory as JSON'
+    )
+
+    parser.add_argument("stages", type=str, nargs='*', choices=STAGES, metavar="STAGE",
+                        help="The stages to benchmark (" + ", ".join(STAGES) + ") (default: all)")
+    parser.add_argument("-n", "--iterations", type=int, default=5, help="The number of timed runs of each stage (default: 5)")
+    parser.add_argument("--warmup", type=int, default=1, help="The number of untimed runs of each stage before the timed ones (default: 1)")
+    parser.add_argument("-o", "--output", type=str, help="Save the report to this file instead of printing it")
+    for name, value in mock_endpoint.DEFAULT_SIZES.items():
+        parser.add_argument("--" + name.replace('_', '-'), type=int, default=value,
+                            help="The '" + name + "' size of the synthetic data (default: " + str(value) + ")")
+    trimming.add_arguments(parser)
+    pipeline.add_arguments(parser)
+    # Each stage runs in a fresh process, so that its peak memory is measured on its own.
+    parser.add_argument("--run-stage", type=str, choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--endpoint", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--result-path", type=str, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    if args.iterations < 1:
+        parser.error("the number of iterations must be at least 1")
+    return args
+
+
+def benchmark_stage(stage: str, endpoint: str, args):
+    with tempfile.TemporaryDirectory(prefix="vhakg-benchmark-") as directory:
+        result_path = os.path.join(directory, "result.json")
+        command = [sys.executable, os.path.abspath(__file__), "--run-stage", stage, "--endpoint", endpoint, "--result-path", result_path,
+                   "--iterations", str(args.iterations), "--warmup", str(args.warmup), "--trim-mode", args.trim_mode]
+        for name, number in pipeline.parse_jobs(args.jobs).items():
+            command += ["--jobs", name + "=" + str(number)]
+
+        # The stages print their progress, which is not part of the report.
+        process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if process.returncode != 0:
+            return {'status': 'failed', 'error': process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "exit code " + str(process.returncode)}
+        with open(result_path) as file:
+            result = json.load(file)
+
+    return summarize(result)
+
+
+def summarize(result: dict):
+    latencies = sorted(result['latencies'])
+    total_seconds = sum(latencies)
+    items = sum(result['items'])
+    written_bytes = sum(result['bytes'])
+    return {
+        'status': 'ok',
+        'latency_ms': {
+            **{'p' + str(p): percentile(latencies, p) * 1000 for p in PERCENTILES},
+            'mean': total_seconds / len(latencies) * 1000,
+            'min': latencies[0] * 1000,
+            'max': latencies[-1] * 1000,
+        },
+        'items_per_run': items / len(latencies),
+        'items_per_second': items / total_seconds if total_seconds > 0 else None,
+        'written_mb_per_second': written_bytes / 1024 / 1024 / total_seconds if total_seconds > 0 else None,
+        'peak_rss_mb': result['peak_rss_kb'] / 1024,
+    }
+
+
+def percentile(values: list, p: int):
+    """Returns the p-th percentile of sorted values by the nearest-rank method."""
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
+
+def run_stage(args):
+    import query_cache
+    import sparql
+    import video_cache
+    import vocabulary
+
+    sparql.configure(args.endpoint)
+    # Nothing is cached between runs, so that every run does the full work of a search.
+    query_cache.configure(False)
+    video_cache.configure(None, 0)
+    vocabulary.configure(False)
+    pipeline.configure(pipeline.parse_jobs(args.jobs))
+
+    mmkg_search = importlib.import_module('mmkg-search')
+    action_object_search = importlib.import_module('action-object-search')
+
+    # The searches the output stages depend on run once, outside of the timed runs.
+    frame_list = None
+    video_segments = None
+    if args.run_stage.startswith('output_'):
+        frame_list = mmkg_search.get_frames(ACTIVITY, SCENE, CAMERA, None, None, None, OBJECT_INSTANCE)
+    elif args.run_stage != 'action_object_search':
+        video_segments = sparql.get_frames_of_video_segment(ACTION, OBJECT, None, None)
+
+    def run(output_path: str):
+        if args.run_stage == 'get_frames':
+            return len(mmkg_search.get_frames(ACTIVITY, SCENE, CAMERA, None, None, ACTION, OBJECT_INSTANCE))
+        if args.run_stage == 'output_video':
+            mmkg_search.output_video(ACTIVITY, SCENE, CAMERA, frame_list, output_path, args.trim_mode)
+        elif args.run_stage == 'output_image':
+            mmkg_search.output_image(frame_list, output_path)
+        elif args.run_stage == 'output_annotation':
+            mmkg_search.output_annotation(ACTIVITY, SCENE, CAMERA, frame_list, output_path)
+        elif args.run_stage == 'action_object_search':
+            return len(sparql.get_frames_of_video_segment(ACTION, OBJECT, None, None))
+        elif args.run_stage == 'action_object_video':
+            action_object_search.output_video_segment(video_segments, output_path, args.trim_mode)
+        elif args.run_stage == 'action_object_image':
+            action_object_search.output_object_containing_image(video_segments, OBJECT, None, output_path)
+        elif args.run_stage == 'action_object_annotation':
+            action_object_search.generate_tsv(video_segments, OBJECT, None, output_path)
+        pipeline.wait()
+        return None
+
+    result = {'latencies': [], 'items': [], 'bytes': []}
+    for i in range(args.warmup + args.iterations):
+        with tempfile.TemporaryDirectory(prefix="vhakg-benchmark-") as output_path:
+            start = time.perf_counter()
+            items = run(output_path)
+            latency = time.perf_counter() - start
+            files = [os.path.join(root, name) for root, _, names in os.walk(output_path) for name in names if export_manifest.is_output_file(name)]
+            if i < args.warmup:
+                continue
+            # The output stages are measured in saved files, the searches in found segments.
+            result['latencies'].append(latency)
+            result['items'].append(items if items is not None else len(files))
+            result['bytes'].append(sum(os.path.getsize(file) for file in files))
+
+    # On Linux, the maximum resident set size is in kilobytes.
+    result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(args.result_path, "w") as file:
+        json.dump(result, file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+import argparse
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import contextlib
+import importlib
+import json
+import os
+import socketserver
+import tarfile
+import threading
+import uuid
+import sparql
+import video_cache
+import query_cache
+import vocabulary
+import segment_index
+import trimming
+import pipeline
+import annotation_dataset
+import shards
+import profiling
+import export_manifest
+
+batch_search = importlib.import_module('batch-search')
+action_object_search = importlib.import_module('action-object-search')
+
+DEFAULT_PORT = 8765
+
+
+def main():
+    args = get_args()
+
+    sparql.configure(args.endpoint)
+    query_cache.configure(not args.no_cache, args.query_cache_path, args.query_cache_size, args.query_cache_ttl, args.refresh)
+    video_cache.configure(args.video_cache_dir, args.video_cache_size)
+    pipeline.configure(pipeline.parse_jobs(args.jobs))
+    shards.configure(args.shard_size)
+    profiling.configure(args.profile, args.profile_output, args.profile_format)
+    export_manifest.configure(not args.no_resume, args.verify_resume)
+
+    # Everything that is slow to start is set up once and kept for all requests.
+    action_object_search.wait_for_database()
+    vocabulary.configure(args.vocabulary_index, args.vocabulary_index_dir)
+    segment_index.configure(args.segment_index, args.segment_index_dir)
+
+    SearchHandler.output_root = Path(args.output_path).resolve()
+    annotation_dataset.configure(args.annotation_format, str(SearchHandler.output_root))
+    SearchHandler.output_paths = OutputPaths()
+    SearchHandler.searches = batch_search.Searches()
+    SearchHandler.trim_mode = args.trim_mode
+    SearchHandler.max_frames_in_flight = args.max_frames_in_flight
+    SearchHandler.annotation_format = args.annotation_format
+    SearchHandler.output_format = args.output_format
+
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = ThreadingUnixHTTPServer(args.socket, SearchHandler)
+        print("Listening on " + args.socket)
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), SearchHandler)
+        print("Listening on http://" + args.host + ":" + str(args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        profiling.report()
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        prog='search_server',
+        description='Serve searches of the RDF database over a local HTTP API, keeping the connections, the vocabulary index and the video cache warm'
+    )
+
+    parser.add_argument("output_path", type=str, help="The directory to save the search results in (can be relative or absolute)")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="The address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="The port to listen on (default: " + str(DEFAULT_PORT) + ")")
+    parser.add_argument("--socket", type=str, help="Listen on this Unix socket instead of a TCP port")
+    parser.add_argument('--max-frames-in-flight', type=int, default=sparql.MAX_FRAMES_IN_FLIGHT, help='The maximum number of images held in memory while exporting')
+    sparql.add_arguments(parser)
+    query_cache.add_arguments(parser)
+    video_cache.add_arguments(parser)
+    vocabulary.add_arguments(parser)
+    segment_index.add_arguments(parser)
+    trimming.add_arguments(parser)
+    pipeline.add_arguments(parser)
+    annotation_dataset.add_arguments(parser)
+    shards.add_arguments(parser)
+    profiling.add_arguments(parser)
+    export_manifest.add_arguments(parser)
+
+    return parser.parse_args()
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class OutputPaths:
+    """The output paths of the requests being served.
+
+    The shard writers and export manifests of an output path and the paths under it are shared and
+    closed at the end of a request, so a request waits while another one saves to its output path
+    or to a path above or below it.
+    """
+
+    def __init__(self):
+        self.paths = []
+        self.condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def use(self, path: Path):
+        with self.condition:
+            while any(path.is_relative_to(other) or other.is_relative_to(path) for other in self.paths):
+                self.condition.wait()
+            self.paths.append(path)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.paths.remove(path)
+                self.condition.notify_all()
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """Runs a search per `POST /search` request.
+
+    The request body is a JSON object with the same fields as an entry of a batch manifest. The
+    response lists the saved files as JSON, or is a tar archive of them if `archive` is true.
+    """
+
+    output_root = None
+    output_paths = None
+    searches = None
+    trim_mode = 'exact'
+    max_frames_in_flight = sparql.MAX_FRAMES_IN_FLIGHT
+    annotation_format = 'tsv'
+    output_format = 'files'
+
+    def address_string(self):
+        # Clients of a Unix socket have no address.
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {'status': 'failed', 'error': "Not found"})
+            return
+        self.send_json(200, {'status': 'ok'})
+
+    def do_POST(self):
+        if self.path != "/search":
+            self.send_json(404, {'status': 'failed', 'error': "Not found"})
+            return
+
+        try:
+            entry = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if not isinstance(entry, dict):
+                raise ValueError("The request body must be a JSON object")
+            entry = {key: value for key, value in entry.items() if value not in (None, '')}
+            output_path = (self.output_root / entry.pop('output_path', uuid.uuid4().hex)).resolve()
+            if not output_path.is_relative_to(self.output_root):
+                raise ValueError("The output path must be inside the output path of the server")
+        except ValueError as e:
+            self.send_json(400, {'status': 'failed', 'error': str(e)})
+            return
+
+        is_archive = batch_search.to_bool(entry.pop('archive', False))
+        with self.output_paths.use(output_path):
+            self.search(entry, output_path, is_archive)
+
+    def search(self, entry: dict, output_path: Path, is_archive: bool):
+        with pipeline.job() as job:
+            try:
+                batch_search.search(self.searches, entry, str(output_path), self.trim_mode, self.max_frames_in_flight, self.annotation_format, self.output_format)
+                errors = []
+            except Exception as e:
+                errors = [e]
+        errors = job.wait() + errors
+        shards.close(str(output_path))
+        export_manifest.close(str(output_path))
+        if len(errors) > 0:
+            self.send_json(500, {'status': 'failed', 'error': repr(errors[0])})
+            return
+
+        # Files saved outside of the output path, e.g. to the annotation dataset of the server, are found in the export manifests.
+        files = {str(path) for path in output_path.rglob("*") if path.is_file()} | set(export_manifest.get_recorded_files(str(output_path)))
+        files = sorted(file for file in files if export_manifest.is_output_file(file))
+        if not is_archive:
+            self.send_json(200, {'status': 'ok', 'output_path': str(output_path), 'files': files})
+            return
+
+        # The archive is streamed as it is written, so it is never held in memory.
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-tar")
+        self.end_headers()
+        with tarfile.open(fileobj=self.wfile, mode="w|") as archive:
+            for file in files:
+                # Files outside of the output path are archived at their path in the output path of the server.
+                archive.add(file, arcname=os.path.relpath(file, output_path if Path(file).is_relative_to(output_path) else self.output_root))
+
+    def send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+if __name__ == '__main__':
+    main()
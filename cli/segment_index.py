@@ -0,0 +1,111 @@
+import bisect
+import json
+import os
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "vhakg-tools", "segments")
+
+
+class IntervalIndex:
+    """Interval index of the start and end frames of the segments of one camera video.
+
+    The segments are sorted by their start frame, next to the running maximum of their end frames,
+    so the segments overlapping a frame range are found with two binary searches instead of a scan.
+    """
+
+    def __init__(self, segments: dict):
+        self.segments = segments
+        self.names = sorted(segments, key=lambda name: (segments[name]['start_frame'], segments[name]['end_frame']))
+        self.start_frames = [segments[name]['start_frame'] for name in self.names]
+        self.max_end_frames = []
+        for name in self.names:
+            end_frame = segments[name]['end_frame']
+            self.max_end_frames.append(max(self.max_end_frames[-1], end_frame) if len(self.max_end_frames) > 0 else end_frame)
+
+    def overlapping(self, start_frame: int | None, end_frame: int | None):
+        """Returns the names of the segments overlapping a frame range, in the order of their start frames.
+
+        A missing start or end frame means the beginning or the end of the video.
+        """
+        # Segments before `low` end before the range, segments from `high` on start after it.
+        low = 0 if start_frame is None else bisect.bisect_left(self.max_end_frames, start_frame)
+        high = len(self.names) if end_frame is None else bisect.bisect_right(self.start_frames, end_frame)
+        return [name for name in self.names[low:high] if start_frame is None or start_frame <= self.segments[name]['end_frame']]
+
+    def clip(self, start_frame: int | None, end_frame: int | None):
+        """Returns the segments overlapping a frame range, with their frames clipped to the range."""
+        frame_list = {}
+        for name in self.overlapping(start_frame, end_frame):
+            segment = self.segments[name]
+            frame_list[name] = {**segment,
+                                'start_frame': segment['start_frame'] if start_frame is None else max(start_frame, segment['start_frame']),
+                                'end_frame': segment['end_frame'] if end_frame is None else min(end_frame, segment['end_frame'])}
+        return frame_list
+
+    def clip_ranges(self, ranges: list):
+        """Clips the segments to each `(start_frame, end_frame)` of a list, e.g. the windows of a sliding window."""
+        return [self.clip(start_frame, end_frame) for start_frame, end_frame in ranges]
+
+
+class SegmentIndex:
+    """Local index of the segments of every camera video of the knowledge graph.
+
+    The segments of all cameras are fetched with one query and kept per `activity_scene_camera`,
+    so the segments of any frame range are looked up without querying the database.
+    """
+
+    def __init__(self, cameras: dict):
+        self.cameras = {camera: IntervalIndex(segments) for camera, segments in cameras.items()}
+
+    @classmethod
+    def load(cls, directory: str = DEFAULT_DIRECTORY):
+        import sparql
+
+        path = os.path.join(directory, sparql.get_dataset_fingerprint() + ".json")
+        if os.path.exists(path):
+            with open(path) as file:
+                cameras = json.load(file)
+        else:
+            print("Building the segment index...")
+            cameras = sparql.get_segment_intervals()
+            os.makedirs(directory, exist_ok=True)
+            with open(path + ".part", "w") as file:
+                json.dump(cameras, file)
+            os.replace(path + ".part", path)
+
+        return cls(cameras)
+
+    def get(self, activity: str, scene: str, camera: str):
+        """Returns the interval index of a camera video; it is empty if the video has no segments."""
+        return self.cameras.get(activity + "_" + scene + "_" + camera, IntervalIndex({}))
+
+
+_segment_index = None
+
+
+def configure(enabled: bool, directory: str = DEFAULT_DIRECTORY):
+    global _segment_index
+    _segment_index = SegmentIndex.load(directory) if enabled else None
+
+
+def add_arguments(parser):
+    parser.add_argument("--segment-index", action='store_true',
+                        help="Look up the segments of the camera in a local index of the segments of all cameras instead of the RDF database")
+    parser.add_argument("--segment-index-dir", type=str, default=DEFAULT_DIRECTORY,
+                        help="The directory of the local segment index (default: " + DEFAULT_DIRECTORY + ")")
+
+
+def get_index():
+    return _segment_index
+
+
+def get_frame_lists(activity: str, scene: str, camera: str, ranges: list):
+    """Returns the frame list of all segments of a camera for each `(start_frame, end_frame)` of a list.
+
+    The segments are looked up in the segment index, or searched for once if it is not enabled, and
+    every range is resolved against them with binary searches, e.g. for the windows of a sliding window.
+    """
+    import sparql
+
+    intervals = _segment_index.get(activity, scene, camera) if _segment_index is not None else IntervalIndex(sparql.get_all_frames(activity, scene, camera))
+    return [{'all': {'start_frame': start_frame, 'end_frame': end_frame}, **frame_list}
+            for (start_frame, end_frame), frame_list in zip(ranges, intervals.clip_ranges(ranges))]
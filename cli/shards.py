@@ -0,0 +1,118 @@
+import io
+import json
+import os
+import tarfile
+import threading
+
+import profiling
+
+OUTPUT_FORMATS = ['files', 'shards']
+DEFAULT_SHARD_SIZE_MB = 1024
+
+
+def add_arguments(parser):
+    parser.add_argument("--output-format", type=str, choices=OUTPUT_FORMATS, default='files',
+                        help="How frames and their annotations are saved: one file each, or packed into tar 'shards' "
+                             "with an index for sequential reads by data loaders (default: files)")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE_MB,
+                        help="The maximum size of a shard in MB (default: " + str(DEFAULT_SHARD_SIZE_MB) + ")")
+
+
+class ShardWriter:
+    """Packs samples into numbered tar shards of a bounded size, in the layout of WebDataset.
+
+    The files of a sample are stored next to each other as `<key>.<extension>`, so a shard can be
+    read sequentially sample by sample. `index.jsonl` records for every sample its shard, the offset
+    of its first member in the shard and the sizes of its files.
+
+    Shards already in the directory, e.g. of an earlier run, are kept: new shards are numbered after
+    them and their samples are appended to the index.
+    """
+
+    def __init__(self, directory: str, max_shard_size_mb: int = DEFAULT_SHARD_SIZE_MB):
+        self.directory = directory
+        self.max_shard_bytes = max_shard_size_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        self.shard_number = max(get_shard_numbers(directory), default=-1)
+        self.shard_name = None
+        self.tar = None
+        os.makedirs(self.directory, exist_ok=True)
+        self.index_file = open(os.path.join(self.directory, "index.jsonl"), "a")
+
+    def next_shard(self):
+        if self.tar is not None:
+            self.tar.close()
+            print("Shard saved to " + os.path.join(self.directory, self.shard_name))
+        self.shard_number += 1
+        self.shard_name = "shard-" + str(self.shard_number).zfill(6) + ".tar"
+        self.tar = tarfile.open(os.path.join(self.directory, self.shard_name), "w")
+
+    def add(self, key: str, files: dict):
+        """Adds a sample whose files are given as `{extension: bytes}`."""
+        # Each member takes a 512-byte header and is padded to a multiple of 512 bytes.
+        sample_size = sum(512 + (len(data) + 511) // 512 * 512 for data in files.values())
+        with self.lock, profiling.span("file.write") as span:
+            span['bytes'] = sample_size
+            if self.tar is None or (self.tar.offset > 0 and self.tar.offset + sample_size > self.max_shard_bytes):
+                self.next_shard()
+
+            offset = self.tar.offset
+            for extension, data in files.items():
+                info = tarfile.TarInfo(key + "." + extension)
+                info.size = len(data)
+                self.tar.addfile(info, io.BytesIO(data))
+            self.index_file.write(json.dumps({'key': key, 'shard': self.shard_name, 'offset': offset,
+                                              'sizes': {extension: len(data) for extension, data in files.items()}}) + "\n")
+
+    def close(self):
+        with self.lock:
+            if self.tar is not None:
+                self.tar.close()
+                print("Shard saved to " + os.path.join(self.directory, self.shard_name))
+                self.tar = None
+            self.index_file.close()
+
+
+def get_shard_numbers(directory: str):
+    if not os.path.isdir(directory):
+        return []
+    names = [name for name in os.listdir(directory) if name.startswith("shard-") and name.endswith(".tar")]
+    return [int(name[len("shard-"):-len(".tar")]) for name in names if name[len("shard-"):-len(".tar")].isdigit()]
+
+
+def bbox_metadata(annotation: dict):
+    import annotation_dataset
+
+    left_x, top_y, right_x, bottom_y = annotation_dataset.parse_bbox(annotation['2dbbox'])
+    return {'object': annotation['object'], 'left_x': left_x, 'top_y': top_y, 'right_x': right_x, 'bottom_y': bottom_y}
+
+
+def action_metadata(annotation: dict):
+    return {key: annotation[key] for key in ['action', 'main_object', 'target_object', 'start_frame', 'end_frame']}
+
+
+_writers = {}
+_lock = threading.Lock()
+_max_shard_size_mb = DEFAULT_SHARD_SIZE_MB
+
+
+def configure(max_shard_size_mb: int = DEFAULT_SHARD_SIZE_MB):
+    global _max_shard_size_mb
+    _max_shard_size_mb = max_shard_size_mb
+
+
+def get_writer(output_path: str):
+    """Returns the shard writer of an output path, which is shared by all searches saving there."""
+    directory = os.path.abspath(os.path.join(output_path, "shards"))
+    with _lock:
+        if directory not in _writers:
+            _writers[directory] = ShardWriter(directory, _max_shard_size_mb)
+        return _writers[directory]
+
+
+def close(output_path: str | None = None):
+    """Closes the shard writers of an output path and the paths under it, or all of them."""
+    with _lock:
+        for directory in list(_writers):
+            if output_path is None or directory.startswith(os.path.abspath(output_path) + os.sep):
+                _writers.pop(directory).close()
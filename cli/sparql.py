@@ -1,56 +1,215 @@
+import os
+
 PREFIX_EX = "http://kgrc4si.home.kg/virtualhome2kg/instance/"
 PREFIX_VH2KG = "http://kgrc4si.home.kg/virtualhome2kg/ontology/"
-ENDPOINT = "http://localhost:7200/repositories/kgrc4si"
+ENDPOINT = os.environ.get("VHAKG_SPARQL_ENDPOINT", "http://localhost:7200/repositories/kgrc4si")
+ANNOTATION_BATCH_SIZE = 50
+MAX_FRAMES_IN_FLIGHT = 16
+
+_client = None
+
+
+def configure(endpoint: str = ENDPOINT):
+    global _client
+    if endpoint.startswith("http://") or endpoint.startswith("https://"):
+        from sparql_client import SparqlClient
+        _client = SparqlClient(endpoint)
+    else:
+        # Anything else is the path of a local store built from the .ttl files, searched without a server.
+        from local_store import LocalStoreClient
+        _client = LocalStoreClient(endpoint)
+
+
+def add_arguments(parser):
+    parser.add_argument("--endpoint", type=str, default=ENDPOINT,
+                        help="The SPARQL endpoint of the RDF database, or the path of a local store built with build-local-store.py (default: " + ENDPOINT + ")")
+
+
+def get_client():
+    if _client is None:
+        configure()
+    return _client
+
+
+def select(query: str):
+    """Runs a SELECT query, taking its results from the local query cache if possible."""
+    import query_cache
+
+    cache = query_cache.get_cache()
+    if cache is None:
+        return get_client().select(query)
+    return cache.get_or_run("select", query, lambda: get_client().select(query))
+
+
+def select_stream(query: str):
+    """Runs a SELECT query and iterates over its rows; rows from the query cache are read at once."""
+    import query_cache
+
+    cache = query_cache.get_cache()
+    if cache is None:
+        return get_client().select_stream(query)
+    return iter(cache.get_or_run("rows", query, lambda: list(get_client().select_stream(query))))
 
 
 def check_database_connection():
-    from SPARQLWrapper import SPARQLWrapper, JSON
-    sparql = SPARQLWrapper(ENDPOINT)
-    sparql.setQuery("ASK {}")
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
-    return results["boolean"]
+    return get_client().ask("ASK {}")
+
+
+def get_dataset_fingerprint():
+    import hashlib
+    from sparql_client import SparqlError
+
+    client = get_client()
+    # The dataset never changes after `importrdf preload`, so the statement count of the
+    # repository (RDF4J REST API) together with the endpoint identifies the loaded data.
+    try:
+        size = client.get("/size").decode().strip()
+    except (OSError, SparqlError):
+        size = "unknown"
+
+    return hashlib.sha256((client.endpoint + "#" + size).encode()).hexdigest()[:16]
+
+
+def get_vocabulary():
+    print("Searching for the vocabulary...")
+    vocabulary = {'actions': [], 'objects': {}, 'cameras': []}
+
+    queries = {
+        'actions': "SELECT DISTINCT ?action WHERE { ?event vh2kg:action ?action . }",
+        'objects': "SELECT DISTINCT ?object ?label WHERE { ?event vh2kg:mainObject|vh2kg:targetObject ?object . ?object rdfs:label ?label . }",
+        'cameras': "SELECT DISTINCT ?camera WHERE { ?scene vh2kg:hasVideo ?camera . }",
+    }
+    for name, query in queries.items():
+        results = select("""
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
+""" + query)
+
+        bindings = results["results"]["bindings"]
+        for result in bindings:
+            if name == 'objects':
+                vocabulary['objects'].setdefault(result["label"]["value"], []).append(result["object"]["value"])
+            else:
+                vocabulary[name].append(result[name[:-1]]["value"])
+
+    return vocabulary
+
+
+def values_clause(variable: str, iris: list):
+    return "VALUES ?" + variable + " { " + " ".join("<" + iri + ">" for iri in iris) + " } ."
+
+
+def match_object_label(variable: str, name: str):
+    import vocabulary
+
+    index = vocabulary.get_index()
+    if index is not None:
+        return values_clause(variable, index.resolve_objects(name))
+    return f'?{variable} rdfs:label ?{variable}_label FILTER regex(?{variable}_label, "{name}", "i") .'
+
+
+def match_action(action: str):
+    import vocabulary
+
+    index = vocabulary.get_index()
+    if index is not None:
+        return values_clause("action", index.resolve_actions(action))
+    return f'FILTER regex(STR(?action), "{action}", "i") .'
+
+
+def match_camera(camera: str):
+    import vocabulary
+
+    index = vocabulary.get_index()
+    if index is not None:
+        return values_clause("camera", index.resolve_cameras(camera))
+    return f'FILTER regex(STR(?camera), "camera{camera}", "i") .'
 
 
 def get_all_frames(activity, scene, camera):
+    return get_all_frames_of_cameras(activity, scene, [camera]).get(camera, {})
+
+
+def get_all_frames_of_cameras(activity, scene, cameras):
+    """Searches for the segments of the videos of several cameras at once; they are returned by camera."""
     print("Searching for all frames...")
-    from SPARQLWrapper import SPARQLWrapper, JSON
-    frame_list = {}
+    camera_frame_lists = {}
 
     query = """
 PREFIX ex: <http://kgrc4si.home.kg/virtualhome2kg/instance/>
 PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
 PREFIX mssn: <http://mssn.sigappfr.org/mssn/>
-select DISTINCT ?segment ?start_frame ?end_frame where {
-    ex:""" + activity + "_" + scene + "_" + camera + """ mssn:hasMediaSegment ?segment.
+select DISTINCT ?camera ?segment ?start_frame ?end_frame where {
+    """ + camera_values(activity, scene, cameras) + """
+    ?camera mssn:hasMediaSegment ?segment.
     ?segment vh2kg:hasStartFrame ?start_frame ;
              vh2kg:hasEndFrame ?end_frame .
 }
     """
-    sparql = SPARQLWrapper(ENDPOINT)
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
+    results = select(query)
 
     bindings = results["results"]["bindings"]
     for result in bindings:
         segment = result["segment"]["value"].replace(PREFIX_EX, "")
+        frame_list = camera_frame_lists.setdefault(camera_name(activity, scene, result), {})
         frame_list[segment] = {'start_frame': int(result["start_frame"]["value"]), 'end_frame': int(result["end_frame"]["value"])}
 
-    return frame_list
+    return camera_frame_lists
+
+
+def get_segment_intervals():
+    """Returns the start and end frames of the segments of all camera videos, keyed by `activity_scene_camera`."""
+    print("Searching for the segments of all cameras...")
+    cameras = {}
+
+    query = """
+PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
+PREFIX mssn: <http://mssn.sigappfr.org/mssn/>
+select ?camera ?segment ?start_frame ?end_frame where {
+    ?scene vh2kg:hasVideo ?camera .
+    ?camera mssn:hasMediaSegment ?segment .
+    ?segment vh2kg:hasStartFrame ?start_frame ;
+             vh2kg:hasEndFrame ?end_frame .
+}"""
+    for result in select_stream(query):
+        camera = result["camera"]["value"].replace(PREFIX_EX, "")
+        segment = result["segment"]["value"].replace(PREFIX_EX, "")
+        cameras.setdefault(camera, {})[segment] = {'start_frame': int(result["start_frame"]["value"]), 'end_frame': int(result["end_frame"]["value"])}
+
+    return cameras
+
+
+def get_scene_cameras(activity, scene):
+    """Returns the names of the cameras that recorded an activity in a scene, e.g. `camera1`."""
+    query = """
+PREFIX ex: <http://kgrc4si.home.kg/virtualhome2kg/instance/>
+PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
+select DISTINCT ?camera where {
+    ex:""" + activity + "_" + scene + """ vh2kg:hasVideo ?camera .
+}"""
+    cameras = [camera_name(activity, scene, result) for result in select(query)["results"]["bindings"]]
+    return sorted(cameras, key=lambda camera: (len(camera), camera))
 
 
-def get_frames_from_action(activity, scene, camera, action):
+def camera_values(activity, scene, cameras):
+    return values_clause("camera", [PREFIX_EX + activity + "_" + scene + "_" + camera for camera in cameras])
+
+
+def camera_name(activity, scene, result):
+    return result["camera"]["value"].replace(PREFIX_EX + activity + "_" + scene + "_", "")
+
+
+def get_frames_from_action_of_cameras(activity, scene, cameras, action):
     print("Searching for frames from event...")
-    from SPARQLWrapper import SPARQLWrapper, JSON
-    frame_list = {}
+    camera_frame_lists = {}
 
     query = """
 PREFIX ex: <http://kgrc4si.home.kg/virtualhome2kg/instance/>
 PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
 PREFIX mssn: <http://mssn.sigappfr.org/mssn/>
-select DISTINCT ?segment ?start_frame ?end_frame where {
-    ex:""" + activity + "_" + scene + "_" + camera + """ mssn:hasMediaSegment ?segment.
+select DISTINCT ?camera ?segment ?start_frame ?end_frame where {
+    """ + camera_values(activity, scene, cameras) + """
+    ?camera mssn:hasMediaSegment ?segment.
     ?segment vh2kg:isVideoSegmentOf ?event ;
              vh2kg:hasStartFrame ?start_frame ;
              vh2kg:hasEndFrame ?end_frame .
@@ -58,91 +217,171 @@ select DISTINCT ?segment ?start_frame ?end_frame where {
     filter (regex(str(?action), '""" + action + """'))
 }
     """
-    sparql = SPARQLWrapper(ENDPOINT)
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
+    results = select(query)
 
     bindings = results["results"]["bindings"]
     for result in bindings:
         segment = result["segment"]["value"].replace(PREFIX_EX, "")
+        frame_list = camera_frame_lists.setdefault(camera_name(activity, scene, result), {})
         frame_list[segment] = {'start_frame': int(result["start_frame"]["value"]), 'end_frame': int(result["end_frame"]["value"])}
 
-    return frame_list
+    return camera_frame_lists
 
 
-def get_frames_from_object(activity, scene, camera, action, object):
+def get_frames_from_object_of_cameras(activity, scene, cameras, action, object):
     print("Searching for frames from object...")
-    from SPARQLWrapper import SPARQLWrapper, JSON
-    frame_list = {}
+    camera_frame_lists = {}
 
+    # Only the first and the last frame of each segment are needed, so they are aggregated by the database.
     query = """
 PREFIX ex: <http://kgrc4si.home.kg/virtualhome2kg/instance/>
 PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
 PREFIX mssn: <http://mssn.sigappfr.org/mssn/>
-select DISTINCT ?segment ?frame_number where {
-    ex:""" + activity + "_" + scene + "_" + camera + """ mssn:hasMediaSegment ?segment.
-    ?segment mssn:hasMediaDescriptor ?descriptor .
-    ?descriptor mssn:hasMediaDescriptor ?descriptor_object ;
-                     vh2kg:frameNumber ?frame_number .
-    ?descriptor_object vh2kg:is2DbboxOf ex:""" + object + "_" + scene + """ .
-    """
-    if action is not None:
-        query += """
-    ?event vh2kg:action ?action .
-    filter (regex(str(?action), '""" + action + """'))
-        """
-    query += "} order by asc(?frame_number)"
+select ?camera ?segment (MIN(?frame_number) as ?start_frame) (MAX(?frame_number) as ?end_frame) where {
+    """ + camera_values(activity, scene, cameras) + """
+    """ + object_frame_pattern(scene, object, "?frame_number") + """
+    """ + action_filter(action) + """
+} group by ?camera ?segment order by asc(?start_frame)"""
+
+    for result in select_stream(query):
+        segment = result["segment"]["value"].replace(PREFIX_EX, "")
+        frame_list = camera_frame_lists.setdefault(camera_name(activity, scene, result), {})
+        frame_list[segment] = {'start_frame': int(result["start_frame"]["value"]), 'end_frame': int(result["end_frame"]["value"])}
 
-    sparql = SPARQLWrapper(ENDPOINT)
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
+    return camera_frame_lists
 
-    bindings = results["results"]["bindings"]
-    frames = {}
 
-    for result in bindings:
+def get_visibility_runs_from_object_of_cameras(activity, scene, cameras, action, object, gap_tolerance=0):
+    """Searches for the runs of consecutive frames in which an object is visible in the videos of several cameras.
+
+    Frames at most `gap_tolerance` frames apart belong to the same run. The visible frames are
+    fetched in order and split into runs in one pass. The runs are keyed by the segment name and
+    their index in the segment, and hold the name of their segment in 'segment'.
+    """
+    print("Searching for visibility runs from object...")
+    camera_frame_lists = {}
+
+    query = """
+PREFIX ex: <http://kgrc4si.home.kg/virtualhome2kg/instance/>
+PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
+PREFIX mssn: <http://mssn.sigappfr.org/mssn/>
+select DISTINCT ?camera ?segment ?frame_number where {
+    """ + camera_values(activity, scene, cameras) + """
+    """ + object_frame_pattern(scene, object, "?frame_number") + """
+    """ + action_filter(action) + """
+} order by asc(?camera) asc(?segment) asc(?frame_number)"""
+
+    run = None
+    run_counts = {}
+    for result in select_stream(query):
+        camera = camera_name(activity, scene, result)
         segment = result["segment"]["value"].replace(PREFIX_EX, "")
         frame_number = int(result["frame_number"]["value"])
-        if segment not in frames:
-            frames[segment] = [frame_number]
-        else:
-            frames[segment].append(frame_number)
+        # A run continues while the next visible frame of the segment is at most `gap_tolerance + 1` frames later.
+        if run is not None and run[0] == camera and run[1]['segment'] == segment and frame_number - run[1]['end_frame'] <= gap_tolerance + 1:
+            run[1]['end_frame'] = frame_number
+            continue
+        run_counts[segment] = run_counts.get(segment, 0) + 1
+        run = (camera, {'segment': segment, 'start_frame': frame_number, 'end_frame': frame_number})
+        camera_frame_lists.setdefault(camera, {})[segment + "_run" + str(run_counts[segment])] = run[1]
 
-    for segment in frames:
-        frame_list[segment] = {'start_frame': min(frames[segment]), 'end_frame': max(frames[segment])}
+    return {camera: dict(sorted(frame_list.items(), key=lambda item: item[1]['start_frame'])) for camera, frame_list in camera_frame_lists.items()}
 
-    return frame_list
 
+def object_frame_pattern(scene, object, frame_number_variable, segment_variable="?segment"):
+    suffix = frame_number_variable.lstrip("?")
+    return """?camera mssn:hasMediaSegment """ + segment_variable + """ .
+    """ + segment_variable + """ mssn:hasMediaDescriptor ?descriptor_""" + suffix + """ .
+    ?descriptor_""" + suffix + """ mssn:hasMediaDescriptor ?descriptor_object_""" + suffix + """ ;
+                     vh2kg:frameNumber """ + frame_number_variable + """ .
+    ?descriptor_object_""" + suffix + """ vh2kg:is2DbboxOf ex:""" + object + "_" + scene + """ ."""
+
+
+def action_filter(action):
+    if action is None:
+        return ""
+    return """?event vh2kg:action ?action .
+    filter (regex(str(?action), '""" + action + """'))"""
 
-def get_video(activity, scene, camera):
-    print("Getting video...")
-    from SPARQLWrapper import SPARQLWrapper, JSON
 
+def get_video_frame_rate(activity, scene, camera):
     query = """
 PREFIX ex: <http://kgrc4si.home.kg/virtualhome2kg/instance/>
 PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
-select DISTINCT ?frame_rate ?video where {
+select DISTINCT ?frame_rate where {
     ex:""" + activity + "_" + scene + "_" + camera + """ vh2kg:frameRate ?frame_rate ;
-                                                         vh2kg:video ?video .
+                                                         vh2kg:video [] .
 }
     """
-    sparql = SPARQLWrapper(ENDPOINT)
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
+    bindings = select(query)["results"]["bindings"]
 
-    return results
+    return bindings[0]["frame_rate"]["value"] if len(bindings) > 0 else None
 
 
-def get_images(segment, start_frame, end_frame):
-    print("Getting images...")
+def write_video(activity, scene, camera, file):
+    """Writes the video of a camera to a file and returns its size in bytes.
+
+    The base64 literal is decoded while it is being received, so the video is never held in memory.
+    """
+    print("Getting video...")
+
+    query = """
+PREFIX ex: <http://kgrc4si.home.kg/virtualhome2kg/instance/>
+PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
+select ?video where {
+    ex:""" + activity + "_" + scene + "_" + camera + """ vh2kg:video ?video .
+} limit 1
+    """
+
+    return write_base64(get_client().select_value_stream(query), file)
+
+
+def write_base64(chunks, file):
+    """Decodes base64 text arriving in chunks into a file and returns the number of bytes written."""
     import base64
-    import cv2
-    import numpy
-    from SPARQLWrapper import SPARQLWrapper, JSON
-    image_dict = {}
+    import profiling
+
+    size = 0
+    remainder = ""
+    for chunk in chunks:
+        # Only whole groups of 4 characters can be decoded, the rest is decoded with the next chunk.
+        chunk = remainder + "".join(chunk.split())
+        length = len(chunk) - len(chunk) % 4
+        remainder = chunk[length:]
+        with profiling.span("base64.decode") as span:
+            data = base64.b64decode(chunk[:length])
+            span['bytes'] = len(data)
+        with profiling.span("file.write") as span:
+            file.write(data)
+            span['bytes'] = len(data)
+        size += len(data)
+
+    if remainder != "":
+        raise ValueError("The base64 data is truncated")
+    return size
+
+
+def iter_images(segment, start_frame, end_frame, frames_in_flight):
+    """Yields the frames of a segment as `(descriptor, frame_number, split_width, image)`, in order.
+
+    Each frame takes a slot of the semaphore `frames_in_flight` from its first tile on, and the
+    consumer releases it once the frame is written, so the semaphore bounds the frames held in
+    memory all the way to the files. Slots of frames that are not yielded are released here.
+    """
+    print("Getting images...")
+    from collections import deque
+    import images
+    import pipeline
+    pending_frames = deque()
+
+    def complete_frame():
+        # Once popped, the slot of a frame belongs to the consumer, unless the frame cannot be assembled.
+        pending_frame = pending_frames.popleft()
+        try:
+            return images.complete_frame(pending_frame)
+        except BaseException:
+            frames_in_flight.release()
+            raise
 
     query = """
 PREFIX ex: <http://kgrc4si.home.kg/virtualhome2kg/instance/>
@@ -162,145 +401,238 @@ select DISTINCT ?descriptor ?frame_number ?split_width ?image_id ?image where {
     if end_frame is not None:
         query += "filter (?frame_number <= " + str(end_frame) + ")"
 
-    query += "} order by asc(?frame_number) asc(?image_id)"
-
-    sparql = SPARQLWrapper(ENDPOINT)
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
-
-    bindings = results["results"]["bindings"]
-    for result in bindings:
-        frame_number = int(result["frame_number"]["value"])
-        if frame_number < start_frame or end_frame < frame_number:
-            continue
-
-        descriptor = result["descriptor"]["value"].replace(PREFIX_EX, "")
-        split_width = int(result["split_width"]["value"])
-        image_id = result["image_id"]["value"]
-        base64_data = result["image"]["value"]
-        if descriptor not in image_dict:
-            image_dict[descriptor] = {'split_width': split_width, 'frame_number': frame_number, 'images': {}}
-        img_raw = numpy.frombuffer(base64.b64decode(base64_data), numpy.uint8)
-        image = cv2.imdecode(img_raw, cv2.IMREAD_UNCHANGED)
-        image_dict[descriptor]['images'][image_id] = image
-
-    for descriptor in image_dict:
-        image_dict[descriptor]['images'] = dict(sorted(image_dict[descriptor]['images'].items(), key=lambda item: int(item[0])))
-
-    return image_dict
-
-
-def get_annotation_2d_bbox(scene, frame_list):
+    query += "} order by asc(?frame_number) asc(?descriptor) asc(?image_id)"
+
+    # Rows arrive ordered by frame, so a frame is complete as soon as the next one starts. Completed
+    # frames are assembled and handed out in order whenever no slot is free for the next frame.
+    try:
+        for result in get_client().select_stream(query):
+            frame_number = int(result["frame_number"]["value"])
+            if frame_number < start_frame or end_frame < frame_number:
+                continue
+
+            descriptor = result["descriptor"]["value"].replace(PREFIX_EX, "")
+            split_width = int(result["split_width"]["value"])
+            image_id = result["image_id"]["value"]
+            base64_data = result["image"]["value"]
+            if len(pending_frames) == 0 or pending_frames[-1]['descriptor'] != descriptor:
+                # Without held frames, the next frame waits for one of the frames handed out to be written.
+                while not frames_in_flight.acquire(blocking=len(pending_frames) == 0):
+                    yield complete_frame()
+                pending_frames.append({'descriptor': descriptor, 'frame_number': frame_number, 'split_width': split_width, 'tiles': {}})
+            # Tiles are decoded in the background while the next rows are being received.
+            pending_frames[-1]['tiles'][int(image_id)] = pipeline.submit('decode', images.decode_tile, base64_data)
+
+        while len(pending_frames) > 0:
+            yield complete_frame()
+    finally:
+        for _ in pending_frames:
+            frames_in_flight.release()
+
+
+def get_annotation_2d_bbox_batched(scene, frame_list, batch_size=ANNOTATION_BATCH_SIZE):
     print("Getting annotation 2D bbox...")
-    from SPARQLWrapper import SPARQLWrapper, JSON
-    annotation_list = []
+    segment_annotations = {}
 
-    for segment in frame_list:
-        if segment == 'all':
-            continue
+    # Entries of the frame list are keyed by their segment, or by their run of a segment.
+    keys = [key for key in frame_list if key != 'all']
+    for i in range(0, len(keys), batch_size):
+        values = frame_range_values(frame_list, keys[i:i+batch_size])
 
-        start_frame = frame_list[segment]['start_frame']
-        end_frame = frame_list[segment]['end_frame']
         query = """
 PREFIX ex: <http://kgrc4si.home.kg/virtualhome2kg/instance/>
 PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
 PREFIX mssn: <http://mssn.sigappfr.org/mssn/>
-select DISTINCT ?frame_number ?object ?2dbbox  where {
-    ex:""" + segment + """ mssn:hasMediaDescriptor ?descriptor .
+select DISTINCT ?key ?frame_number ?object ?2dbbox  where {
+    VALUES (?key ?segment ?start_frame ?end_frame) {
+""" + values + """    }
+    ?segment mssn:hasMediaDescriptor ?descriptor .
     ?descriptor mssn:hasMediaDescriptor ?descriptor_object ;
                      vh2kg:frameNumber ?frame_number .
     ?descriptor_object vh2kg:bbox-2d-value ?2dbbox ;
                        vh2kg:is2DbboxOf ?object .
+    filter (!bound(?start_frame) || ?frame_number >= ?start_frame)
+    filter (!bound(?end_frame) || ?frame_number <= ?end_frame)
+} order by asc(?frame_number)
 """
-        if start_frame is not None:
-            query += "filter (?frame_number >= " + str(start_frame) + ")"
-        if end_frame is not None:
-            query += "filter (?frame_number <= " + str(end_frame) + ")"
-
-        query += "} order by asc(?frame_number)"
-
-        sparql = SPARQLWrapper(ENDPOINT)
-        sparql.setQuery(query)
-        sparql.setReturnFormat(JSON)
-        results = sparql.query().convert()
 
-        bindings = results["results"]["bindings"]
-        for result in bindings:
+        for result in select_stream(query):
+            key = result["key"]["value"]
             frame_number = result["frame_number"]["value"]
             object = result["object"]["value"].replace(PREFIX_EX, "").replace("_" + scene, "")
             bbox = result["2dbbox"]["value"]
-            annotation_list.append({'frame_number': frame_number, 'object': object, '2dbbox': bbox})
+            segment_annotations.setdefault(key, []).append({'segment': frame_list[key].get('segment', key), 'frame_number': frame_number, 'object': object, '2dbbox': bbox})
+
+    annotation_list = []
+    for key in keys:
+        annotation_list.extend(segment_annotations.get(key, []))
 
     return annotation_list
 
 
-def get_annotation_action(scene, frame_list):
+def get_annotation_action_batched(scene, frame_list, batch_size=ANNOTATION_BATCH_SIZE):
     print("Getting annotation action...")
-    from SPARQLWrapper import SPARQLWrapper, JSON
-    annotation_list = []
+    segment_annotations = {}
 
-    for segment in frame_list:
-        if segment == 'all':
-            continue
+    keys = [key for key in frame_list if key != 'all']
+    for i in range(0, len(keys), batch_size):
+        values = "".join("(\"" + key + "\" <" + PREFIX_EX + frame_list[key].get('segment', key) + ">)\n" for key in keys[i:i+batch_size])
 
-        start_frame = frame_list[segment]['start_frame']
-        end_frame = frame_list[segment]['end_frame']
         query = """
 PREFIX ex: <http://kgrc4si.home.kg/virtualhome2kg/instance/>
 PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
 PREFIX mssn: <http://mssn.sigappfr.org/mssn/>
-select DISTINCT ?action ?main_object ?target_object  where {
-    ex:""" + segment + """ vh2kg:isVideoSegmentOf ?event .
+select DISTINCT ?key ?action ?main_object ?target_object  where {
+    VALUES (?key ?segment) {
+""" + values + """    }
+    ?segment vh2kg:isVideoSegmentOf ?event .
     ?event vh2kg:action ?action ;
            vh2kg:mainObject ?main_object .
     OPTIONAL{?event vh2kg:targetObject ?target_object} .
 }
 """
 
-        sparql = SPARQLWrapper(ENDPOINT)
-        sparql.setQuery(query)
-        sparql.setReturnFormat(JSON)
-        results = sparql.query().convert()
-
-        bindings = results["results"]["bindings"]
-        for result in bindings:
+        for result in select_stream(query):
+            key = result["key"]["value"]
             action = result["action"]["value"].replace(PREFIX_VH2KG, "").replace("action/", " ")
             main_object = result["main_object"]["value"].replace(PREFIX_EX, "").replace("_" + scene, "")
             target_object = result["target_object"]["value"].replace(PREFIX_EX, "").replace("_" + scene, "") if "target_object" in result else ''
-            annotation_list.append({'action': action, 'main_object': main_object, 'target_object': target_object, 'start_frame': start_frame, 'end_frame': end_frame})
+            segment_annotations.setdefault(key, []).append({'segment': frame_list[key].get('segment', key), 'action': action, 'main_object': main_object, 'target_object': target_object, 'start_frame': frame_list[key]['start_frame'], 'end_frame': frame_list[key]['end_frame']})
+
+    annotation_list = []
+    for key in keys:
+        annotation_list.extend(segment_annotations.get(key, []))
 
     return annotation_list
 
 
+def frame_range_values(frame_list, keys):
+    """Rows of `VALUES (?key ?segment ?start_frame ?end_frame)` for the entries of a frame list."""
+    values = ""
+    for key in keys:
+        start_frame = frame_list[key]['start_frame']
+        end_frame = frame_list[key]['end_frame']
+        values += "(\"" + key + "\" <" + PREFIX_EX + frame_list[key].get('segment', key) + "> " + ("UNDEF" if start_frame is None else str(start_frame)) + " " + ("UNDEF" if end_frame is None else str(end_frame)) + ")\n"
+    return values
+
+
+def count_frames_batched(frame_list, batch_size=ANNOTATION_BATCH_SIZE):
+    """Counts the frames, image tiles and 2D bboxes in the frame ranges of a frame list without fetching them."""
+    counts = {'frames': 0, 'tiles': 0, 'bboxes': 0}
+
+    keys = [key for key in frame_list if key != 'all']
+    for i in range(0, len(keys), batch_size):
+        values = frame_range_values(frame_list, keys[i:i+batch_size])
+        prefixes = """
+PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
+PREFIX mssn: <http://mssn.sigappfr.org/mssn/>
+"""
+        frame_pattern = """    VALUES (?key ?segment ?start_frame ?end_frame) {
+""" + values + """    }
+    ?segment mssn:hasMediaDescriptor ?descriptor .
+    ?descriptor vh2kg:frameNumber ?frame_number .
+    filter (!bound(?start_frame) || ?frame_number >= ?start_frame)
+    filter (!bound(?end_frame) || ?frame_number <= ?end_frame)
+"""
+
+        # The tiles and the bboxes of a frame are counted separately, so that they do not multiply each other.
+        result = select(prefixes + """select (COUNT(DISTINCT ?descriptor) as ?frames) (COUNT(?split_image) as ?tiles) where {
+""" + frame_pattern + """    OPTIONAL { ?descriptor vh2kg:image ?split_image }
+}""")["results"]["bindings"][0]
+        counts['frames'] += int(result["frames"]["value"])
+        counts['tiles'] += int(result["tiles"]["value"])
+
+        result = select(prefixes + """select (COUNT(?bbox) as ?bboxes) where {
+""" + frame_pattern + """    ?descriptor mssn:hasMediaDescriptor ?bbox .
+    ?bbox vh2kg:bbox-2d-value [] .
+}""")["results"]["bindings"][0]
+        counts['bboxes'] += int(result["bboxes"]["value"])
+
+    return counts
+
+
+def get_average_tile_size(segments, sample_size=100):
+    """Estimates the size in bytes of an image tile from a sample of the tiles of some segments."""
+    query = """
+PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
+PREFIX mssn: <http://mssn.sigappfr.org/mssn/>
+PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+select (AVG(STRLEN(STR(?image))) as ?size) where {
+    {
+        select ?image where {
+            """ + values_clause("segment", [PREFIX_EX + segment for segment in segments]) + """
+            ?segment mssn:hasMediaDescriptor ?descriptor .
+            ?descriptor vh2kg:image ?split_image .
+            ?split_image rdf:value ?image .
+        } limit """ + str(sample_size) + """
+    }
+}"""
+    bindings = select(query)["results"]["bindings"]
+    if len(bindings) == 0 or "size" not in bindings[0]:
+        return 0
+
+    # Tiles are stored in base64, which takes 4 characters for 3 bytes.
+    return float(bindings[0]["size"]["value"]) * 3 / 4
+
+
+def get_video_sizes(cameras):
+    """Returns the estimated size in bytes and the number of frames of the video of each `(activity, scene, camera)`.
+
+    Only the video of one camera is measured: the sizes of the others are estimated from their
+    number of frames, so the database does not read every video literal to size a search.
+    """
+    camera_iris = {PREFIX_EX + activity + "_" + scene + "_" + camera: (activity, scene, camera) for activity, scene, camera in cameras}
+    video_sizes = {}
+
+    query = """
+PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
+PREFIX mssn: <http://mssn.sigappfr.org/mssn/>
+select ?camera (MAX(?end_frame) as ?last_frame) where {
+    """ + values_clause("camera", list(camera_iris)) + """
+    ?camera mssn:hasMediaSegment ?segment .
+    ?segment vh2kg:hasEndFrame ?end_frame .
+} group by ?camera order by ?camera"""
+    for result in select(query)["results"]["bindings"]:
+        if "last_frame" in result:
+            video_sizes[result["camera"]["value"]] = int(result["last_frame"]["value"]) + 1
+    if len(video_sizes) == 0:
+        return {}
+
+    sample_iri = next(iter(video_sizes))
+    query = """
+PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
+select (STRLEN(STR(?video)) as ?size) where {
+    <""" + sample_iri + """> vh2kg:video ?video .
+} limit 1"""
+    bindings = select(query)["results"]["bindings"]
+    if len(bindings) == 0 or "size" not in bindings[0]:
+        return {}
+    # Videos are stored in base64, which takes 4 characters for 3 bytes.
+    bytes_per_frame = int(bindings[0]["size"]["value"]) * 3 / 4 / video_sizes[sample_iri]
+
+    return {camera_iris[iri]: {'size': int(bytes_per_frame * frames), 'frames': frames} for iri, frames in video_sizes.items()}
+
+
 def get_cameras(action: str, main_object: str, target_object: str | None, camera: str | None):
-    from SPARQLWrapper import SPARQLWrapper, JSON
 
     query = f"""
         PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
         PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
 
         SELECT DISTINCT ?camera WHERE {{
-            ?main_object rdfs:label ?main_object_label FILTER regex(?main_object_label, "{main_object}", "i") .
-            {
-                f'?target_object rdfs:label ?target_object_label FILTER regex(?target_object_label, "{target_object}", "i") .'
-
-                if target_object is not None else ''
-            }
+            {match_object_label('main_object', main_object)}
+            {match_object_label('target_object', target_object) if target_object is not None else ''}
             ?event vh2kg:mainObject ?main_object ;
                  {'vh2kg:targetObject ?target_object ;' if target_object is not None else ''}
                    vh2kg:action ?action .
             ?scene vh2kg:hasEvent ?event ;
                    vh2kg:hasVideo ?camera .
-            FILTER regex(STR(?action), "{action}", "i") .
-            {f'FILTER regex(STR(?camera), "camera{camera}", "i") .' if camera is not None else ''}
+            {match_action(action)}
+            {match_camera(camera) if camera is not None else ''}
         }}
     """
 
-    sparql = SPARQLWrapper(ENDPOINT)
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
+    results = select(query)
 
     bindings = results["results"]["bindings"]
 
@@ -313,7 +645,6 @@ def get_cameras(action: str, main_object: str, target_object: str | None, camera
 
 
 def get_frames_of_video_segment(action: str, main_object: str, target_object: str | None, camera: str | None):
-    from SPARQLWrapper import SPARQLWrapper, JSON
 
     query = f"""
         PREFIX ex: <http://kgrc4si.home.kg/virtualhome2kg/instance/>
@@ -322,30 +653,22 @@ def get_frames_of_video_segment(action: str, main_object: str, target_object: st
         PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
 
         SELECT DISTINCT ?video_segment ?start_frame ?end_frame WHERE {{
-            ?main_object rdfs:label ?main_object_label FILTER regex(?main_object_label, "{main_object}", "i") .
-            {
-                f'?target_object rdfs:label ?target_object_label FILTER regex(?target_object_label, "{target_object}", "i") '
-                if target_object is not None 
-                else ''
-            }
+            {match_object_label('main_object', main_object)}
+            {match_object_label('target_object', target_object) if target_object is not None else ''}
             ?event vh2kg:mainObject ?main_object ;
                     {'vh2kg:targetObject ?target_object ;' if target_object is not None else ''}
                     vh2kg:action ?action ;
                     vh2kg:hasVideoSegment ?video_segment .
             ?video_segment vh2kg:hasStartFrame ?start_frame ;
                         vh2kg:hasEndFrame   ?end_frame .
-            ?camera mssn:hasMediaSegment ?video_segment ;
-                    vh2kg:video ?base64Video ;
-                    vh2kg:frameRate ?frameRate .
-            FILTER regex(STR(?action), "{action}", "i") .
-            {f'FILTER regex(STR(?camera), "camera{camera}", "i") .' if camera is not None else ''}
+            ?camera mssn:hasMediaSegment ?video_segment .
+            FILTER EXISTS {{ ?camera vh2kg:frameRate [] ; vh2kg:video [] }} .
+            {match_action(action)}
+            {match_camera(camera) if camera is not None else ''}
         }}
     """
 
-    sparql = SPARQLWrapper(ENDPOINT)
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
+    results = select(query)
 
     bindings = results["results"]["bindings"]
 
@@ -360,7 +683,6 @@ def get_frames_of_video_segment(action: str, main_object: str, target_object: st
 
 
 def get_object_containing_frames(video_segment_name: str, main_object: str, target_object:str | None):
-    from SPARQLWrapper import SPARQLWrapper, JSON
 
     is_target_object_specified = target_object is not None
     
@@ -372,8 +694,6 @@ def get_object_containing_frames(video_segment_name: str, main_object: str, targ
 
         SELECT DISTINCT ?frame_number WHERE {{ 
             BIND (<{PREFIX_EX + video_segment_name}> AS ?video_segment) .
-            BIND ("{main_object}" AS ?main_object_name) .
-            {f'BIND ("{target_object}" AS ?target_object_name) .' if is_target_object_specified else ''}
             
             ?scene vh2kg:hasVideo ?camera .
             ?scene vh2kg:hasEvent ?event .
@@ -390,31 +710,60 @@ def get_object_containing_frames(video_segment_name: str, main_object: str, targ
             }
             ?frame vh2kg:frameNumber ?frame_number .
             
-            ?main_object rdfs:label ?main_object_label .
-            {'?targetObject rdfs:label ?target_object_label .' if is_target_object_specified else ''}
-            FILTER regex(?main_object_label, ?main_object_name, "i") .
-            {'FILTER regex(?target_object_label, ?target_object_name, "i") .' if is_target_object_specified else ''}
+            {match_object_label('main_object', main_object)}
+            {match_object_label('targetObject', target_object) if is_target_object_specified else ''}
         }}
     """
 
-    sparql = SPARQLWrapper(ENDPOINT)
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
-
-    bindings = results["results"]["bindings"]
-
     frame_lists = []
-    for binding in bindings:
+    for binding in select_stream(query):
         frame_number = int(binding["frame_number"]["value"])
         frame_lists.append({video_segment_name: {'start_frame': frame_number, 'end_frame': frame_number}})
 
     return frame_lists
 
 
+def count_object_containing_frames(video_segment_names: list, main_object: str, target_object: str | None, batch_size=ANNOTATION_BATCH_SIZE):
+    """Counts the frames of the segments in which the objects are visible, like `get_object_containing_frames`, without fetching them."""
+    is_target_object_specified = target_object is not None
+    frame_count = 0
+
+    for i in range(0, len(video_segment_names), batch_size):
+        query = f"""
+        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+        PREFIX mssn: <http://mssn.sigappfr.org/mssn/>
+        PREFIX vh2kg: <http://kgrc4si.home.kg/virtualhome2kg/ontology/>
+        PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+
+        SELECT ?video_segment (COUNT(DISTINCT ?frame_number) AS ?frames) WHERE {{
+            {values_clause("video_segment", [PREFIX_EX + name for name in video_segment_names[i:i+batch_size]])}
+
+            ?scene vh2kg:hasVideo ?camera .
+            ?scene vh2kg:hasEvent ?event .
+            ?event vh2kg:mainObject ?main_object .
+            {'?event vh2kg:targetObject ?targetObject .' if is_target_object_specified else ''}
+
+            ?camera mssn:hasMediaSegment ?video_segment .
+            ?video_segment mssn:hasMediaDescriptor ?frame .
+            ?frame mssn:hasMediaDescriptor ?object .
+            {
+                r'{{?object vh2kg:is2DbboxOf ?main_object} UNION {?object vh2kg:is2DbboxOf ?targetObject}} .'
+                if is_target_object_specified else
+                '?object vh2kg:is2DbboxOf ?main_object .'
+            }
+            ?frame vh2kg:frameNumber ?frame_number .
+
+            {match_object_label('main_object', main_object)}
+            {match_object_label('targetObject', target_object) if is_target_object_specified else ''}
+        }} GROUP BY ?video_segment
+    """
+        frame_count += sum(int(binding["frames"]["value"]) for binding in select(query)["results"]["bindings"])
+
+    return frame_count
+
+
 def get_annotation_2d_bbox_from_object(main_object: str, target_object: str | None, video_segment_name: str):
     print("Getting annotation 2D bbox...")
-    from SPARQLWrapper import SPARQLWrapper, JSON
     annotation_list = []
 
     query = f"""
@@ -425,8 +774,6 @@ def get_annotation_2d_bbox_from_object(main_object: str, target_object: str | No
 
         SELECT DISTINCT ?frame_number ?object ?2dbbox WHERE {{
             BIND (<{PREFIX_EX + video_segment_name}> AS ?video_segment) .
-            BIND ("{main_object}" AS ?main_object_name) .
-            BIND ("{target_object}" AS ?target_object_name) .
             
             ?event vh2kg:hasVideoSegment ?video_segment .
             ?event vh2kg:mainObject ?main_object .
@@ -455,20 +802,12 @@ def get_annotation_2d_bbox_from_object(main_object: str, target_object: str | No
             ?object vh2kg:bbox-2d-value ?2dbbox ;
                     rdfs:label ?label .
             
-            ?main_object rdfs:label ?main_object_label .
-            {'?target_object rdfs:label ?target_object_label .' if target_object is not None else ''}
-            FILTER regex(?main_object_label, ?main_object_name, "i") .
-            {'FILTER regex(?target_object_label, ?target_object_name, "i") .' if target_object is not None else ''}
+            {match_object_label('main_object', main_object)}
+            {match_object_label('target_object', target_object) if target_object is not None else ''}
         }}
     """
 
-    sparql = SPARQLWrapper(ENDPOINT)
-    sparql.setQuery(query)
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
-
-    bindings = results["results"]["bindings"]
-    for result in bindings:
+    for result in select_stream(query):
         frame_number = result["frame_number"]["value"]
         object = result["object"]["value"].replace(PREFIX_EX, "")
         bbox = result["2dbbox"]["value"]
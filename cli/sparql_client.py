@@ -0,0 +1,231 @@
+import csv
+import http.client
+import io
+import json
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+import profiling
+
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 600
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+
+# Large literals such as videos are streamed in chunks of this many characters.
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Failures after which a query can be sent again on a fresh connection. Queries never modify the
+# repository, so every request is idempotent. A query that timed out is not sent again, since it
+# would most likely time out again after as long.
+RETRYABLE_ERRORS = (ConnectionResetError, ConnectionAbortedError, BrokenPipeError, http.client.HTTPException)
+RETRYABLE_STATUSES = (502, 503, 504)
+
+# Result rows may contain whole base64 images.
+csv.field_size_limit(sys.maxsize)
+
+
+class SparqlError(Exception):
+    pass
+
+
+class ConnectTimeoutError(ConnectionAbortedError, TimeoutError):
+    """The connection to the endpoint timed out, which unlike a read timeout is worth trying again."""
+
+
+class SparqlClient:
+    """SPARQL protocol client which keeps one persistent HTTP connection per thread.
+
+    Connections are reused across queries (HTTP keep-alive), connect and read timeouts are
+    applied separately, and failed requests are retried with exponential backoff.
+    """
+
+    def __init__(self, endpoint: str, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT, read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF):
+        url = urlsplit(endpoint)
+        self.endpoint = endpoint
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port
+        self.path = url.path
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection_class = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            connection = connection_class(self.host, self.port, timeout=self.connect_timeout)
+            try:
+                connection.connect()
+            except TimeoutError as e:
+                raise ConnectTimeoutError("Connecting to " + self.endpoint + " timed out") from e
+            connection.sock.settimeout(self.read_timeout)
+            self.local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+    def retrying(self, function):
+        attempt = 0
+        while True:
+            try:
+                return function()
+            except RETRYABLE_ERRORS:
+                # The connection may be half-closed, so the next attempt starts on a new one.
+                self.close()
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+            except TimeoutError:
+                # The response may still arrive on the connection, so it cannot be reused.
+                self.close()
+                raise
+
+    def request(self, method: str, path: str, body: bytes | None = None, headers: dict | None = None):
+        connection = self.connection()
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        if response.status in RETRYABLE_STATUSES:
+            response.read()
+            raise http.client.HTTPException("HTTP " + str(response.status))
+        if response.status != 200:
+            raise SparqlError("HTTP " + str(response.status) + ": " + response.read().decode(errors='replace'))
+        return response
+
+    def read(self, method: str, path: str, body: bytes | None = None, headers: dict | None = None):
+        return self.retrying(lambda: self.request(method, path, body, headers).read())
+
+    def query(self, query: str, accept: str = "application/sparql-results+json"):
+        return self.read("POST", self.path, urlencode({'query': query}).encode(),
+                         {'Content-Type': "application/x-www-form-urlencoded", 'Accept': accept})
+
+    def select(self, query: str):
+        with profiling.span("sparql.query") as span:
+            data = self.query(query)
+            results = json.loads(data)
+            span['bytes'] = len(data)
+            span['rows'] = len(results["results"]["bindings"])
+        return results
+
+    def select_stream(self, query: str):
+        """Yields the bindings of a SELECT query one by one while the response is still being received.
+
+        The results are requested as SPARQL CSV, so rows are parsed incrementally instead of loading
+        the whole JSON document. Bindings have the same shape as in the JSON format; unbound
+        variables are omitted.
+        """
+        return profiling.iterate("sparql.query", self.stream_rows(query), binding_size)
+
+    def stream_rows(self, query: str):
+        response = self.retrying(lambda: self.request("POST", self.path, urlencode({'query': query}).encode(),
+                                                      {'Content-Type': "application/x-www-form-urlencoded", 'Accept': "text/csv"}))
+        completed = False
+        try:
+            reader = csv.reader(io.TextIOWrapper(response, encoding="utf-8", newline=""))
+            variables = next(reader, [])
+            for row in reader:
+                yield {variable: {'value': value} for variable, value in zip(variables, row) if value != ""}
+            completed = True
+        finally:
+            if not completed:
+                # The rest of the response is still on the connection, so it cannot be reused.
+                self.close()
+
+    def select_value_stream(self, query: str, chunk_size: int = STREAM_CHUNK_SIZE):
+        """Yields the value of the first variable in the first row of a SELECT query in chunks of text
+        while the response is still being received, so that a large literal is never held in memory.
+
+        The results are requested as SPARQL CSV. A value quoted in CSV, e.g. base64 data with line
+        breaks, is unquoted while it is read. Nothing is yielded if there are no results.
+        """
+        return profiling.iterate("sparql.query", self.stream_value(query, chunk_size), len)
+
+    def stream_value(self, query: str, chunk_size: int):
+        response = self.retrying(lambda: self.request("POST", self.path, urlencode({'query': query}).encode(),
+                                                      {'Content-Type': "application/x-www-form-urlencoded", 'Accept': "text/csv"}))
+        completed = False
+        try:
+            reader = io.TextIOWrapper(response, encoding="utf-8", newline="")
+            reader.readline()
+            chunks = iter(lambda: reader.read(chunk_size), "")
+            chunk = next(chunks, "")
+            if chunk.startswith('"'):
+                yield from quoted_field(chunk[1:], chunks)
+            else:
+                yield from unquoted_field(chunk, chunks)
+            # Only the rest of the row is left, which is read so that the connection can be reused.
+            reader.read()
+            completed = True
+        finally:
+            if not completed:
+                self.close()
+
+    def ask(self, query: str):
+        with profiling.span("sparql.query") as span:
+            data = self.query(query)
+            span['bytes'] = len(data)
+        return json.loads(data)["boolean"]
+
+    def get(self, path: str):
+        with profiling.span("sparql.query") as span:
+            data = self.read("GET", self.path + path)
+            span['bytes'] = len(data)
+        return data
+
+
+def unquoted_field(chunk: str, chunks):
+    """Yields the text of an unquoted CSV field, which ends with the field or the row."""
+    while chunk != "":
+        end = min((index for index in (chunk.find(","), chunk.find("\r"), chunk.find("\n")) if index >= 0), default=-1)
+        if end >= 0:
+            if end > 0:
+                yield chunk[:end]
+            return
+        yield chunk
+        chunk = next(chunks, "")
+
+
+def quoted_field(chunk: str, chunks):
+    """Yields the text of a quoted CSV field after its opening quote, with `""` unescaped to `"`."""
+    is_quote_pending = False
+    if chunk == "":
+        chunk = next(chunks, "")
+    while chunk != "":
+        parts = []
+        index = 0
+        while index < len(chunk):
+            if is_quote_pending:
+                is_quote_pending = False
+                if chunk[index] != '"':
+                    # A quote not followed by another one closes the field.
+                    if len(parts) > 0:
+                        yield "".join(parts)
+                    return
+                parts.append('"')
+                index += 1
+                continue
+            quote = chunk.find('"', index)
+            if quote < 0:
+                parts.append(chunk[index:])
+                break
+            parts.append(chunk[index:quote])
+            index = quote + 1
+            is_quote_pending = True
+        if len(parts) > 0:
+            yield "".join(parts)
+        chunk = next(chunks, "")
+
+
+def binding_size(binding: dict):
+    return sum(len(value['value']) for value in binding.values())
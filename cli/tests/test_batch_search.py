@@ -0,0 +1,33 @@
+import importlib
+
+import segment_index
+
+batch_search = importlib.import_module('batch-search')
+
+
+def test_ranges_of_whole_video_searches_are_resolved_per_camera(monkeypatch):
+    calls = []
+
+    def get_frame_lists(activity, scene, camera, ranges):
+        calls.append((camera, ranges))
+        if camera == 'camera3':
+            raise ConnectionResetError()
+        return [{'all': {'start_frame': start_frame, 'end_frame': end_frame}} for start_frame, end_frame in ranges]
+
+    monkeypatch.setattr(segment_index, 'get_frame_lists', get_frame_lists)
+    entries = [
+        (1, {'activity': "a", 'scene': "s", 'camera': "camera1", 'start': "0", 'end': "9"}),
+        (2, {'activity': "a", 'scene': "s", 'camera': "camera2"}),
+        (3, {'activity': "a", 'scene': "s", 'camera': "camera1", 'start': 5, 'end': 14}),
+        (4, {'activity': "a", 'scene': "s", 'camera': "camera1", 'object': "bread1"}),
+        (5, {'action': "put", 'main_object': "bread"}),
+        (6, {'activity': "a", 'scene': "s", 'camera': "camera3"}),
+        (7, {'activity': "a", 'scene': "s", 'start': 0}),
+    ]
+
+    frame_lists = batch_search.get_frame_lists(entries)
+
+    assert calls == [("camera1", [(0, 9), (5, 14)]), ("camera2", [(None, None)]), ("camera3", [(None, None)])]
+    assert sorted(frame_lists) == [1, 2, 3, 6]
+    assert frame_lists[3] == {'all': {'start_frame': 5, 'end_frame': 14}}
+    assert isinstance(frame_lists[6], ConnectionResetError)
@@ -0,0 +1,58 @@
+import importlib
+
+mmkg_search = importlib.import_module('mmkg-search')
+
+
+def segment_name(camera, segment):
+    return "clean_sink_" + camera[-1] + "_scene1_video_" + segment
+
+
+def run(camera, segment, index, start_frame, end_frame):
+    return segment_name(camera, segment) + "_run" + str(index), {'segment': segment_name(camera, segment), 'start_frame': start_frame, 'end_frame': end_frame}
+
+
+def test_segments_are_aligned_across_cameras():
+    frame_lists = {
+        'camera1': {segment_name('camera1', 'segment0'): {'start_frame': 0, 'end_frame': 20}},
+        'camera2': {segment_name('camera2', 'segment0'): {'start_frame': 5, 'end_frame': 30}},
+    }
+    clips = {camera: {key: camera + "/videos/" + key + ".mp4" for key in frame_list} for camera, frame_list in frame_lists.items()}
+
+    [segment] = mmkg_search.align_segments('scene1', frame_lists, clips)
+
+    assert segment['key'] == 'video_segment0'
+    assert (segment['start_frame'], segment['end_frame']) == (5, 20)
+    assert segment['views']['camera2'] == {'segment': segment_name('camera2', 'segment0'), 'start_frame': 5, 'end_frame': 30,
+                                           'video': "camera2/videos/" + segment_name('camera2', 'segment0') + ".mp4"}
+
+
+def test_runs_are_listed_under_their_segment_when_their_counts_differ():
+    frame_lists = {
+        'camera1': dict([run('camera1', 'segment0', 1, 0, 4), run('camera1', 'segment0', 2, 10, 14), run('camera1', 'segment0', 3, 30, 40)]),
+        'camera2': dict([run('camera2', 'segment0', 1, 12, 35)]),
+    }
+
+    [segment] = mmkg_search.align_segments('scene1', frame_lists, {})
+
+    assert segment['key'] == 'video_segment0'
+    assert [view['runs'] for view in segment['views'].values()] == [
+        [{'run': segment_name('camera1', 'segment0') + "_run1", 'start_frame': 0, 'end_frame': 4},
+         {'run': segment_name('camera1', 'segment0') + "_run2", 'start_frame': 10, 'end_frame': 14},
+         {'run': segment_name('camera1', 'segment0') + "_run3", 'start_frame': 30, 'end_frame': 40}],
+        [{'run': segment_name('camera2', 'segment0') + "_run1", 'start_frame': 12, 'end_frame': 35}],
+    ]
+    assert (segment['views']['camera1']['start_frame'], segment['views']['camera1']['end_frame']) == (0, 40)
+    # The frames of the segment seen by both cameras, not those of the first runs, which do not overlap.
+    assert (segment['start_frame'], segment['end_frame']) == (12, 35)
+
+
+def test_segments_without_common_frames_have_none():
+    frame_lists = {
+        'camera1': dict([run('camera1', 'segment0', 1, 0, 4)]),
+        'camera2': dict([run('camera2', 'segment0', 1, 10, 14), run('camera2', 'segment1', 1, 50, 60)]),
+    }
+
+    segments = mmkg_search.align_segments('scene1', frame_lists, {})
+
+    assert [(segment['key'], segment['start_frame'], segment['end_frame']) for segment in segments] == [
+        ('video_segment0', None, None), ('video_segment1', 50, 60)]
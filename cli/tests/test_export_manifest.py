@@ -0,0 +1,81 @@
+import export_manifest
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+def record(directory, name, data, params):
+    manifest = export_manifest.ExportManifest(str(directory))
+    write(directory / name, data)
+    manifest.record_file(str(directory / name), params)
+    manifest.close()
+
+
+def test_recorded_files_are_complete_for_the_same_parameters(tmp_path):
+    record(tmp_path, "images/a.jpg", b"image", {'segment': "s"})
+
+    manifest = export_manifest.ExportManifest(str(tmp_path))
+    assert manifest.is_file_complete(str(tmp_path / "images/a.jpg"), {'segment': "s"})
+    assert not manifest.is_file_complete(str(tmp_path / "images/a.jpg"), {'segment': "t"})
+    assert not manifest.is_file_complete(str(tmp_path / "images/b.jpg"), {'segment': "s"})
+
+
+def test_files_with_another_size_are_not_complete(tmp_path):
+    record(tmp_path, "a.tsv", b"rows", {})
+    write(tmp_path / "a.tsv", b"row")
+
+    assert not export_manifest.ExportManifest(str(tmp_path)).is_file_complete(str(tmp_path / "a.tsv"), {})
+
+
+def test_files_corrupted_in_place_are_only_found_when_verified(tmp_path):
+    record(tmp_path, "a.tsv", b"rows", {})
+    write(tmp_path / "a.tsv", b"r\0\0\0")
+
+    assert export_manifest.ExportManifest(str(tmp_path)).is_file_complete(str(tmp_path / "a.tsv"), {})
+    assert not export_manifest.ExportManifest(str(tmp_path), verify=True).is_file_complete(str(tmp_path / "a.tsv"), {})
+
+
+def test_nothing_is_complete_without_resume(tmp_path):
+    record(tmp_path, "a.tsv", b"rows", {})
+
+    assert not export_manifest.ExportManifest(str(tmp_path), resume=False).is_file_complete(str(tmp_path / "a.tsv"), {})
+
+
+def test_groups_are_recorded_once_all_their_files_are_saved(tmp_path):
+    manifest = export_manifest.ExportManifest(str(tmp_path))
+    group = manifest.group("images/s", {'segment': "s"})
+    for name in ["a.jpg", "b.jpg"]:
+        write(tmp_path / name, name.encode())
+        group.add(str(tmp_path / name))
+    group.close()
+    manifest.record_file(str(tmp_path / "a.jpg"), {})
+    group.done()
+    assert not manifest.is_group_complete("images/s", {'segment': "s"})
+
+    manifest.record_file(str(tmp_path / "b.jpg"), {})
+    group.done()
+    assert manifest.is_group_complete("images/s", {'segment': "s"})
+    manifest.close()
+
+
+def test_a_cut_off_last_line_is_ignored(tmp_path):
+    record(tmp_path, "a.tsv", b"rows", {})
+    with open(tmp_path / export_manifest.MANIFEST_NAME, "a") as file:
+        file.write('{"name": "b.tsv", "par')
+
+    assert export_manifest.ExportManifest(str(tmp_path)).is_file_complete(str(tmp_path / "a.tsv"), {})
+
+
+def test_the_manifest_is_not_an_output_file(tmp_path):
+    assert not export_manifest.is_output_file(str(tmp_path / export_manifest.MANIFEST_NAME))
+    assert export_manifest.is_output_file(str(tmp_path / "images/a.jpg"))
+
+
+def test_recorded_files_include_files_outside_of_the_output_path(tmp_path):
+    record(tmp_path / "search", "../annotations/a.parquet", b"rows", {})
+    record(tmp_path / "search" / "camera1", "images/a.jpg", b"image", {})
+
+    assert sorted(export_manifest.get_recorded_files(str(tmp_path / "search"))) == [
+        str(tmp_path / "annotations/a.parquet"), str(tmp_path / "search/camera1/images/a.jpg")]
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import numpy
+
+import images
+import pipeline
+import sparql
+
+MAX_FRAMES_IN_FLIGHT = 3
+
+
+class Rows:
+    """Client whose results hold the tiles of frames with two tiles each."""
+
+    def __init__(self, frame_count):
+        self.frame_count = frame_count
+
+    def select_stream(self, query):
+        for frame_number in range(self.frame_count):
+            for image_id in range(2):
+                yield {'descriptor': {'value': sparql.PREFIX_EX + "frame" + str(frame_number)},
+                       'frame_number': {'value': str(frame_number)},
+                       'split_width': {'value': "2"},
+                       'image_id': {'value': str(image_id)},
+                       'image': {'value': str(frame_number)}}
+
+
+def test_frames_are_bounded_until_they_are_written(monkeypatch, tmp_path):
+    lock = threading.Lock()
+    live_frames = set()
+    max_live_frames = 0
+
+    def decode_tile(base64_data):
+        nonlocal max_live_frames
+        with lock:
+            live_frames.add(base64_data)
+            max_live_frames = max(max_live_frames, len(live_frames))
+        return numpy.zeros((4, 4, 3), numpy.uint8)
+
+    def on_saved(image_path):
+        with lock:
+            live_frames.remove(image_path.rsplit("frame", 1)[-1].split(".")[0])
+
+    write_image = images.write_image
+
+    def slow_write_image(*args):
+        # Writes are slower than fetches, so frames pile up unless the bound covers the writes.
+        time.sleep(0.01)
+        write_image(*args)
+
+    pipeline.configure({'write': 1})
+    monkeypatch.setattr(sparql, 'get_client', lambda: Rows(30))
+    monkeypatch.setattr(images, 'decode_tile', decode_tile)
+    monkeypatch.setattr(images, 'write_image', slow_write_image)
+
+    frames_in_flight = threading.BoundedSemaphore(MAX_FRAMES_IN_FLIGHT)
+    for descriptor, _, _, image in sparql.iter_images("segment", 0, 29, frames_in_flight):
+        images.save_image(str(tmp_path / (descriptor + ".jpg")), image, on_saved, frames_in_flight.release)
+    pipeline.wait()
+
+    assert len(list(tmp_path.iterdir())) == 30
+    assert 0 < max_live_frames <= MAX_FRAMES_IN_FLIGHT
+    # All slots are free again.
+    assert all(frames_in_flight.acquire(blocking=False) for _ in range(MAX_FRAMES_IN_FLIGHT))
+
+
+def test_slots_of_frames_that_are_not_handed_out_are_released(monkeypatch):
+    pipeline.configure()
+    monkeypatch.setattr(sparql, 'get_client', lambda: Rows(10))
+    monkeypatch.setattr(images, 'decode_tile', lambda base64_data: numpy.zeros((4, 4, 3), numpy.uint8))
+
+    frames_in_flight = threading.BoundedSemaphore(MAX_FRAMES_IN_FLIGHT)
+    frames = sparql.iter_images("segment", 0, 9, frames_in_flight)
+    next(frames)
+    frames.close()
+    pipeline.wait()
+
+    # Only the slot of the frame handed out is still taken.
+    assert [frames_in_flight.acquire(blocking=False) for _ in range(MAX_FRAMES_IN_FLIGHT)] == [True, True, False]
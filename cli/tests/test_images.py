@@ -0,0 +1,62 @@
+import cv2
+import numpy
+import pytest
+
+import images
+
+
+def write_video(path, frame_count):
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 30, (16, 16))
+    for frame_number in range(frame_count):
+        writer.write(numpy.full((16, 16, 3), frame_number * 10, numpy.uint8))
+    writer.release()
+
+
+def test_tiles_are_placed_row_by_row():
+    tiles = [numpy.full((2, 3), value, numpy.uint8) for value in range(4)]
+
+    frame = images.assemble_frame(tiles, 2)
+
+    assert frame.shape == (4, 6)
+    assert [frame[0, 0], frame[0, 3], frame[2, 0], frame[2, 3]] == [0, 1, 2, 3]
+
+
+def test_the_last_row_and_column_may_be_narrower():
+    tiles = [numpy.ones((2, 3), numpy.uint8), numpy.ones((2, 1), numpy.uint8), numpy.ones((1, 3), numpy.uint8), numpy.ones((1, 1), numpy.uint8)]
+
+    assert images.assemble_frame(tiles, 2).shape == (3, 4)
+
+
+def test_frames_are_handed_to_their_targets(tmp_path):
+    write_video(tmp_path / "video.avi", 10)
+    saved = {}
+
+    images.extract_frames(str(tmp_path / "video.avi"), {index: [lambda image, index=index: saved.setdefault(index, int(image.mean()))] for index in [2, 5, 9]})
+
+    assert sorted(saved) == [2, 5, 9]
+    # The frames are compressed, so their brightness is only close to the one written.
+    assert all(abs(saved[index] - index * 10) <= 3 for index in saved)
+
+
+def test_the_capture_is_released_if_a_frame_cannot_be_handed_on(tmp_path, monkeypatch):
+    write_video(tmp_path / "video.avi", 5)
+    captures = []
+
+    class VideoCapture(cv2.VideoCapture):
+        def __init__(self, path):
+            super().__init__(path)
+            self.is_released = False
+            captures.append(self)
+
+        def release(self):
+            self.is_released = True
+            super().release()
+
+    def save(image):
+        raise RuntimeError("rejected")
+
+    monkeypatch.setattr(cv2, 'VideoCapture', VideoCapture)
+    with pytest.raises(RuntimeError):
+        images.extract_frames(str(tmp_path / "video.avi"), {1: [save]})
+
+    assert [capture.is_released for capture in captures] == [True]
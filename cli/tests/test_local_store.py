@@ -0,0 +1,77 @@
+import pytest
+from rdflib import BNode, Literal, URIRef
+from rdflib.namespace import XSD
+
+import local_store
+
+EX = "http://example.org/"
+TURTLE = """
+@prefix ex: <http://example.org/> .
+@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .
+
+ex:frame1 a ex:Frame ; ex:number 1 ; ex:label "frame"@en ; ex:segment ex:segment1 .
+ex:frame2 a ex:Frame ; ex:number 2 ; ex:label "frame" ; ex:segment ex:segment1 ; ex:bbox [ ex:x 3 ] .
+ex:segment1 a ex:Segment .
+"""
+
+
+@pytest.fixture
+def client(tmp_path):
+    (tmp_path / "rdf").mkdir()
+    (tmp_path / "rdf" / "frames.ttl").write_text(TURTLE)
+    path = str(tmp_path / "store.sqlite3")
+    local_store.compile_store(str(tmp_path / "rdf"), path)
+    return local_store.LocalStoreClient(path)
+
+
+def triples(client, s=None, p=None, o=None):
+    return sorted((triple for triple, _ in client.store.triples((s, p, o))), key=str)
+
+
+def test_triples_are_found_by_every_pattern(client):
+    frame1, number, segment = URIRef(EX + "frame1"), URIRef(EX + "number"), URIRef(EX + "segment")
+
+    assert len(triples(client)) == len(client.store) == 11
+    assert len(triples(client, s=frame1)) == 4
+    assert triples(client, p=number) == [(frame1, number, Literal(1)), (URIRef(EX + "frame2"), number, Literal(2))]
+    assert len(triples(client, o=URIRef(EX + "segment1"))) == 2
+    assert triples(client, s=frame1, p=segment) == [(frame1, segment, URIRef(EX + "segment1"))]
+    assert triples(client, p=number, o=Literal(2)) == [(URIRef(EX + "frame2"), number, Literal(2))]
+    assert triples(client, s=frame1, p=number, o=Literal(1)) == [(frame1, number, Literal(1))]
+
+
+def test_literals_keep_their_datatype_and_language(client):
+    label = URIRef(EX + "label")
+
+    assert triples(client, p=label, o=Literal("frame", lang="en")) == [(URIRef(EX + "frame1"), label, Literal("frame", lang="en"))]
+    assert triples(client, p=label, o=Literal("frame")) == [(URIRef(EX + "frame2"), label, Literal("frame"))]
+    assert triples(client, p=URIRef(EX + "number"), o=Literal("1", datatype=XSD.string)) == []
+    assert triples(client, s=URIRef(EX + "frame1"), p=URIRef(EX + "number"))[0][2].datatype == XSD.integer
+
+
+def test_blank_nodes_are_kept(client):
+    (_, _, bbox), = triples(client, p=URIRef(EX + "bbox"))
+
+    assert isinstance(bbox, BNode)
+    assert triples(client, s=bbox) == [(bbox, URIRef(EX + "x"), Literal(3))]
+
+
+def test_unknown_terms_match_nothing(client):
+    assert triples(client, s=URIRef(EX + "frame3")) == []
+    assert triples(client, p=URIRef(EX + "number"), o=Literal(3)) == []
+
+
+def test_queries_run_against_the_store(client):
+    result = client.select("""
+PREFIX ex: <http://example.org/>
+SELECT ?frame ?number WHERE { ?frame ex:segment ex:segment1 ; ex:number ?number . OPTIONAL { ?frame ex:bbox ?bbox } } ORDER BY ?number
+""")
+
+    assert result['head']['vars'] == ["frame", "number"]
+    assert result['results']['bindings'] == [
+        {'frame': {'value': EX + "frame1"}, 'number': {'value': "1"}},
+        {'frame': {'value': EX + "frame2"}, 'number': {'value': "2"}},
+    ]
+    assert client.ask("PREFIX ex: <http://example.org/> ASK { ex:frame2 ex:bbox ?bbox }")
+    assert client.get("/size") == b"11"
+    assert "".join(client.select_value_stream('SELECT ?label WHERE { <http://example.org/frame1> <http://example.org/label> ?label }', 2)) == "frame"
@@ -0,0 +1,84 @@
+import argparse
+import threading
+
+import pytest
+
+import pipeline
+
+
+@pytest.fixture
+def tasks():
+    tasks = pipeline.Pipeline({name: 2 for name in pipeline.STAGES})
+    yield tasks
+    for stage in tasks.stages.values():
+        stage.executor.shutdown()
+
+
+def test_jobs_wait_for_the_tasks_their_tasks_submit(tasks):
+    done = []
+    started = threading.Event()
+
+    def write():
+        started.wait()
+        done.append("write")
+
+    def encode():
+        tasks.submit('write', write)
+        done.append("encode")
+
+    with pipeline.job() as job:
+        tasks.submit('encode', encode)
+    # The job is still waited for after its context is left.
+    started.set()
+
+    assert job.wait() == []
+    assert sorted(done) == ["encode", "write"]
+    assert job.finished_at is not None
+
+
+def test_errors_are_kept_by_the_job_of_the_task(tasks):
+    error = ValueError("failed")
+
+    def fail():
+        raise error
+
+    with pipeline.job() as failing_job:
+        tasks.submit('fetch', fail)
+    with pipeline.job() as other_job:
+        tasks.submit('fetch', lambda: None)
+
+    assert failing_job.wait() == [error]
+    assert failing_job.wait() == []
+    assert other_job.wait() == []
+    # Errors of jobs are not kept by the pipeline, which a long-running server never drains.
+    tasks.wait()
+
+
+def test_errors_of_tasks_without_a_job_are_raised_by_the_pipeline(tasks):
+    def fail():
+        raise ValueError("failed")
+
+    tasks.submit('fetch', fail)
+
+    with pytest.raises(ValueError):
+        tasks.wait()
+
+
+def test_failed_submits_finish_their_tasks(tasks, monkeypatch):
+    def submit(function, *args):
+        raise RuntimeError("cannot schedule new futures after shutdown")
+
+    monkeypatch.setattr(tasks.stages['write'], 'submit', submit)
+    with pipeline.job() as job:
+        with pytest.raises(RuntimeError):
+            tasks.submit('write', lambda: None)
+
+    assert job.wait() == []
+    assert tasks.all_tasks.unfinished_tasks == 0
+
+
+def test_jobs_are_parsed_by_stage():
+    assert pipeline.parse_jobs([pipeline.parse_job("fetch=8"), pipeline.parse_job("encode=2")]) == {'fetch': 8, 'encode': 2}
+    for value in ("fetch", "fetch=0", "upload=2"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            pipeline.parse_job(value)
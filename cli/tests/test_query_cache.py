@@ -0,0 +1,99 @@
+import time
+
+import query_cache
+
+
+def cache(tmp_path, **options):
+    cache = query_cache.QueryCache(str(tmp_path / "queries.sqlite3"), **options)
+    cache.fingerprint = "fingerprint"
+    return cache
+
+
+def counting(result):
+    runs = []
+
+    def run():
+        runs.append(result)
+        return result
+
+    return run, runs
+
+
+def test_whitespace_outside_of_literals_and_iris_is_normalized():
+    query = """
+SELECT ?frame WHERE {
+    ?frame   ex:label  "two  spaces" ;
+           ex:other 'a\\'  b' .
+    FILTER(?frame != <http://example.org/a b>)
+}
+"""
+
+    assert query_cache.normalize_query(query) == "SELECT ?frame WHERE { ?frame ex:label \"two  spaces\" ; ex:other 'a\\'  b' . FILTER(?frame != <http://example.org/a b>) }"
+
+
+def test_results_are_cached_by_normalized_query(tmp_path):
+    results = cache(tmp_path)
+    run, runs = counting({'rows': [1, 2]})
+
+    assert results.get_or_run('select', "SELECT ?s\nWHERE { ?s ?p ?o }", run) == {'rows': [1, 2]}
+    assert results.get_or_run('select', "SELECT ?s WHERE {  ?s ?p ?o  }", run) == {'rows': [1, 2]}
+    assert results.get_or_run('ask', "SELECT ?s WHERE { ?s ?p ?o }", run) == {'rows': [1, 2]}
+    assert len(runs) == 2
+
+
+def test_results_are_keyed_by_the_dataset_fingerprint(tmp_path):
+    results = cache(tmp_path)
+    run, runs = counting([])
+
+    results.get_or_run('select', "SELECT * {}", run)
+    results.fingerprint = "reloaded"
+    results.get_or_run('select', "SELECT * {}", run)
+
+    assert len(runs) == 2
+
+
+def test_expired_results_are_run_again(tmp_path, monkeypatch):
+    results = cache(tmp_path, ttl_days=1)
+    run, runs = counting([])
+    now = time.time()
+
+    monkeypatch.setattr(time, 'time', lambda: now)
+    results.get_or_run('select', "SELECT * {}", run)
+    monkeypatch.setattr(time, 'time', lambda: now + 23 * 60 * 60)
+    results.get_or_run('select', "SELECT * {}", run)
+    assert len(runs) == 1
+
+    monkeypatch.setattr(time, 'time', lambda: now + 25 * 60 * 60)
+    results.get_or_run('select', "SELECT * {}", run)
+    assert len(runs) == 2
+
+
+def test_refreshed_results_are_replaced(tmp_path):
+    run, runs = counting([])
+    cache(tmp_path).get_or_run('select', "SELECT * {}", run)
+
+    cache(tmp_path, refresh=True).get_or_run('select', "SELECT * {}", run)
+
+    assert len(runs) == 2
+
+
+def test_least_recently_used_results_are_evicted(tmp_path, monkeypatch):
+    results = cache(tmp_path, max_size_mb=1)
+    value = "x" * (400 * 1024)
+    now = time.time()
+    runs = []
+
+    def run(name, at):
+        monkeypatch.setattr(time, 'time', lambda: at)
+        return results.get_or_run('select', "SELECT ?" + name + " {}", lambda: runs.append(name) or value)
+
+    run("a", now)
+    run("b", now + 1)
+    # Reading `a` makes `b` the least recently used result.
+    run("a", now + 2)
+    run("c", now + 3)
+    assert runs == ["a", "b", "c"]
+
+    run("a", now + 4)
+    run("b", now + 5)
+    assert runs == ["a", "b", "c", "b"]
@@ -0,0 +1,29 @@
+import importlib
+import threading
+from pathlib import Path
+
+search_server = importlib.import_module('search-server')
+
+
+def test_requests_wait_for_overlapping_output_paths():
+    output_paths = search_server.OutputPaths()
+    started = []
+    events = []
+
+    def request(path):
+        started.append(path)
+        with output_paths.use(Path(path)):
+            events.append(path)
+
+    with output_paths.use(Path("/output/a")):
+        threads = [threading.Thread(target=request, args=(path,)) for path in ["/output/a/b", "/output", "/output/c"]]
+        for thread in threads:
+            thread.start()
+        threads[2].join(timeout=5)
+        # Only the request saving next to the running one went ahead.
+        assert events == ["/output/c"]
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert sorted(events) == ["/output", "/output/a/b", "/output/c"]
+    assert output_paths.paths == []
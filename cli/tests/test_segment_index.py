@@ -0,0 +1,53 @@
+import pytest
+
+import segment_index
+
+SEGMENTS = {
+    'segment0': {'start_frame': 0, 'end_frame': 19},
+    'segment1': {'start_frame': 20, 'end_frame': 39},
+    # A long segment overlapping the next ones.
+    'segment2': {'start_frame': 40, 'end_frame': 100},
+    'segment3': {'start_frame': 50, 'end_frame': 59},
+}
+
+
+@pytest.fixture
+def index(monkeypatch):
+    monkeypatch.setattr(segment_index, '_segment_index', segment_index.SegmentIndex({'clean_sink_scene1_camera1': SEGMENTS}))
+    return segment_index.get_index()
+
+
+def test_overlapping_segments_are_found_in_start_order():
+    intervals = segment_index.IntervalIndex(SEGMENTS)
+
+    assert intervals.overlapping(15, 25) == ['segment0', 'segment1']
+    assert intervals.overlapping(60, 70) == ['segment2']
+    assert intervals.overlapping(55, 55) == ['segment2', 'segment3']
+    assert intervals.overlapping(200, 300) == []
+
+
+def test_missing_bounds_are_the_ends_of_the_video():
+    intervals = segment_index.IntervalIndex(SEGMENTS)
+
+    assert intervals.overlapping(None, 10) == ['segment0']
+    assert intervals.overlapping(95, None) == ['segment2']
+    assert intervals.overlapping(None, None) == list(SEGMENTS)
+
+
+def test_segments_are_clipped_to_the_range():
+    frame_list = segment_index.IntervalIndex({**SEGMENTS, 'segment0': {**SEGMENTS['segment0'], 'segment': "video"}}).clip(10, 25)
+
+    assert frame_list == {'segment0': {'start_frame': 10, 'end_frame': 19, 'segment': "video"}, 'segment1': {'start_frame': 20, 'end_frame': 25}}
+
+
+def test_cameras_without_segments_have_an_empty_index(index):
+    assert index.get('clean_sink', 'scene1', 'camera2').clip(None, None) == {}
+
+
+def test_frame_lists_are_resolved_for_each_range(index):
+    frame_lists = segment_index.get_frame_lists('clean_sink', 'scene1', 'camera1', [(0, 5), (35, 45)])
+
+    assert frame_lists == [
+        {'all': {'start_frame': 0, 'end_frame': 5}, 'segment0': {'start_frame': 0, 'end_frame': 5}},
+        {'all': {'start_frame': 35, 'end_frame': 45}, 'segment1': {'start_frame': 35, 'end_frame': 39}, 'segment2': {'start_frame': 40, 'end_frame': 45}},
+    ]
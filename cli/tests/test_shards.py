@@ -0,0 +1,47 @@
+import json
+import tarfile
+
+import shards
+
+
+def read_index(directory):
+    with open(directory / "index.jsonl") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_samples_are_packed_next_to_each_other_with_their_offsets(tmp_path):
+    writer = shards.ShardWriter(str(tmp_path))
+    writer.add("a", {'jpg': b"image", 'json': b"{}"})
+    writer.add("b", {'jpg': b"image"})
+    writer.close()
+
+    index = read_index(tmp_path)
+    with tarfile.open(tmp_path / "shard-000000.tar") as tar:
+        assert tar.getnames() == ["a.jpg", "a.json", "b.jpg"]
+        assert [member.offset for member in tar.getmembers() if member.name.endswith(".jpg")] == [entry['offset'] for entry in index]
+    assert index[0]['sizes'] == {'jpg': 5, 'json': 2}
+
+
+def test_shards_are_split_at_their_size(tmp_path):
+    writer = shards.ShardWriter(str(tmp_path))
+    writer.max_shard_bytes = 3 * 1024
+    for key in "abc":
+        writer.add(key, {'jpg': b"x" * 1024})
+    writer.close()
+
+    assert [entry['shard'] for entry in read_index(tmp_path)] == ["shard-000000.tar", "shard-000000.tar", "shard-000001.tar"]
+
+
+def test_a_second_run_keeps_the_shards_of_the_first(tmp_path):
+    for key in "ab":
+        writer = shards.ShardWriter(str(tmp_path))
+        writer.add(key, {'jpg': b"image"})
+        writer.close()
+
+    assert [(entry['key'], entry['shard']) for entry in read_index(tmp_path)] == [("a", "shard-000000.tar"), ("b", "shard-000001.tar")]
+    with tarfile.open(tmp_path / "shard-000000.tar") as tar:
+        assert tar.getnames() == ["a.jpg"]
+
+
+def test_bboxes_are_split_into_coordinates():
+    assert shards.bbox_metadata({'object': "bread1", '2dbbox': "1,2,3,4"}) == {'object': "bread1", 'left_x': 1.0, 'top_y': 2.0, 'right_x': 3.0, 'bottom_y': 4.0}
@@ -0,0 +1,77 @@
+import pytest
+
+import sparql_client
+
+
+def client():
+    return sparql_client.SparqlClient("http://localhost:7200/repositories/test", retries=2, backoff=0)
+
+
+def failing(errors):
+    attempts = []
+
+    def function():
+        attempts.append(len(attempts))
+        if len(attempts) <= len(errors):
+            raise errors[len(attempts) - 1]
+        return "result"
+
+    return function, attempts
+
+
+def test_dropped_connections_are_retried():
+    function, attempts = failing([ConnectionResetError(), sparql_client.ConnectTimeoutError()])
+
+    assert client().retrying(function) == "result"
+    assert len(attempts) == 3
+
+
+def test_retries_are_limited():
+    function, attempts = failing([ConnectionResetError()] * 3)
+
+    with pytest.raises(ConnectionResetError):
+        client().retrying(function)
+    assert len(attempts) == 3
+
+
+def test_read_timeouts_are_not_retried():
+    function, attempts = failing([TimeoutError()])
+
+    with pytest.raises(TimeoutError):
+        client().retrying(function)
+    assert len(attempts) == 1
+
+
+def test_query_errors_are_not_retried():
+    function, attempts = failing([sparql_client.SparqlError("HTTP 400")])
+
+    with pytest.raises(sparql_client.SparqlError):
+        client().retrying(function)
+    assert len(attempts) == 1
+
+
+def field(parse, chunks):
+    chunks = iter(chunks)
+    return list(parse(next(chunks, ""), chunks))
+
+
+def test_unquoted_fields_end_with_the_field_or_the_row():
+    assert field(sparql_client.unquoted_field, ["abc,def"]) == ["abc"]
+    assert field(sparql_client.unquoted_field, ["ab", "cd", "e\r\n"]) == ["ab", "cd", "e"]
+    assert field(sparql_client.unquoted_field, ["ab", "\n"]) == ["ab"]
+    assert field(sparql_client.unquoted_field, ["ab", "c"]) == ["ab", "c"]
+    assert field(sparql_client.unquoted_field, [",def"]) == []
+    assert field(sparql_client.unquoted_field, []) == []
+
+
+def test_quoted_fields_are_unquoted():
+    assert "".join(field(sparql_client.quoted_field, ['ab\r\ncd",x'])) == "ab\r\ncd"
+    assert "".join(field(sparql_client.quoted_field, ['say ""hi""",x'])) == 'say "hi"'
+    assert "".join(field(sparql_client.quoted_field, ['",x'])) == ""
+    assert field(sparql_client.quoted_field, ['ab"']) == ["ab"]
+
+
+def test_quotes_are_unescaped_across_chunks():
+    assert "".join(field(sparql_client.quoted_field, ['a"', '"b', '"', ',x'])) == 'a"b'
+    assert "".join(field(sparql_client.quoted_field, ["", 'ab', 'c"', '\r\n'])) == "abc"
+    assert "".join(field(sparql_client.quoted_field, ['a"', '""', '"', '"\r\n'])) == 'a""'
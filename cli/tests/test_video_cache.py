@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+import sparql
+import video_cache
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    fetches = []
+
+    def write_video(activity, scene, camera, file):
+        fetches.append(camera)
+        file.write(b"video")
+        return len(b"video")
+
+    monkeypatch.setattr(sparql, 'get_video_frame_rate', lambda activity, scene, camera: 30.0 if camera != "missing" else None)
+    monkeypatch.setattr(sparql, 'write_video', write_video)
+    return fetches
+
+
+def cache(directory, max_size_mb):
+    cache = video_cache.VideoCache(directory, max_size_mb)
+    cache.fingerprint = "fingerprint"
+    return cache
+
+
+def add_video(cache, name, size, accessed):
+    path = os.path.join(cache.directory, name + ".mp4")
+    with open(path, "wb") as file:
+        file.write(b"\0" * size)
+    with open(os.path.join(cache.directory, name + ".json"), "w") as file:
+        file.write("{}")
+    os.utime(path, (accessed, accessed))
+    return path
+
+
+def test_cached_videos_are_fetched_once(tmp_path, fetches):
+    videos = cache(str(tmp_path), 1)
+
+    with videos.get_video("clean_sink", "scene1", "camera1") as video:
+        assert video.frame_rate == 30.0
+        assert os.path.exists(video.path)
+    with videos.get_video("clean_sink", "scene1", "camera1") as video:
+        assert video.frame_rate == 30.0
+
+    assert fetches == ["camera1"]
+    assert videos.pins == {}
+
+
+def test_missing_videos_are_not_pinned(tmp_path, fetches):
+    videos = cache(str(tmp_path), 1)
+
+    assert videos.get_video("clean_sink", "scene1", "missing") is None
+    assert videos.pins == {}
+
+
+def test_least_recently_used_videos_are_evicted(tmp_path):
+    videos = cache(str(tmp_path), 1)
+    oldest = add_video(videos, "oldest", MB // 2, 1000)
+    older = add_video(videos, "older", MB // 2, 2000)
+    newest = add_video(videos, "newest", MB // 2, 3000)
+
+    videos.evict()
+
+    assert [os.path.exists(path) for path in (oldest, older, newest)] == [False, True, True]
+    assert not os.path.exists(oldest[:-len(".mp4")] + ".json")
+
+
+def test_pinned_videos_are_not_evicted(tmp_path):
+    videos = cache(str(tmp_path), 1)
+    oldest = add_video(videos, "oldest", MB // 2, 1000)
+    older = add_video(videos, "older", MB // 2, 2000)
+    newest = add_video(videos, "newest", MB // 2, 3000)
+    videos.pin(oldest)
+
+    videos.evict()
+    assert [os.path.exists(path) for path in (oldest, older, newest)] == [True, False, True]
+
+    videos.unpin(oldest)
+    latest = add_video(videos, "latest", MB // 2, 4000)
+    videos.evict()
+    assert [os.path.exists(path) for path in (oldest, older, newest, latest)] == [False, False, True, True]
+
+
+def test_videos_are_removed_after_use_without_a_cache(fetches):
+    videos = cache(None, 0)
+
+    with videos.get_video("clean_sink", "scene1", "camera1") as first:
+        with videos.get_video("clean_sink", "scene1", "camera1") as second:
+            assert first.path == second.path
+        assert os.path.exists(first.path)
+    assert not os.path.exists(first.path)
+    assert fetches == ["camera1"]
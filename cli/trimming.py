@@ -0,0 +1,163 @@
+import os
+import tempfile
+
+import ffmpeg
+
+import profiling
+
+TRIM_MODES = ['exact', 'copy', 'smart']
+
+# Encoders used to re-encode the boundary GOPs in the codec of the source video.
+ENCODERS = {'h264': 'libx264', 'hevc': 'libx265', 'mpeg4': 'mpeg4', 'vp9': 'libvpx-vp9', 'av1': 'libaom-av1'}
+# Stream parameters compared between the source and the re-encoded GOPs; the extradata holds e.g. the H.264 SPS and PPS.
+STREAM_PARAMETERS = ['codec_name', 'profile', 'pix_fmt', 'width', 'height', 'extradata_hash']
+
+
+def add_arguments(parser):
+    parser.add_argument("--trim-mode", type=str, choices=TRIM_MODES, default='exact',
+                        help="How video segments are cut: 'exact' re-encodes them, 'copy' copies the streams from the preceding keyframe, "
+                             "'smart' copies the streams and re-encodes only the GOPs at the segment boundaries, or the whole segment if they cannot be "
+                             "joined with the source stream (default: exact)")
+
+
+def trim_segments(source_path: str, frame_rate, segments: list, trim_mode: str = 'exact'):
+    """Cuts all segments out of one source video in a single ffmpeg invocation.
+
+    `segments` is a list of `(video_path, start_frame, end_frame)`; a missing start or end frame
+    means the beginning or the end of the video. In 'exact' mode every segment is decoded from its
+    start and re-encoded. In 'copy' mode the streams are copied without decoding, starting at the
+    keyframe before the start frame. In 'smart' mode the frames are exact, but only the boundary
+    GOPs of a segment are re-encoded; the packets between them are copied. Segments whose
+    re-encoded GOPs do not match the parameters of the source stream are re-encoded entirely.
+    """
+    print("Trimming video...")
+    jobs = []
+    for video_path, start_frame, end_frame in segments:
+        if start_frame is not None and start_frame == end_frame:
+            print("ERROR: Cannot trim video to a single frame.")
+            continue
+        start_seconds = 0 if start_frame is None else float(start_frame)/float(frame_rate)
+        end_seconds = None if end_frame is None else float(end_frame)/float(frame_rate)
+        jobs.append((video_path, start_seconds, end_seconds))
+
+    if len(jobs) == 0:
+        return
+
+    if trim_mode == 'exact':
+        run_outputs([reencode(source_path, video_path, start_seconds, end_seconds) for video_path, start_seconds, end_seconds in jobs])
+    else:
+        with profiling.span("ffmpeg.probe") as span:
+            probe = ffmpeg.probe(source_path, select_streams='v:0', show_entries='packet=pts_time,flags', show_data_hash='SHA256')
+            span['bytes'] = os.path.getsize(source_path)
+        keyframes = sorted(float(packet['pts_time']) for packet in probe['packets'] if 'K' in packet['flags'] and packet.get('pts_time') is not None)
+        if trim_mode == 'copy':
+            outputs = []
+            for video_path, start_seconds, end_seconds in jobs:
+                keyframe = max([keyframe for keyframe in keyframes if keyframe <= start_seconds], default=0)
+                outputs.append(copy(source_path, video_path, keyframe, end_seconds))
+            run_outputs(outputs)
+        else:
+            smart_cut(source_path, frame_rate, probe, keyframes, jobs)
+
+    for video_path, _, _ in jobs:
+        print("Video saved to " + video_path)
+
+
+def smart_cut(source_path: str, frame_rate, probe: dict, keyframes: list, jobs: list):
+    half_frame = 0.5/float(frame_rate)
+    video_stream = probe['streams'][0]
+    with tempfile.TemporaryDirectory(prefix="vhakg-trim-") as tmp_directory:
+        outputs = []
+        joins = []
+        for i, (video_path, start_seconds, end_seconds) in enumerate(jobs):
+            # Packets are copied between the first and the last keyframe of the segment. Only the
+            # frames before the first keyframe and from the last keyframe on are re-encoded.
+            inner_keyframes = [keyframe for keyframe in keyframes if keyframe >= start_seconds - half_frame and (end_seconds is None or keyframe < end_seconds - half_frame)]
+            if len(inner_keyframes) == 0:
+                outputs.append(reencode(source_path, video_path, start_seconds, end_seconds, video_stream))
+                continue
+
+            first_keyframe = inner_keyframes[0]
+            last_keyframe = inner_keyframes[-1] if end_seconds is not None else None
+            parts = []
+            reencoded_parts = []
+            if first_keyframe - start_seconds > half_frame:
+                parts.append(os.path.join(tmp_directory, str(i) + "_head.mp4"))
+                reencoded_parts.append(parts[-1])
+                outputs.append(reencode(source_path, parts[-1], start_seconds, first_keyframe, video_stream))
+            if last_keyframe is None or last_keyframe > first_keyframe:
+                parts.append(os.path.join(tmp_directory, str(i) + "_middle.mp4"))
+                outputs.append(copy(source_path, parts[-1], first_keyframe, last_keyframe, exact_end=True))
+            if last_keyframe is not None:
+                parts.append(os.path.join(tmp_directory, str(i) + "_tail.mp4"))
+                reencoded_parts.append(parts[-1])
+                outputs.append(reencode(source_path, parts[-1], last_keyframe, end_seconds, video_stream))
+            joins.append((video_path, parts, reencoded_parts, start_seconds, end_seconds))
+
+        run_outputs(outputs, overwrite=True)
+
+        # The concat demuxer takes the codec parameters of the first part for all of them, so the
+        # copied packets are only decodable if the re-encoded GOPs match the source stream.
+        source_parameters = stream_parameters(video_stream)
+        fallbacks = []
+        for video_path, parts, reencoded_parts, start_seconds, end_seconds in joins:
+            if any(stream_parameters(probe_stream(part)) != source_parameters for part in reencoded_parts):
+                print("WARNING: The re-encoded GOPs of " + video_path + " do not match the source video, so it is re-encoded entirely.")
+                fallbacks.append(reencode(source_path, video_path, start_seconds, end_seconds))
+        if len(fallbacks) > 0:
+            run_outputs(fallbacks, overwrite=True)
+        fallback_paths = {output.node.kwargs['filename'] for output in fallbacks}
+        joins = [(video_path, parts) for video_path, parts, _, _, _ in joins if video_path not in fallback_paths]
+
+        for i, (video_path, parts) in enumerate(joins):
+            list_path = os.path.join(tmp_directory, str(i) + ".txt")
+            with open(list_path, "w") as file:
+                file.writelines("file '" + part + "'\n" for part in parts)
+            with profiling.span("ffmpeg.run") as span:
+                ffmpeg.input(list_path, format='concat', safe=0).output(video_path, c='copy').run()
+                span['bytes'] = os.path.getsize(video_path)
+
+
+def probe_stream(video_path: str):
+    with profiling.span("ffmpeg.probe") as span:
+        stream = ffmpeg.probe(video_path, select_streams='v:0', show_data_hash='SHA256')['streams'][0]
+        span['bytes'] = os.path.getsize(video_path)
+    return stream
+
+
+def stream_parameters(stream: dict):
+    """Returns the parameters of a video stream that have to be equal for its packets to be joined with another's."""
+    return {key: stream.get(key) for key in STREAM_PARAMETERS}
+
+
+def reencode(source_path: str, video_path: str, start_seconds: float, end_seconds: float | None, video_stream: dict | None = None):
+    # The input is seeked, so decoding starts near the start of the segment instead of the beginning of the video.
+    input_options = {'ss': start_seconds}
+    if end_seconds is not None:
+        input_options['to'] = end_seconds
+    options = {}
+    if video_stream is not None:
+        # The re-encoded GOP is joined with copied packets, so it has to match the source stream.
+        options['vcodec'] = ENCODERS.get(video_stream['codec_name'], video_stream['codec_name'])
+        options['pix_fmt'] = video_stream['pix_fmt']
+        options['video_track_timescale'] = video_stream['time_base'].split('/')[1]
+    return ffmpeg.input(source_path, **input_options).output(video_path, **options)
+
+
+def copy(source_path: str, video_path: str, start_seconds: float, end_seconds: float | None, exact_end: bool = False):
+    options = {}
+    if end_seconds is not None:
+        options['t'] = end_seconds - start_seconds
+        if exact_end:
+            # Packets decoded before the end keyframe but shown after it would otherwise be kept.
+            options['bsf:v'] = "noise=drop=gte(pts*tb\\,{:.6f})".format(end_seconds - start_seconds - 0.001)
+    return ffmpeg.input(source_path, ss=start_seconds).output(video_path, c='copy', avoid_negative_ts='make_zero', **options)
+
+
+def run_outputs(outputs: list, overwrite: bool = False):
+    stream = ffmpeg.merge_outputs(*outputs)
+    if overwrite:
+        stream = stream.overwrite_output()
+    with profiling.span("ffmpeg.run") as span:
+        stream.run()
+        span['bytes'] = sum(os.path.getsize(output.node.kwargs['filename']) for output in outputs if os.path.exists(output.node.kwargs['filename']))
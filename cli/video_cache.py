@@ -0,0 +1,179 @@
+import atexit
+import collections
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "vhakg-tools", "videos")
+DEFAULT_MAX_SIZE_MB = 10240
+
+
+class PinnedVideo:
+    """A cached video, which is not evicted until `close()` is called or its context is left.
+
+    It is handed from the task that fetched it to the task that reads it, so a video is fetched
+    only once per use even if the cache is full or disabled.
+    """
+
+    def __init__(self, cache, path: str, frame_rate):
+        self.cache = cache
+        self.path = path
+        self.frame_rate = frame_rate
+        self.closed = False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.cache.unpin(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class VideoCache:
+    """On-disk store of decoded camera videos with a size-bounded LRU eviction policy.
+
+    Entries are keyed by `activity_scene_camera` and the dataset fingerprint, so a reloaded
+    repository never serves stale videos. The modification time of an entry is its last access time.
+    """
+
+    def __init__(self, directory: str | None = DEFAULT_DIRECTORY, max_size_mb: int = DEFAULT_MAX_SIZE_MB):
+        if directory is None or max_size_mb <= 0:
+            # Nothing is persisted: keep only the videos in use in a directory removed on exit.
+            directory = tempfile.mkdtemp(prefix="vhakg-videos-")
+            atexit.register(shutil.rmtree, directory, True)
+            max_size_mb = 0
+
+        self.directory = directory
+        self.max_bytes = max_size_mb * 1024 * 1024
+        self.fingerprint = None
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.pins = collections.Counter()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def paths(self, activity: str, scene: str, camera: str):
+        import sparql
+
+        with self.lock:
+            if self.fingerprint is None:
+                self.fingerprint = sparql.get_dataset_fingerprint()
+
+        name = activity + "_" + scene + "_" + camera
+        key = hashlib.sha256((name + "@" + self.fingerprint).encode()).hexdigest()
+        return name, os.path.join(self.directory, key + ".mp4"), os.path.join(self.directory, key + ".json")
+
+    def pin(self, video_path: str):
+        with self.lock:
+            self.pins[video_path] += 1
+
+    def unpin(self, video_path: str):
+        with self.lock:
+            self.pins[video_path] -= 1
+            if self.pins[video_path] > 0:
+                return
+            del self.pins[video_path]
+        if self.max_bytes == 0:
+            # Without a cache, a video is removed as soon as it is no longer used.
+            self.evict()
+
+    def get_video(self, activity: str, scene: str, camera: str):
+        """Returns the video of a camera as a `PinnedVideo`, which the caller has to close, or None if there is none."""
+        name, video_path, metadata_path = self.paths(activity, scene, camera)
+        with self.lock:
+            key_lock = self.key_locks.setdefault(video_path, threading.Lock())
+
+        self.pin(video_path)
+        try:
+            # Different videos are fetched concurrently, the same video only once.
+            with key_lock:
+                frame_rate = self.fetch(activity, scene, camera)
+        except BaseException:
+            self.unpin(video_path)
+            raise
+        if frame_rate is None:
+            self.unpin(video_path)
+            return None
+        return PinnedVideo(self, video_path, frame_rate)
+
+    def fetch(self, activity: str, scene: str, camera: str):
+        import sparql
+
+        name, video_path, metadata_path = self.paths(activity, scene, camera)
+        if os.path.exists(video_path) and os.path.exists(metadata_path):
+            print("Using cached video for " + name + "...")
+            os.utime(video_path)
+            with open(metadata_path) as file:
+                return json.load(file)['frame_rate']
+
+        frame_rate = sparql.get_video_frame_rate(activity, scene, camera)
+        if frame_rate is None:
+            return None
+
+        # Write next to the final location and rename, so concurrent processes never see partial files.
+        tmp_file = tempfile.NamedTemporaryFile(dir=self.directory, suffix=".part", delete=False)
+        try:
+            with tmp_file:
+                size = sparql.write_video(activity, scene, camera, tmp_file)
+            if size == 0:
+                os.remove(tmp_file.name)
+                return None
+            os.replace(tmp_file.name, video_path)
+        except BaseException:
+            if os.path.exists(tmp_file.name):
+                os.remove(tmp_file.name)
+            raise
+        with open(metadata_path, "w") as file:
+            json.dump({'name': name, 'fingerprint': self.fingerprint, 'frame_rate': frame_rate}, file)
+
+        self.evict()
+        return frame_rate
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            for file_name in os.listdir(self.directory):
+                if not file_name.endswith(".mp4"):
+                    continue
+                path = os.path.join(self.directory, file_name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_size <= self.max_bytes:
+                    break
+                if path in self.pins:
+                    continue
+                os.remove(path)
+                metadata_path = path[:-len(".mp4")] + ".json"
+                if os.path.exists(metadata_path):
+                    os.remove(metadata_path)
+                total_size -= size
+
+
+_video_cache = None
+
+
+def configure(directory: str | None = DEFAULT_DIRECTORY, max_size_mb: int = DEFAULT_MAX_SIZE_MB):
+    global _video_cache
+    _video_cache = VideoCache(directory, max_size_mb)
+
+
+def add_arguments(parser):
+    parser.add_argument("--video-cache-dir", type=str, default=DEFAULT_DIRECTORY,
+                        help="The directory of the local video cache (default: " + DEFAULT_DIRECTORY + ")")
+    parser.add_argument("--video-cache-size", type=int, default=DEFAULT_MAX_SIZE_MB,
+                        help="The size budget of the local video cache in MB, 0 disables it (default: " + str(DEFAULT_MAX_SIZE_MB) + ")")
+
+
+def get_video(activity: str, scene: str, camera: str):
+    if _video_cache is None:
+        configure()
+    return _video_cache.get_video(activity, scene, camera)
@@ -0,0 +1,68 @@
+import json
+import os
+import re
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "vhakg-tools", "vocabulary")
+
+
+class VocabularyIndex:
+    """Local index of the action IRIs, object labels and camera IRIs of the knowledge graph.
+
+    User input is resolved against the index with the same partial, case-insensitive matching
+    as the `regex(..., "i")` filters, so queries can bind exact IRIs with `VALUES` instead.
+    """
+
+    def __init__(self, actions: list, objects: dict, cameras: list):
+        self.actions = actions
+        self.objects = objects
+        self.cameras = cameras
+
+    @classmethod
+    def load(cls, directory: str = DEFAULT_DIRECTORY):
+        import sparql
+
+        path = os.path.join(directory, sparql.get_dataset_fingerprint() + ".json")
+        if os.path.exists(path):
+            with open(path) as file:
+                vocabulary = json.load(file)
+        else:
+            print("Building the vocabulary index...")
+            vocabulary = sparql.get_vocabulary()
+            os.makedirs(directory, exist_ok=True)
+            with open(path + ".part", "w") as file:
+                json.dump(vocabulary, file)
+            os.replace(path + ".part", path)
+
+        return cls(vocabulary['actions'], vocabulary['objects'], vocabulary['cameras'])
+
+    def resolve_actions(self, action: str):
+        return [iri for iri in self.actions if re.search(action, iri, re.IGNORECASE)]
+
+    def resolve_objects(self, name: str):
+        iris = set()
+        for label, object_iris in self.objects.items():
+            if re.search(name, label, re.IGNORECASE):
+                iris.update(object_iris)
+        return sorted(iris)
+
+    def resolve_cameras(self, camera: str):
+        return [iri for iri in self.cameras if re.search("camera" + camera, iri, re.IGNORECASE)]
+
+
+_vocabulary_index = None
+
+
+def configure(enabled: bool, directory: str = DEFAULT_DIRECTORY):
+    global _vocabulary_index
+    _vocabulary_index = VocabularyIndex.load(directory) if enabled else None
+
+
+def add_arguments(parser):
+    parser.add_argument("--vocabulary-index", action='store_true',
+                        help="Resolve the action, objects and camera against a local vocabulary index and search with exact IRIs")
+    parser.add_argument("--vocabulary-index-dir", type=str, default=DEFAULT_DIRECTORY,
+                        help="The directory of the local vocabulary index (default: " + DEFAULT_DIRECTORY + ")")
+
+
+def get_index():
+    return _vocabulary_index